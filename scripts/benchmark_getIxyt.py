@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Benchmark of the detector cube extraction.
+
+Loads the cross-sections of a run, rebins them with the default TOF binning, and times
+data_set.getIxyt against the previous builder, which read the spectra one pixel at a time,
+checking that both give the same cubes.
+
+Usage: python scripts/benchmark_getIxyt.py /path/to/REF_M_42112.nxs.h5
+"""
+
+import argparse
+import time
+
+import mantid.simpleapi as api
+import numpy as np
+
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.data_set import getIxyt
+
+
+def _getIxyt_per_pixel(nxs_data):
+    """Cube builder before the bulk extraction, reading one spectrum at a time"""
+    n_y = int(nxs_data.getInstrument().getNumberParameter("number-of-y-pixels")[0])
+    n_x = int(nxs_data.getInstrument().getNumberParameter("number-of-x-pixels")[0])
+    n_tof = nxs_data.blocksize()
+    _y = np.zeros((n_x, n_y, n_tof))
+    _e = np.zeros((n_x, n_y, n_tof))
+    for x in range(n_x):
+        for y in range(n_y):
+            _y[x, y, :] = nxs_data.readY(n_y * x + y)[:]
+            _e[x, y, :] = nxs_data.readE(n_y * x + y)[:]
+    return _y, _e
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("file_path", help="event file of the run")
+    args = parser.parse_args()
+
+    conf = Configuration()
+    ws_list = conf.instrument.load_data(args.file_path, conf)
+    tof_edges = np.arange(ws_list[0].getTofMin(), ws_list[0].getTofMax(), conf.tof_bins)
+    binning_ws = api.CreateWorkspace(DataX=tof_edges, DataY=np.zeros(len(tof_edges) - 1))
+    rebinned = [api.RebinToWorkspace(WorkspaceToRebin=ws, WorkspaceToMatch=binning_ws) for ws in ws_list]
+
+    t_0 = time.time()
+    reference = [_getIxyt_per_pixel(ws) for ws in rebinned]
+    t_loop = time.time() - t_0
+
+    t_0 = time.time()
+    cubes = [getIxyt(ws) for ws in rebinned]
+    t_bulk = time.time() - t_0
+
+    same = all(
+        np.array_equal(counts, ref_counts) and np.array_equal(errors, ref_errors)
+        for (counts, errors), (ref_counts, ref_errors) in zip(cubes, reference)
+    )
+    print("getIxyt for %d cross-sections" % len(rebinned))
+    print("  per-pixel: %.3f sec" % t_loop)
+    print("  bulk:      %.3f sec" % t_bulk)
+    print("  speed-up: %.1f, same cubes: %s" % (t_loop / t_bulk, same))
+
+
+if __name__ == "__main__":
+    main()
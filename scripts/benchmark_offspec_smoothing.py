@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Benchmark of the off-specular smoothing engines.
+
+Compares the KD-tree smoothing (off_specular.smooth_data_kdtree) with the brute-force
+grid scan (off_specular._smooth_data) on random data, for several grid sizes and numbers
+of data points, and checks that both give the same output.
+
+Usage: python scripts/benchmark_offspec_smoothing.py [--points 100000 1000000] [--skip-brute-force]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from quicknxs.interfaces.data_handling import off_specular
+
+GRIDS = [(50, 20), (150, 50), (300, 100)]
+
+
+def _random_data(n_points, seed=42):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-0.03, 0.03, n_points)
+    y = rng.uniform(0.0, 0.1, n_points)
+    intensity = rng.exponential(1.0, n_points)
+    return x, y, intensity
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--points", type=int, nargs="+", default=[100000, 1000000], help="numbers of data points")
+    parser.add_argument("--skip-brute-force", action="store_true", help="only time the KD-tree smoothing")
+    args = parser.parse_args()
+
+    print("%10s %10s %12s %12s %10s %10s" % ("points", "grid", "brute [s]", "kd-tree [s]", "speed-up", "max diff"))
+    for n_points in args.points:
+        x, y, intensity = _random_data(n_points)
+        for gridx, gridy in GRIDS:
+            options = dict(gridx=gridx, gridy=gridy, axis_sigma_scaling=2, xysigma0=0.05)
+            t_0 = time.perf_counter()
+            _, _, smoothed = off_specular.smooth_data_kdtree(x, y, intensity, **options)
+            kdtree_time = time.perf_counter() - t_0
+            if args.skip_brute_force:
+                print("%10d %10s %12s %12.3f" % (n_points, "%dx%d" % (gridx, gridy), "-", kdtree_time))
+                continue
+            t_0 = time.perf_counter()
+            _, _, reference = off_specular._smooth_data(x, y, intensity, indices=[0, gridx], **options)
+            brute_time = time.perf_counter() - t_0
+            print(
+                "%10d %10s %12.3f %12.3f %10.1f %10.2g"
+                % (
+                    n_points,
+                    "%dx%d" % (gridx, gridy),
+                    brute_time,
+                    kdtree_time,
+                    brute_time / kdtree_time,
+                    np.max(np.abs(smoothed - reference)),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
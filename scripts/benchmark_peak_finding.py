@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Benchmark of the automatic peak search over many runs.
+
+Scans the x-projections of all the cross-sections of a set of simulated runs, first one
+projection at a time with the pure-Python SciPy 1.1 backport (peak_finding._backport_*),
+then in a single call to data_info.scan_x_profiles, and checks that both find the same peaks.
+
+Usage: python scripts/benchmark_peak_finding.py [--runs 40] [--cross-sections 4]
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy import ndimage
+
+from quicknxs.interfaces.data_handling import peak_finding
+from quicknxs.interfaces.data_handling.data_info import scan_x_profiles
+
+
+def _random_profiles(n_profiles, n_x=304, seed=42):
+    rng = np.random.default_rng(seed)
+    x = np.arange(n_x)
+    centers = rng.uniform(80, 220, n_profiles)
+    heights = rng.uniform(10, 5000, n_profiles)
+    signal = heights[:, np.newaxis] * np.exp(-((x - centers[:, np.newaxis]) ** 2) / 30.0)
+    return rng.poisson(signal + rng.uniform(1, 50, (n_profiles, 1))).astype(float)
+
+
+def _backport_peaks(profile):
+    """Peak positions, prominences and widths of one projection, as found before the batch scan"""
+    smoothed = ndimage.gaussian_filter(profile, 3)
+    peaks, _ = peak_finding._backport_find_peaks(smoothed)
+    prominences, _, _ = peak_finding._backport_peak_prominences(smoothed, peaks)
+    widths, _, _, _ = peak_finding._backport_peak_widths(smoothed, peaks)
+    return peaks, prominences, widths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=40, help="number of runs")
+    parser.add_argument("--cross-sections", type=int, default=4, help="number of cross-sections per run")
+    args = parser.parse_args()
+
+    profiles = _random_profiles(args.runs * args.cross_sections)
+
+    t_0 = time.time()
+    reference = [_backport_peaks(profile) for profile in profiles]
+    t_backport = time.time() - t_0
+
+    t_0 = time.time()
+    results = scan_x_profiles(profiles)
+    t_batch = time.time() - t_0
+
+    n_same = sum(
+        sorted(found_peaks) == sorted(peaks.tolist()) for (found_peaks, _), (peaks, _, _) in zip(results, reference)
+    )
+    print("%d projections (%d runs)" % (len(profiles), args.runs))
+    print("  backport, one at a time: %.4f sec" % t_backport)
+    print("  batch scan:              %.4f sec" % t_batch)
+    print("  speed-up: %.1f, same peaks for %d/%d projections" % (t_backport / t_batch, n_same, len(profiles)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Benchmark of the text export of off-specular and GISANS data.
+
+Compares quicknxs_io.write_reflectivity_data with the previous writer, which called
+np.savetxt for each pixel, on random off-specular data of several sizes, and checks
+that both write the same bytes.
+
+Usage: python scripts/benchmark_text_export.py [--pixels 287] [--tof 200 1000] [--runs 4] [--directory /tmp]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from quicknxs.interfaces.data_handling import quicknxs_io
+
+COLUMNS = ["Qx", "Qz", "ki_z", "kf_z", "ki_z-kf_z", "I", "dI"]
+
+
+def _legacy_write(output_path, data, col_names):
+    """Writer of the [run][pixel][TOF][parameter] data before the bulk formatting"""
+    with open(output_path, "a") as fd:
+        fd.write("# [Data]\n")
+        fd.write("# %s\n" % "\t".join(["%12s" % item for item in col_names[:4]]))
+        for tof_item in data:
+            for pixel_item in tof_item:
+                np.savetxt(fd, pixel_item, delimiter="\t", fmt="%-18e")
+                fd.write("\n")
+
+
+def _random_data(n_runs, n_pixels, n_tof, seed=42):
+    rng = np.random.default_rng(seed)
+    data = []
+    for _ in range(n_runs):
+        run_data = rng.normal(0.0, 0.05, (n_pixels, n_tof, len(COLUMNS)))
+        # Intensities, with empty pixels
+        run_data[:, :, 5:] = rng.exponential(1e-3, (n_pixels, n_tof, 2)) * (rng.random((n_pixels, n_tof, 1)) > 0.2)
+        data.append(run_data)
+    return data
+
+
+def _time_writer(writer, output_path, data):
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    t_0 = time.perf_counter()
+    writer(output_path, data, COLUMNS)
+    return time.perf_counter() - t_0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pixels", type=int, default=287, help="number of pixels of each run")
+    parser.add_argument("--tof", type=int, nargs="+", default=[200, 1000], help="numbers of TOF bins")
+    parser.add_argument("--runs", type=int, default=4, help="number of runs in the file")
+    parser.add_argument("--directory", default=None, help="directory to write the files to")
+    args = parser.parse_args()
+
+    print("%10s %10s %12s %12s %10s %10s" % ("values", "size [MB]", "legacy [s]", "bulk [s]", "speed-up", "identical"))
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        legacy_path = os.path.join(directory, "legacy.dat")
+        bulk_path = os.path.join(directory, "bulk.dat")
+        for n_tof in args.tof:
+            data = _random_data(args.runs, args.pixels, n_tof)
+            legacy_time = _time_writer(_legacy_write, legacy_path, data)
+            bulk_time = _time_writer(quicknxs_io.write_reflectivity_data, bulk_path, data)
+            with open(legacy_path, "rb") as legacy_fd, open(bulk_path, "rb") as bulk_fd:
+                identical = legacy_fd.read() == bulk_fd.read()
+            print(
+                "%10d %10.1f %12.3f %12.3f %10.1f %10s"
+                % (
+                    sum(run_data.size for run_data in data),
+                    os.path.getsize(bulk_path) / 1e6,
+                    legacy_time,
+                    bulk_time,
+                    legacy_time / bulk_time,
+                    identical,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
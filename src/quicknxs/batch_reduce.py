@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Reproduce reductions from QuickNXS reduced files, without the user interface.
+
+Each reduced file is used as a template: the direct beams, data runs and reduction
+parameters it lists are loaded in a DataManager, as when a reduced file is opened in
+the application, and the output files are written by the ProcessingWorkflow.
+Templates are reduced concurrently by a pool of worker processes.
+"""
+
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import mantid.simpleapi as api
+
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.processing_workflow import DEFAULT_OPTIONS, ProcessingWorkflow
+from quicknxs.interfaces.data_manager import DataManager
+
+# Header lines that differ between the files written for the cross-sections of a reduction
+_PER_FILE_HEADER_LINES = ("# Date:", "# Extracted states:")
+
+
+def _reduction_key(file_path):
+    """
+    Header of a QuickNXS reduced file, without the lines specific to one output file,
+    or None if the file is not a QuickNXS reduced file.
+    """
+    lines = []
+    try:
+        with open(file_path, "r") as fd:
+            for line in fd:
+                if not lines and not line.startswith("# Datafile created by QuickNXS"):
+                    return None
+                if line.startswith("# [Data]"):
+                    break
+                if not line.startswith(_PER_FILE_HEADER_LINES):
+                    lines.append(line)
+    except (OSError, UnicodeDecodeError):
+        return None
+    return "".join(lines) if lines else None
+
+
+def find_reduced_files(paths):
+    """
+    List the reduced files to use as templates.
+
+    Directories are searched for .dat files. The files written for each cross-section
+    and output type of the same reduction describe the same reduction, so only the
+    first one of them is listed.
+
+    :param list paths: reduced files and directories
+    :returns: list of file paths
+    """
+    candidates = []
+    for path in paths:
+        if os.path.isdir(path):
+            candidates.extend(sorted(glob.glob(os.path.join(path, "*.dat"))))
+        else:
+            candidates.append(path)
+
+    reduced_files = []
+    keys = set()
+    for file_path in candidates:
+        key = _reduction_key(file_path)
+        if key is None:
+            logging.warning("Skipping %s: not a QuickNXS reduced file", file_path)
+            continue
+        if key not in keys:
+            keys.add(key)
+            reduced_files.append(file_path)
+    return reduced_files
+
+
+def reduce_reduced_file(file_path, output_options):
+    """
+    Reproduce the reduction described by a reduced file and write its outputs.
+
+    :param str file_path: reduced file to use as a template
+    :param dict output_options: ProcessingWorkflow output options
+    :returns: dictionary with the template path, the number of data runs, the time spent
+        in each stage, the exported files and the error message, if any
+    """
+    result = dict(file_path=file_path, n_runs=0, times={}, exported_files=[], error=None)
+    t_0 = time.time()
+    try:
+        data_manager = DataManager(os.path.dirname(os.path.abspath(file_path)))
+        data_manager.load_data_from_reduced_file(file_path, configuration=Configuration())
+        result["times"]["load"] = time.time() - t_0
+        if not data_manager.main_reduction_list:
+            raise RuntimeError("No data could be loaded")
+        result["n_runs"] = sum(len(reduction_list) for reduction_list in data_manager.peak_reduction_lists.values())
+
+        data_manager.set_active_reduction_list_index(data_manager.MAIN_REDUCTION_LIST_INDEX)
+        data_manager.set_active_data_from_reduction_list(0)
+        workflow = ProcessingWorkflow(data_manager, output_options)
+        workflow.execute()
+        for description, elapsed in workflow.timings:
+            # Steps are described as "Peak <index> <output type>"
+            if description.startswith("Peak "):
+                stage = description.split(" ", 2)[-1]
+                result["times"][stage] = result["times"].get(stage, 0) + elapsed
+        result["exported_files"] = workflow.exported_data_files
+    except Exception as error:
+        logging.error("Could not reduce %s\n%s", file_path, traceback.format_exc())
+        result["error"] = str(error)
+    finally:
+        # Worker processes reduce many templates, so release the workspaces of this one
+        api.mtd.clear()
+    result["times"]["total"] = time.time() - t_0
+    return result
+
+
+def _reduce_reduced_file(arguments):
+    """Unpack the arguments of reduce_reduced_file for Pool.imap_unordered"""
+    return reduce_reduced_file(*arguments)
+
+
+def reduce_reduced_files(reduced_files, output_options, processes=1):
+    """
+    Reduce a list of templates, concurrently if more than one process is requested.
+    Results are returned as templates complete.
+
+    :param list reduced_files: reduced files to use as templates
+    :param dict output_options: ProcessingWorkflow output options
+    :param int processes: number of worker processes
+    """
+    tasks = [(file_path, output_options) for file_path in reduced_files]
+    if processes <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield _reduce_reduced_file(task)
+        return
+    # Mantid runs its own threads, so start the workers from a fresh interpreter rather than forking
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(min(processes, len(tasks))) as pool:
+        for result in pool.imap_unordered(_reduce_reduced_file, tasks):
+            yield result
+
+
+def summarize(results, elapsed):
+    """
+    Throughput summary of a batch of reductions
+    :param list results: results returned by reduce_reduced_file
+    :param float elapsed: wall-clock time of the batch, in seconds
+    """
+    succeeded = [result for result in results if result["error"] is None]
+    n_runs = sum(result["n_runs"] for result in succeeded)
+    runs_per_minute = 60.0 * n_runs / elapsed if elapsed > 0 else 0
+    lines = [
+        "Reduced %s of %s templates (%s runs) in %.1f sec: %.2f runs/min"
+        % (len(succeeded), len(results), n_runs, elapsed, runs_per_minute)
+    ]
+    stages = []
+    for result in succeeded:
+        stages.extend(stage for stage in result["times"] if stage not in stages)
+    for stage in stages:
+        times = [result["times"][stage] for result in succeeded if stage in result["times"]]
+        lines.append("  %-14s mean %8.2f sec   total %10.2f sec" % (stage + ":", sum(times) / len(times), sum(times)))
+    for result in results:
+        if result["error"] is not None:
+            lines.append("  FAILED %s: %s" % (result["file_path"], result["error"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="quicknxs-reduce", description="Reproduce reductions from QuickNXS reduced files, without the GUI"
+    )
+    parser.add_argument("paths", nargs="+", help="reduced .dat files, or directories of reduced files")
+    parser.add_argument("-o", "--output-directory", required=True, help="directory to write the output files to")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="number of templates reduced concurrently")
+    parser.add_argument("--template", default=DEFAULT_OPTIONS["output_file_template"], help="output file name template")
+    parser.add_argument("--asym", action="store_true", help="export the spin asymmetry")
+    parser.add_argument("--offspec", action="store_true", help="export the off-specular reflectivity")
+    parser.add_argument("--offspec-binned", action="store_true", help="export the binned off-specular reflectivity")
+    parser.add_argument("--gisans", action="store_true", help="export GISANS")
+    parser.add_argument("--numpy", action="store_true", help="also write the specular data as numpy arrays")
+    parser.add_argument("--matlab", action="store_true", help="also write the specular data in matlab format")
+    parser.add_argument(
+        "--hdf5",
+        action="store_true",
+        help="write each output type in a compressed HDF5 file, instead of ASCII files for off-specular and GISANS",
+    )
+    parser.add_argument("--five-cols", action="store_true", help="write the theta column in the specular files")
+    parser.add_argument("--no-script", action="store_true", help="do not write the Mantid python script")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log the progress of each reduction")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, format="%(levelname)s:%(asctime)-15s %(message)s"
+    )
+
+    output_options = dict(DEFAULT_OPTIONS)
+    output_options.update(
+        export_asym=args.asym,
+        export_offspec=args.offspec,
+        export_offspec_smooth=args.offspec_binned,
+        export_gisans=args.gisans,
+        format_numpy=args.numpy,
+        format_matlab=args.matlab,
+        format_hdf5=args.hdf5,
+        format_5cols=args.five_cols,
+        format_mantid=not args.no_script,
+        output_directory=os.path.abspath(args.output_directory),
+        output_file_template=args.template,
+    )
+    os.makedirs(output_options["output_directory"], exist_ok=True)
+
+    reduced_files = find_reduced_files(args.paths)
+    if not reduced_files:
+        print("No QuickNXS reduced files found")
+        return 1
+
+    t_0 = time.time()
+    results = []
+    for result in reduce_reduced_files(reduced_files, output_options, args.processes):
+        results.append(result)
+        status = "failed" if result["error"] is not None else "%s runs" % result["n_runs"]
+        print(
+            "[%s/%s] %s: %s, %.1f sec"
+            % (len(results), len(reduced_files), result["file_path"], status, result["times"]["total"])
+        )
+    print(summarize(results, time.time() - t_0))
+    return 0 if all(result["error"] is None for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
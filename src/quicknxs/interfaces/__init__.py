@@ -1,11 +1,13 @@
 import os
 
-from PyQt5.uic import loadUi
-
 from quicknxs import ui
 
 
 def load_ui(ui_filename, baseinstance):
+    # Qt is only imported when building the user interface, so that the data
+    # handling modules can be used without it
+    from PyQt5.uic import loadUi
+
     ui_filename = os.path.split(ui_filename)[-1]
     ui_path = os.path.dirname(ui.__file__)
 
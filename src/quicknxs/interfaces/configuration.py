@@ -47,6 +47,40 @@ class Configuration(object):
     # Number of events below which we throw away a workspace
     # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
     nbr_events_min = 100
+    # Directory of the persistent detector cube cache, and its maximum size in GB.
+    # An empty directory turns the cache off.
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    cube_cache_directory = ""
+    cube_cache_max_size = 20.0
+    # Memory budget, in GB, for loaded data sets kept in memory
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    cache_memory_budget = 8.0
+    # Number of runs on each side of the opened run to load ahead of time, or 0 to turn off prefetching
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    prefetch_runs = 0
+    # SQLite file holding the run meta-data index, or an empty string to keep the index in memory
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    run_index_file = ""
+    # Number of cross-sections whose off-specular and GISANS outputs are computed at a time, and of output
+    # files written at a time by the worker pool, or 0 to compute and write them one after the other
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    export_processes = 0
+    # Size of the worker pool used to smooth off-specular data and rebin GISANS data,
+    # or 0 for one process per CPU. Set to 1 to run these calculations in the main process.
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    worker_processes = 0
+    # If True, merge the off-specular and GISANS data of the runs in single precision
+    # and rebin it run by run, rather than merging all the runs first
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    low_memory_merge = False
+    # If True, store the binned detector cubes as uint32 counts, or float32 for weighted events,
+    # and compute the errors of raw counts from the counts when they are needed
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    compact_cubes = False
+    # Fraction of non-zero bins below which the binned detector cubes are stored as sparse arrays,
+    # or 0 to always store dense cubes
+    # Note: not exposed in the UI, but can be modified in ~/.config/.refredm.conf
+    sparse_cube_fill_factor = 0.1
 
     def __init__(self, settings=None):
         self.instrument = Instrument()
@@ -247,6 +281,18 @@ class Configuration(object):
         # Number of events below which we throw away a workspace
         settings.setValue("nbr_events_min", self.nbr_events_min)
 
+        # Persistent cube cache
+        settings.setValue("cube_cache_directory", self.cube_cache_directory)
+        settings.setValue("cube_cache_max_size", self.cube_cache_max_size)
+        settings.setValue("cache_memory_budget", self.cache_memory_budget)
+        settings.setValue("prefetch_runs", self.prefetch_runs)
+        settings.setValue("run_index_file", self.run_index_file)
+        settings.setValue("export_processes", self.export_processes)
+        settings.setValue("worker_processes", self.worker_processes)
+        settings.setValue("low_memory_merge", self.low_memory_merge)
+        settings.setValue("compact_cubes", self.compact_cubes)
+        settings.setValue("sparse_cube_fill_factor", self.sparse_cube_fill_factor)
+
         # Off-specular options
         settings.setValue("off_spec_x_axis", self.off_spec_x_axis)
         settings.setValue("off_spec_slice", self.off_spec_slice)
@@ -355,6 +401,20 @@ class Configuration(object):
         # Number of events below which we throw away a workspace
         Configuration.nbr_events_min = int(settings.value("nbr_events_min", self.nbr_events_min))
 
+        # Persistent cube cache
+        Configuration.cube_cache_directory = str(settings.value("cube_cache_directory", self.cube_cache_directory))
+        Configuration.cube_cache_max_size = float(settings.value("cube_cache_max_size", self.cube_cache_max_size))
+        Configuration.cache_memory_budget = float(settings.value("cache_memory_budget", self.cache_memory_budget))
+        Configuration.prefetch_runs = int(settings.value("prefetch_runs", self.prefetch_runs))
+        Configuration.run_index_file = str(settings.value("run_index_file", self.run_index_file))
+        Configuration.export_processes = int(settings.value("export_processes", self.export_processes))
+        Configuration.worker_processes = int(settings.value("worker_processes", self.worker_processes))
+        Configuration.low_memory_merge = _verify_true("low_memory_merge", self.low_memory_merge)
+        Configuration.compact_cubes = _verify_true("compact_cubes", self.compact_cubes)
+        Configuration.sparse_cube_fill_factor = float(
+            settings.value("sparse_cube_fill_factor", self.sparse_cube_fill_factor)
+        )
+
         # Off-specular options
         self.off_spec_x_axis = int(settings.value("off_spec_x_axis", self.off_spec_x_axis))
         self.off_spec_slice = _verify_true("off_spec_slice", self.off_spec_slice)
@@ -413,6 +473,16 @@ class Configuration(object):
         cls.deadtime_tof_step = 100
         cls.lock_direct_beam_y = False
         cls.nbr_events_min = 100
+        cls.cube_cache_directory = ""
+        cls.cube_cache_max_size = 20.0
+        cls.cache_memory_budget = 8.0
+        cls.prefetch_runs = 0
+        cls.run_index_file = ""
+        cls.export_processes = 0
+        cls.worker_processes = 0
+        cls.low_memory_merge = False
+        cls.compact_cubes = False
+        cls.sparse_cube_fill_factor = 0.1
 
 
 def get_direct_beam_low_res_roi(data_conf, direct_beam_conf):
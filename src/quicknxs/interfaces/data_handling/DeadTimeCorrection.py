@@ -12,7 +12,7 @@ from mantid.api import (
     PythonAlgorithm,
 )
 from mantid.kernel import Direction, FloatArrayLengthValidator, FloatArrayProperty
-from mantid.simpleapi import Rebin, SumSpectra, logger
+from mantid.simpleapi import Plus, Rebin, SumSpectra, logger
 
 
 class SingleReadoutDeadTimeCorrection(PythonAlgorithm):
@@ -69,7 +69,6 @@ class SingleReadoutDeadTimeCorrection(PythonAlgorithm):
         dead_time = self.getProperty("DeadTime").value
         tof_step = self.getProperty("TOFStep").value
         paralyzing = self.getProperty("Paralyzable").value
-        output_workspace = self.getPropertyValue("OutputWorkspace")
 
         # Rebin the data according to the tof_step we want to compute the correction with
         tof_min, tof_max = self.getProperty("TOFRange").value
@@ -81,10 +80,11 @@ class SingleReadoutDeadTimeCorrection(PythonAlgorithm):
             InputWorkspace=ws_event_data,
             Params="%s,%s,%s" % (tof_min, tof_step, tof_max),
             PreserveEvents=False,
+            StoreInADS=False,
         )
 
         # Get the total number of counts on the detector for each TOF bin per pulse
-        counts_ws = SumSpectra(_ws_sc, OutputWorkspace=output_workspace)
+        counts_ws = SumSpectra(_ws_sc, StoreInADS=False)
 
         # If we have error events, add them since those are also detector triggers
         if ws_error_events is not None:
@@ -92,8 +92,9 @@ class SingleReadoutDeadTimeCorrection(PythonAlgorithm):
                 InputWorkspace=ws_error_events,
                 Params="%s,%s,%s" % (tof_min, tof_step, tof_max),
                 PreserveEvents=False,
+                StoreInADS=False,
             )
-            counts_ws += _errors
+            counts_ws = Plus(LHSWorkspace=counts_ws, RHSWorkspace=_errors, StoreInADS=False)
 
         # When operating at a given frequency, the proton charge of the blocked
         # pulsed is zero in the data file, so we don't have to adjust the number of pulses.
@@ -0,0 +1,268 @@
+"""
+Persistent on-disk cache of binned detector cubes.
+
+Event files are immutable, so the products of loading them (the binned (x, y, TOF)
+cubes, the DAS log summary and the peak-finding results) can be kept on disk and
+reused across sessions. Each cached item lives in its own directory under the cache
+root. Arrays are stored as .npy files and memory-mapped when read back.
+
+The cache is opt-in: it is only used when ``Configuration.cube_cache_directory``
+is set.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .filepath import FilePath
+from .serialization import to_json
+
+# Arrays stored for each cross-section
+CUBE_ARRAYS = ["data", "raw_error", "xydata", "xtofdata"]
+# Arrays that may be left out. The errors of compact cubes of raw counts are not stored, see cube_storage.py
+OPTIONAL_CUBE_ARRAYS = ["raw_error"]
+META_FILE = "meta.json"
+
+
+def _file_identity(file_path):
+    """
+    Return a list of (path, size, mtime) for each file making up a (possibly composite) path
+    """
+    identity = []
+    for path in FilePath(file_path).single_paths:
+        stat = os.stat(path)
+        identity.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    return identity
+
+
+def _digest(item):
+    """
+    Stable hash of a JSON-serializable item
+    """
+    return hashlib.sha1(json.dumps(item, sort_keys=True, default=to_json).encode()).hexdigest()
+
+
+def meta_data_key(file_path, cross_section, configuration):
+    """
+    Key identifying the loaded events of one cross-section.
+
+    Parameters
+    ----------
+    file_path: str
+        Path to one or more event files, joined with '+'
+    cross_section: str
+        Cross-section name
+    configuration: Configuration
+        Configuration used to load the events
+
+    Returns
+    -------
+    str
+    """
+    return _digest(
+        dict(
+            files=_file_identity(file_path),
+            cross_section=cross_section,
+            apply_deadtime=bool(configuration.apply_deadtime),
+            paralyzable_deadtime=bool(configuration.paralyzable_deadtime),
+            deadtime_value=float(configuration.deadtime_value),
+            deadtime_tof_step=float(configuration.deadtime_tof_step),
+        )
+    )
+
+
+def data_info_key(meta_key, configuration):
+    """
+    Key identifying the peak-finding results of a cross-section for the
+    configuration options that DataInfo depends on
+    """
+    options = dict(
+        use_roi=configuration.use_roi,
+        use_roi_bck=configuration.use_roi_bck,
+        use_tight_bck=configuration.use_tight_bck,
+        bck_offset=configuration.bck_offset,
+        update_peak_range=configuration.update_peak_range,
+        wl_bandwidth=configuration.wl_bandwidth,
+        force_peak_roi=configuration.force_peak_roi,
+        peak_roi=configuration.peak_roi,
+        force_low_res_roi=configuration.force_low_res_roi,
+        low_res_roi=configuration.low_res_roi,
+        force_bck_roi=configuration.force_bck_roi,
+        bck_roi=configuration.bck_roi,
+    )
+    return "%s-info-%s" % (meta_key, _digest(options)[:16])
+
+
+def cube_key(meta_key, tof_edges):
+    """
+    Key identifying a binned cube for a given set of TOF bin edges
+    """
+    edges = np.ascontiguousarray(tof_edges, dtype=np.float64)
+    return "%s-%s" % (meta_key, hashlib.sha1(edges.tobytes()).hexdigest()[:16])
+
+
+class CubeCache(object):
+    """
+    Directory of cached cross-section data, with a size cap and least-recently-used eviction.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        :param str directory: cache root directory
+        :param float max_size: maximum size of the cache, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _touch(self, path):
+        """Mark an entry as recently used"""
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _write_entry(self, key, write):
+        """
+        Write an entry to a temporary directory and move it in place, so that
+        concurrent readers never see a partial entry.
+        """
+        entry_path = self._entry_path(key)
+        tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            write(tmp_path)
+            if os.path.isdir(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            logging.error("Could not write cache entry %s", key)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.evict()
+
+    def get_meta(self, key):
+        """
+        Return the meta-data dictionary stored under a key, or None
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(os.path.join(entry_path, META_FILE), "r") as fd:
+                meta = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        self._touch(entry_path)
+        return meta
+
+    def put_meta(self, key, meta):
+        """
+        Store a JSON-serializable dictionary under a key
+        """
+
+        def _write(path):
+            with open(os.path.join(path, META_FILE), "w") as fd:
+                json.dump(meta, fd, default=to_json)
+
+        self._write_entry(key, _write)
+
+    def get_arrays(self, key):
+        """
+        Return a dictionary of read-only memory-mapped arrays stored under a key, or None.
+        Optional arrays that were not stored are left out of the dictionary.
+        """
+        entry_path = self._entry_path(key)
+        if not os.path.isdir(entry_path):
+            return None
+        arrays = {}
+        try:
+            for name in CUBE_ARRAYS:
+                array_path = os.path.join(entry_path, name + ".npy")
+                if name in OPTIONAL_CUBE_ARRAYS and not os.path.isfile(array_path):
+                    continue
+                arrays[name] = np.load(array_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        self._touch(entry_path)
+        return arrays
+
+    def put_arrays(self, key, **arrays):
+        """
+        Store arrays under a key
+        """
+
+        def _write(path):
+            for name, value in arrays.items():
+                np.save(os.path.join(path, name + ".npy"), value)
+
+        self._write_entry(key, _write)
+
+    def entries(self):
+        """
+        Return a list of (last access time, size in bytes, path) for each entry
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = 0
+            for item in os.listdir(path):
+                try:
+                    size += os.path.getsize(os.path.join(path, item))
+                except OSError:
+                    pass
+            entries.append((os.path.getmtime(path), size, path))
+        return entries
+
+    def size(self):
+        """Total size of the cache, in bytes"""
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        """
+        Remove least-recently-used entries until the cache fits in its maximum size
+        """
+        entries = sorted(self.entries())
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all entries"""
+        for _, _, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+
+_cube_caches = {}
+
+
+def get_cube_cache(configuration):
+    """
+    Return the cube cache for a configuration, or None if caching is turned off.
+
+    :param Configuration configuration: configuration holding the cache options
+    """
+    directory = configuration.cube_cache_directory
+    if not directory:
+        return None
+    max_size = configuration.cube_cache_max_size * 1024**3
+    cache = _cube_caches.get(directory)
+    if cache is None:
+        try:
+            cache = CubeCache(directory, max_size)
+        except OSError:
+            logging.error("Could not create cube cache in %s", directory)
+            return None
+        _cube_caches[directory] = cache
+    cache.max_size = max_size
+    return cache
@@ -0,0 +1,349 @@
+"""
+Compact in-memory storage of the binned (x, y, TOF) detector cubes of a cross-section.
+
+The counts of raw events are integers, and their errors are the square root of the counts.
+A compact cube stores the counts as uint32, or as float32 for weighted events, and the errors
+of raw counts are computed from the counts when they are read. Reading a compact cube, whether
+by slicing it or by converting it to an array, returns float64 values, so that the code using
+the cubes sees the same values as for a float64 array.
+
+Cubes of runs with few counts are mostly empty. A sparse cube only keeps the non-zero bins,
+so that its memory, and the time taken to slice and sum it, scale with the number of counts
+rather than with the size of the detector.
+"""
+
+import numpy as np
+
+# Number of x pixels checked at a time when looking for raw counts, to limit temporary memory
+_CHECK_SLAB_SIZE = 16
+
+
+class CompactCube(object):
+    """
+    Array stored with a compact dtype, and read back as float64
+    """
+
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, values):
+        """
+        :param ndarray values: stored values, usually uint32 or float32
+        """
+        self.values = values
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def ndim(self):
+        return self.values.ndim
+
+    @property
+    def size(self):
+        return self.values.size
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, key):
+        return np.asarray(self.values[key], dtype=np.float64)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=np.float64 if dtype is None else dtype)
+
+
+class SqrtCountsCube(object):
+    """
+    Errors of raw event counts, computed from the counts when they are read
+    """
+
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, counts):
+        """
+        :param CompactCube counts: counts the errors are computed from
+        """
+        self.counts = counts
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    @property
+    def ndim(self):
+        return self.counts.ndim
+
+    @property
+    def size(self):
+        return self.counts.size
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, key):
+        counts = self.counts[key]
+        if isinstance(counts, SparseCube):
+            return counts.with_values(np.sqrt(counts.values, dtype=np.float64))
+        return np.sqrt(counts)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.sqrt(np.asarray(self.counts, dtype=np.float64 if dtype is None else dtype))
+
+
+def is_raw_counts(counts, errors):
+    """
+    Returns True if the counts are integers that fit in uint32 and their errors are the square root of the counts
+    :param ndarray counts: (x, y, TOF) counts
+    :param ndarray errors: (x, y, TOF) errors on the counts
+    """
+    for i in range(0, counts.shape[0], _CHECK_SLAB_SIZE):
+        slab = counts[i : i + _CHECK_SLAB_SIZE]
+        if slab.size == 0:
+            continue
+        if slab.min() < 0 or slab.max() > np.iinfo(np.uint32).max or not np.array_equal(slab, np.rint(slab)):
+            return False
+        if not np.array_equal(errors[i : i + _CHECK_SLAB_SIZE], np.sqrt(slab)):
+            return False
+    return True
+
+
+class SparseCube(object):
+    """
+    (x, y, TOF) cube holding only its non-zero bins, as a compressed sparse row array
+    of TOF bins for each detector pixel, with pixel index ``n_y * x + y``.
+    Slicing a sparse cube returns a SparseCube, and summing it over axes returns float64 arrays.
+    Integer indices return the selected plane, or line, of the cube as a float64 array.
+    The errors of a sparse cube of raw counts are also sliced as SparseCube objects.
+    Any other use converts it to a float64 array.
+    """
+
+    dtype = np.dtype(np.float64)
+    ndim = 3
+
+    def __init__(self, shape, indptr, tof_indices, values):
+        """
+        :param tuple shape: (n_x, n_y, n_tof) shape of the cube
+        :param ndarray indptr: the TOF bins of pixel i are stored in [indptr[i], indptr[i + 1])
+        :param ndarray tof_indices: TOF bin of each stored value
+        :param ndarray values: stored values
+        """
+        self.shape = tuple(shape)
+        self.indptr = indptr
+        self.tof_indices = tof_indices
+        self.values = values
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def fill_factor(self):
+        """Fraction of the bins that are stored"""
+        return len(self.values) / self.size if self.size else 0.0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _pixels(self):
+        """Pixel index of each stored value"""
+        return np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        n_x, n_y, n_tof = self.shape
+        try:
+            if len(key) > 3:
+                raise TypeError("Too many indices")
+            items = list(key) + [slice(None)] * (3 - len(key))
+            # An integer index selects a slice of length one, which is dropped once converted to an array
+            scalar_axes = []
+            for axis, item in enumerate(items):
+                if isinstance(item, (int, np.integer)) and not isinstance(item, bool):
+                    if not -self.shape[axis] <= item < self.shape[axis]:
+                        raise IndexError(
+                            "index %s is out of bounds for axis %s with size %s" % (item, axis, self.shape[axis])
+                        )
+                    item = int(item) % self.shape[axis]
+                    items[axis] = slice(item, item + 1)
+                    scalar_axes.append(axis)
+            x_index = _axis_index(items[0], n_x)
+            y_index = _axis_index(items[1], n_y)
+            if not isinstance(items[2], slice) or items[2].step not in (None, 1):
+                raise TypeError("Only contiguous TOF ranges are supported")
+            tof_start, tof_stop, _ = items[2].indices(n_tof)
+            tof_stop = max(tof_start, tof_stop)
+        except TypeError:
+            return np.asarray(self)[key]
+
+        # Gather the stored values of the selected pixels
+        pixels = (x_index[:, np.newaxis] * n_y + y_index[np.newaxis, :]).ravel()
+        starts = self.indptr[pixels]
+        lengths = self.indptr[pixels + 1] - starts
+        indptr = np.zeros(len(pixels) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        tof_indices = self.tof_indices[positions]
+
+        if (tof_start, tof_stop) != (0, n_tof):
+            keep = (tof_indices >= tof_start) & (tof_indices < tof_stop)
+            n_kept = np.zeros(len(keep) + 1, dtype=np.int64)
+            np.cumsum(keep, out=n_kept[1:])
+            indptr = n_kept[indptr]
+            positions = positions[keep]
+            tof_indices = tof_indices[keep] - tof_start
+        sliced = SparseCube(
+            (len(x_index), len(y_index), tof_stop - tof_start), indptr, tof_indices, self.values[positions]
+        )
+        if scalar_axes:
+            return np.asarray(sliced).squeeze(axis=tuple(scalar_axes))
+        return sliced
+
+    def sum(self, axis=None):
+        """
+        Sum over one or more axes
+        :param axis: axis or tuple of axes, or None to sum all the values
+        """
+        axes = range(3) if axis is None else np.atleast_1d(axis)
+        axes = sorted({int(a) % 3 for a in axes})
+        kept = [a for a in range(3) if a not in axes]
+        if not kept:
+            return np.float64(self.values.sum(dtype=np.float64))
+
+        pixels = self._pixels()
+        n_y = self.shape[1]
+        coordinates = [pixels // n_y, pixels % n_y, self.tof_indices]
+        shape = tuple(self.shape[a] for a in kept)
+        index = np.ravel_multi_index([coordinates[a] for a in kept], shape) if len(kept) > 1 else coordinates[kept[0]]
+        summed = np.bincount(index, weights=self.values, minlength=int(np.prod(shape)))
+        return summed.reshape(shape)
+
+    def with_values(self, values):
+        """
+        Sparse cube with the same stored bins as this one, holding other values
+        :param ndarray values: value of each stored bin
+        """
+        return SparseCube(self.shape, self.indptr, self.tof_indices, values)
+
+    def toarray(self):
+        """Dense array, with the dtype of the stored values"""
+        return self.__array__(self.values.dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = np.zeros(self.shape, dtype=np.float64 if dtype is None else dtype)
+        dense.reshape((self.shape[0] * self.shape[1], self.shape[2]))[self._pixels(), self.tof_indices] = self.values
+        return dense
+
+
+def _axis_index(key, size):
+    """
+    Indices selected along an axis of a SparseCube
+    :param key: slice, boolean mask or integer indices
+    :param int size: length of the axis
+    """
+    if isinstance(key, slice):
+        return np.arange(*key.indices(size))
+    if isinstance(key, (list, np.ndarray)):
+        key = np.asarray(key)
+        if key.dtype == bool and key.shape == (size,):
+            return np.flatnonzero(key)
+        if key.ndim == 1 and np.issubdtype(key.dtype, np.integer):
+            return key % size
+    raise TypeError("Unsupported index %s" % str(key))
+
+
+def sparse_cube(counts, errors, compact=False):
+    """
+    Store a cube of counts and its errors as sparse cubes
+    :param ndarray counts: (x, y, TOF) counts
+    :param ndarray errors: (x, y, TOF) errors on the counts
+    :param bool compact: if True, store the values as uint32 or float32, see compact_cube()
+    :returns: (counts, errors) as a SparseCube and either a SqrtCountsCube or a SparseCube
+    """
+    raw_counts = is_raw_counts(counts, errors)
+    n_x, n_y, n_tof = counts.shape
+    flat_counts = counts.reshape((n_x * n_y, n_tof))
+    flat_errors = errors.reshape((n_x * n_y, n_tof))
+    mask = flat_counts != 0
+    if not raw_counts:
+        mask |= flat_errors != 0
+    pixels, tof_indices = np.nonzero(mask)
+    indptr = np.zeros(n_x * n_y + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pixels, minlength=n_x * n_y), out=indptr[1:])
+
+    if raw_counts:
+        dtype = np.uint32 if compact else np.float64
+    else:
+        dtype = np.float32 if compact else np.float64
+    data = SparseCube(
+        counts.shape, indptr, tof_indices.astype(np.int32), flat_counts[pixels, tof_indices].astype(dtype)
+    )
+    if raw_counts:
+        return data, SqrtCountsCube(data)
+    return data, SparseCube(counts.shape, indptr, data.tof_indices, flat_errors[pixels, tof_indices].astype(dtype))
+
+
+def store_cube(counts, errors, compact=False, sparse_fill_factor=0.0):
+    """
+    Choose how to store a cube of counts and its errors
+    :param ndarray counts: (x, y, TOF) counts
+    :param ndarray errors: (x, y, TOF) errors on the counts
+    :param bool compact: if True, store the values as uint32 or float32
+    :param float sparse_fill_factor: store sparse cubes if the fraction of non-zero bins is below this value
+    :returns: (counts, errors)
+    """
+    if counts.size > 0 and np.count_nonzero(counts) < sparse_fill_factor * counts.size:
+        return sparse_cube(counts, errors, compact=compact)
+    if compact:
+        return compact_cube(counts, errors)
+    return counts.astype(float, copy=False), errors.astype(float, copy=False)
+
+
+def compact_cube(counts, errors):
+    """
+    Store a cube of counts and its errors in compact form
+    :param ndarray counts: (x, y, TOF) counts
+    :param ndarray errors: (x, y, TOF) errors on the counts
+    :returns: (counts, errors) as a CompactCube and either a SqrtCountsCube or a CompactCube
+    """
+    if is_raw_counts(counts, errors):
+        data = CompactCube(counts.astype(np.uint32))
+        return data, SqrtCountsCube(data)
+    return CompactCube(counts.astype(np.float32)), CompactCube(errors.astype(np.float32))
+
+
+def to_stored_arrays(data, raw_error):
+    """
+    Arrays to write to a file for a cube and its errors, in their compact dtype.
+    Sparse cubes are written as dense arrays, which are memory-mapped when read back.
+    :param data: counts, as an array, a CompactCube or a SparseCube
+    :param raw_error: errors, as an array, a CompactCube, a SparseCube or a SqrtCountsCube
+    :returns: (data, raw_error) arrays, where raw_error is None if the errors are computed from the counts
+    """
+    if isinstance(data, CompactCube):
+        data = data.values
+    elif isinstance(data, SparseCube):
+        data = data.toarray()
+    if isinstance(raw_error, SqrtCountsCube):
+        raw_error = None
+    elif isinstance(raw_error, CompactCube):
+        raw_error = raw_error.values
+    elif isinstance(raw_error, SparseCube):
+        raw_error = raw_error.toarray()
+    return data, raw_error
+
+
+def from_stored_arrays(data, raw_error=None):
+    """
+    Cube and errors from the arrays written by to_stored_arrays()
+    :param ndarray data: stored counts
+    :param ndarray raw_error: stored errors, or None if the errors are computed from the counts
+    """
+    if data.dtype != np.float64:
+        data = CompactCube(data)
+    if raw_error is None:
+        raw_error = SqrtCountsCube(data)
+    elif raw_error.dtype != np.float64:
+        raw_error = CompactCube(raw_error)
+    return data, raw_error
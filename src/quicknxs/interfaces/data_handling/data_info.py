@@ -14,12 +14,42 @@ import numpy as np
 import scipy.optimize as opt
 from scipy import ndimage
 
-from .peak_finding import find_peaks, peak_prominences, peak_widths
+from .peak_finding import find_peaks_by_row
 
 NX_PIXELS = 304
 NY_PIXELS = 256
 
 
+def get_tof_range(ws, wl_bandwidth):
+    """
+    Determine TOF range from the chopper settings of a run
+    :param workspace ws: workspace to work with
+    :param float wl_bandwidth: wavelength band width
+    """
+    run_object = ws.getRun()
+    sample_detector_distance = run_object["SampleDetDis"].getStatistics().mean
+    source_sample_distance = run_object["ModeratorSamDis"].getStatistics().mean
+    # Check units
+    if run_object["SampleDetDis"].units not in ["m", "meter"]:
+        sample_detector_distance /= 1000.0
+    if run_object["ModeratorSamDis"].units not in ["m", "meter"]:
+        source_sample_distance /= 1000.0
+
+    source_detector_distance = source_sample_distance + sample_detector_distance
+
+    h = 6.626e-34  # m^2 kg s^-1
+    m = 1.675e-27  # kg
+    wl = run_object.getProperty("LambdaRequest").value[0]
+    chopper_speed = run_object.getProperty("SpeedRequest1").value[0]
+    wl_offset = 0
+    cst = source_detector_distance / h * m
+    half_width = wl_bandwidth / 2.0
+    tof_min = cst * (wl + wl_offset * 60.0 / chopper_speed - half_width * 60.0 / chopper_speed) * 1e-4
+    tof_max = cst * (wl + wl_offset * 60.0 / chopper_speed + half_width * 60.0 / chopper_speed) * 1e-4
+
+    return [tof_min, tof_max]
+
+
 class DataInfo(object):
     """
     Class to hold the relevant information from a run (scattering or direct beam).
@@ -28,8 +58,12 @@ class DataInfo(object):
     peak_range_offset = 0
     tolerance = 0.02
 
-    def __init__(self, ws, cross_section, configuration):
+    def __init__(self, ws, cross_section, configuration, detector_image=None, other_x_profiles=None):
         self.cross_section = cross_section
+        # Counts per (x, y) pixel summed over TOF, if already binned by the caller
+        self.detector_image = detector_image
+        # Counts vs x pixel of the other cross-sections of the run, most counts first
+        self.other_x_profiles = other_x_profiles
         self.run_number = ws.getRunNumber()
         self.is_direct_beam = False
         self.data_type = 1
@@ -86,29 +120,8 @@ class DataInfo(object):
         Determine TOF range from the data
         :param workspace ws: workspace to work with
         """
-        run_object = ws.getRun()
-        sample_detector_distance = run_object["SampleDetDis"].getStatistics().mean
-        source_sample_distance = run_object["ModeratorSamDis"].getStatistics().mean
-        # Check units
-        if run_object["SampleDetDis"].units not in ["m", "meter"]:
-            sample_detector_distance /= 1000.0
-        if run_object["ModeratorSamDis"].units not in ["m", "meter"]:
-            source_sample_distance /= 1000.0
-
-        source_detector_distance = source_sample_distance + sample_detector_distance
-
-        h = 6.626e-34  # m^2 kg s^-1
-        m = 1.675e-27  # kg
-        wl = run_object.getProperty("LambdaRequest").value[0]
-        chopper_speed = run_object.getProperty("SpeedRequest1").value[0]
-        wl_offset = 0
-        cst = source_detector_distance / h * m
-        half_width = self.wl_bandwidth / 2.0
-        tof_min = cst * (wl + wl_offset * 60.0 / chopper_speed - half_width * 60.0 / chopper_speed) * 1e-4
-        tof_max = cst * (wl + wl_offset * 60.0 / chopper_speed + half_width * 60.0 / chopper_speed) * 1e-4
-
-        self.tof_range = [tof_min, tof_max]
-        return [tof_min, tof_max]
+        self.tof_range = get_tof_range(ws, self.wl_bandwidth)
+        return self.tof_range
 
     def process_roi(self, ws):
         """
@@ -222,7 +235,7 @@ class DataInfo(object):
 
         # Find reflectivity peak and low resolution ranges
         # fitter = Fitter(ws, True)
-        fitter = Fitter2(ws)
+        fitter = Fitter2(ws, detector_image=self.detector_image, other_x_profiles=self.other_x_profiles)
         peak, low_res = fitter.fit_2d_peak()
 
         self.found_peak = copy.copy(peak)
@@ -285,38 +298,20 @@ def chi2(data, model):
     return np.sum((data - model) ** 2 / err) / len(data)
 
 
-class Fitter2(object):
-    DEAD_PIXELS = 10
-
-    def __init__(self, workspace):
-        self.workspace = workspace
-        self._prepare_data()
-
-    def _prepare_data(self):
-        """
-        Read in the data and create arrays for fitting
-        """
-        # Prepare data to fit
-        self.n_x = int(self.workspace.getInstrument().getNumberParameter("number-of-x-pixels")[0])
-        self.n_y = int(self.workspace.getInstrument().getNumberParameter("number-of-y-pixels")[0])
-
-        _integrated = api.Integration(InputWorkspace=self.workspace)
-        signal = _integrated.extractY()
-        self.z = np.reshape(signal, (self.n_x, self.n_y))
-        self.y = np.arange(0, self.n_y)[self.DEAD_PIXELS : -self.DEAD_PIXELS]
-        # 1D data x/y vs counts
-        self.x_vs_counts = np.sum(self.z, 1)
-        self.y_vs_counts = np.sum(self.z, 0)
-
-        self.guess_x = np.argmax(self.x_vs_counts)
-        self.guess_wx = 6.0
-
-    def _scan_peaks(self):
-        f1 = ndimage.gaussian_filter(self.x_vs_counts, 3)
-        peaks, _ = find_peaks(f1)
-        prom, _, _ = peak_prominences(f1, peaks)
-        peaks_w, _, _, _ = peak_widths(f1, peaks)
+def scan_x_profiles(x_profiles):
+    """
+    Find the specular peak candidates in a set of x-projections of the detector image,
+    for instance those of all the cross-sections of a run.
+    The candidates are ordered by a quality factor favoring large peaks in the middle of the detector.
+    :param ndarray x_profiles: counts vs x pixel, with one row per projection
+    :return: list of (found_peaks, best_peak) for each projection, where best_peak is a (position, width)
+        tuple, or None if no peak was found
+    """
+    x_profiles = np.atleast_2d(np.asarray(x_profiles, dtype=np.float64))
+    smoothed = ndimage.gaussian_filter1d(x_profiles, 3, axis=1)
 
+    results = []
+    for peaks, prom, peaks_w in find_peaks_by_row(smoothed):
         # The quality factor is the size of the peak (height*width) multiply by
         # a factor that peaks in the middle of the detector, where the peak usually is.
         nx = 304.0
@@ -333,9 +328,8 @@ class Fitter2(object):
         ordered = sorted(zipped, key=lambda a: a[2])
         found_peaks = [p[0] for p in ordered]
 
+        best_peak = None
         if found_peaks:
-            #    self.guess_x = ordered[0][0]
-            #    self.guess_ws = ordered[0][1]
             i_final = 0
             if (
                 len(ordered) > 1
@@ -343,9 +337,56 @@ class Fitter2(object):
                 and ordered[1][0] < ordered[0][0]
             ):
                 i_final = 1
-            self.guess_x = ordered[i_final][0]
-            self.guess_ws = ordered[i_final][1]
+            best_peak = (ordered[i_final][0], ordered[i_final][1])
+        results.append((found_peaks, best_peak))
+    return results
+
+
+class Fitter2(object):
+    DEAD_PIXELS = 10
 
+    def __init__(self, workspace, detector_image=None, other_x_profiles=None):
+        """
+        :param workspace workspace: event workspace to inspect
+        :param ndarray detector_image: (x, y) counts summed over TOF. If None, the events are integrated
+        :param list other_x_profiles: counts vs x pixel of the other cross-sections of the run, most counts
+            first, which are scanned along with this one
+        """
+        self.workspace = workspace
+        self.detector_image = detector_image
+        self.other_x_profiles = other_x_profiles if other_x_profiles is not None else []
+        self._prepare_data()
+
+    def _prepare_data(self):
+        """
+        Read in the data and create arrays for fitting
+        """
+        # Prepare data to fit
+        self.n_x = int(self.workspace.getInstrument().getNumberParameter("number-of-x-pixels")[0])
+        self.n_y = int(self.workspace.getInstrument().getNumberParameter("number-of-y-pixels")[0])
+
+        if self.detector_image is None:
+            _integrated = api.Integration(InputWorkspace=self.workspace, StoreInADS=False)
+            signal = _integrated.extractY()
+        else:
+            signal = self.detector_image
+        self.z = np.reshape(signal, (self.n_x, self.n_y))
+        self.y = np.arange(0, self.n_y)[self.DEAD_PIXELS : -self.DEAD_PIXELS]
+        # 1D data x/y vs counts
+        self.x_vs_counts = np.sum(self.z, 1)
+        self.y_vs_counts = np.sum(self.z, 0)
+
+        self.guess_x = np.argmax(self.x_vs_counts)
+        self.guess_wx = 6.0
+
+    def _scan_peaks(self):
+        results = scan_x_profiles([self.x_vs_counts] + list(self.other_x_profiles))
+        found_peaks, best_peak = results[0]
+        # Peak candidates of the other cross-sections, in the order of other_x_profiles
+        self.other_peaks = [peaks for peaks, _ in results[1:]]
+        # If no peak is found, the guess stays the maximum of the x-projection
+        if best_peak is not None:
+            self.guess_x, self.guess_ws = best_peak
         return found_peaks
 
     def fit_2d_peak(self):
@@ -408,9 +449,8 @@ class Fitter2(object):
         peak_min = 0
         peak_max = self.n_x
         try:
-            _integral = [np.sum(self.y_vs_counts[:i]) for i in range(len(self.y_vs_counts))]
             _running = 0.1 * np.convolve(self.y_vs_counts, np.ones(10), mode="valid")
-            _deriv = np.asarray([_running[i + 1] - _running[i] for i in range(len(_running) - 1)])
+            _deriv = np.diff(_running)
             _deriv_err = np.sqrt(_running)[:-1]
             _deriv_err[_deriv_err < 1] = 1
             _y = np.arange(len(self.y_vs_counts))[5:-5]
@@ -14,6 +14,7 @@ import numpy as np
 
 from .data_set import NexusMetaData
 from .instrument import Instrument
+from .run_index import get_run_index
 
 
 class NormalizeToUnityQCutoffError(Exception):
@@ -491,6 +492,11 @@ def extract_meta_data(file_path=None, cross_section_data=None, configuration=Non
     elif file_path is None:
         raise RuntimeError("Either a file path or a data object must be supplied")
 
+    # Read the DAS logs directly from the file when possible
+    indexed_meta_data = get_run_index(configuration).get_meta_data(file_path)
+    if indexed_meta_data is not None:
+        return indexed_meta_data
+
     nxs = h5py.File(file_path, mode="r")
     keys = list(nxs.keys())
     keys.sort()
@@ -7,6 +7,7 @@ Uses Mantid Framework
 
 # local imports
 import copy
+import itertools
 import logging
 import math
 import time
@@ -14,6 +15,7 @@ import traceback
 
 # standard imports
 from collections import OrderedDict
+from collections.abc import Mapping
 from typing import Union
 
 import mantid.simpleapi as api
@@ -23,8 +25,10 @@ import numpy as np
 from mantid.dataobjects import Workspace2D
 
 from quicknxs.interfaces.configuration import get_direct_beam_low_res_roi
-from quicknxs.interfaces.data_handling.data_info import DataInfo
+from quicknxs.interfaces.data_handling import cube_cache, cube_storage, reflectivity_cache
+from quicknxs.interfaces.data_handling.data_info import DataInfo, get_tof_range
 from quicknxs.interfaces.data_handling.filepath import FilePath
+from quicknxs.interfaces.data_handling.geometry import GeometryCache
 from quicknxs.interfaces.data_handling.gisans import GISANS
 from quicknxs.interfaces.data_handling.off_specular import OffSpecular
 
@@ -34,6 +38,18 @@ api.ConfigService.setLogLevel(3)
 # Parameters needed for some calculations.
 H_OVER_M_NEUTRON = 3.956034e-7  # h/m_n [m^2/s]
 
+# DataInfo results kept in the cube cache
+DATA_INFO_RESULTS = [
+    "tof_range",
+    "use_roi_actual",
+    "is_direct_beam",
+    "roi_peak",
+    "roi_background",
+    "peak_range",
+    "low_res_range",
+    "background",
+]
+
 # Number of events under which we throw away a workspace
 # TODO: This should be a parameter
 N_EVENTS_CUTOFF = 100
@@ -41,6 +57,16 @@ N_EVENTS_CUTOFF = 100
 # If there's an empty reflectivity curve, add a small value to it so that it can be plotted.
 REFLECTIVITY_THRESHOLD_VALUE = 1e-6
 
+# Serial numbers telling apart event workspaces loaded under the same name
+_event_workspace_ids = itertools.count()
+
+
+def next_event_workspace_id():
+    """
+    Serial number for a new set of events. The reflectivity cache identifies the events of a cross-section by it.
+    """
+    return next(_event_workspace_ids)
+
 
 def _is_empty_reflectivity_curve(input_workspace: Union[str, Workspace2D]) -> bool:
     r"""
@@ -75,29 +101,163 @@ def _shift_empty_reflectivity_curve(
     workspace.dataE(0)[:] += shift**2  # arbitrary small error
 
 
-def getIxyt(nxs_data):
+def _array_memory_size(*items):
     """
-    Return [x, y, TOF] array
-    @param nxs_data: Mantid workspace
+    Number of bytes held in memory by numpy arrays, either given directly or as attributes of objects.
+    Memory-mapped arrays are backed by files and are not counted.
     """
-    _tof_axis = nxs_data.readX(0)[:].copy()
-    nbr_tof = len(_tof_axis)
+    size = 0
+    for item in items:
+        if isinstance(item, np.ndarray):
+            if not isinstance(item, np.memmap):
+                size += item.nbytes
+        elif item is not None and hasattr(item, "__dict__"):
+            size += _array_memory_size(*[value for value in vars(item).values() if isinstance(value, np.ndarray)])
+    return size
 
+
+def getIxyt(nxs_data):
+    """
+    Return [x, y, TOF] counts and error arrays.
+
+    The spectra of the rebinned workspace are extracted in a single transfer and
+    reshaped into the detector geometry. Workspace index ``n_y * x + y`` maps onto
+    element ``[x, y, :]`` of the output, so the reshape is a view on the extracted data.
+
+    @param nxs_data: Mantid workspace with one spectrum per detector pixel
+    """
     sz_y_axis = int(nxs_data.getInstrument().getNumberParameter("number-of-y-pixels")[0])  # 256
     sz_x_axis = int(nxs_data.getInstrument().getNumberParameter("number-of-x-pixels")[0])  # 304
 
-    _y_axis = np.zeros((sz_x_axis, sz_y_axis, nbr_tof - 1))
-    _y_error_axis = np.zeros((sz_x_axis, sz_y_axis, nbr_tof - 1))
+    n_histograms = nxs_data.getNumberHistograms()
+    if n_histograms != sz_x_axis * sz_y_axis:
+        raise RuntimeError(
+            "Workspace has %s spectra but the instrument defines %s x %s pixels"
+            % (n_histograms, sz_x_axis, sz_y_axis)
+        )
 
-    for x in range(sz_x_axis):
-        for y in range(sz_y_axis):
-            _index = int(sz_y_axis * x + y)
-            _y_axis[x, y, :] = nxs_data.readY(_index)[:]
-            _y_error_axis[x, y, :] = nxs_data.readE(_index)[:]
+    nbr_tof = nxs_data.blocksize()
+    _y_axis = nxs_data.extractY().reshape((sz_x_axis, sz_y_axis, nbr_tof))
+    _y_error_axis = nxs_data.extractE().reshape((sz_x_axis, sz_y_axis, nbr_tof))
 
     return _y_axis, _y_error_axis
 
 
+class DASLogs(object):
+    """
+    Summary of the DAS logs of a cross-section. The names and units of the logs are read
+    up front, while the mean, minimum and maximum of a log are computed when it is first read.
+    """
+
+    # Logs left out of the summary
+    SKIPPED_LOGS = ["proton_charge", "frequency", "Veto_pulse"]
+
+    def __init__(self, workspace, meta=None):
+        """
+        :param EventWorkspace workspace: workspace holding the logs, which are read from it by name
+        :param dict meta: names, units and statistics already read, as returned by to_meta(). If None,
+            the names and units are read from the workspace.
+        """
+        self._workspace_name = str(workspace)
+        self.names = []
+        self.units = {}
+        self._statistics = {}
+        if meta is not None:
+            self.names = list(meta["names"])
+            self.units = dict(meta["units"])
+            self._statistics = {
+                motor: tuple(np.float64(value) for value in stats) for motor, stats in meta["statistics"].items()
+            }
+        else:
+            run = workspace.getRun()
+            for motor in run.keys():
+                if motor in self.SKIPPED_LOGS:
+                    continue
+                try:
+                    item = run[motor]
+                    self.units[motor] = str(item.units)
+                    if item.type != "string":
+                        self.names.append(motor)
+                except:
+                    logging.error("Error reading DASLogs %s", motor)
+        # Views of the statistics, indexed by log name
+        self.mean = _LogStatisticsView(self, 0)
+        self.minmax = _LogStatisticsView(self, slice(1, 3))
+
+    def statistics(self, motor):
+        """
+        Return the (mean, minimum, maximum) of a log, computed on first use.
+        They are NaN if the log could not be read, for instance once the workspace has been deleted.
+        :param str motor: name of the log
+        """
+        if motor not in self._statistics:
+            if motor not in self.names:
+                raise KeyError(motor)
+            try:
+                item = api.mtd[self._workspace_name].getRun()[motor]
+                if item.type == "number":
+                    value = np.float64(item.value)
+                    self._statistics[motor] = (value, value, value)
+                else:
+                    stats = item.getStatistics()
+                    self._statistics[motor] = (
+                        np.float64(stats.mean),
+                        np.float64(stats.minimum),
+                        np.float64(stats.maximum),
+                    )
+            except:
+                logging.error("Error reading DASLogs %s", motor)
+                self._statistics[motor] = (np.nan, np.nan, np.nan)
+        return self._statistics[motor]
+
+    def read_all(self):
+        """
+        Compute the statistics of the logs that have not been read yet, before the workspace is deleted
+        """
+        for motor in self.names:
+            self.statistics(motor)
+
+    def to_meta(self):
+        """
+        Return the names and units of the logs, with the statistics computed so far.
+        The statistics of logs that could not be read are left out, so that they are read again.
+        :return: JSON-serializable dictionary, to be passed back to the constructor
+        """
+        statistics = {
+            motor: [float(value) for value in stats]
+            for motor, stats in self._statistics.items()
+            if not np.isnan(stats).any()
+        }
+        return dict(names=list(self.names), units=dict(self.units), statistics=statistics)
+
+
+class _LogStatisticsView(Mapping):
+    """
+    Read-only mapping of log names to one of their statistics, see DASLogs
+    """
+
+    def __init__(self, logs, index):
+        """
+        :param DASLogs logs: summary of the logs
+        :param int index: index, or slice, of the (mean, minimum, maximum) tuple to return
+        """
+        self._logs = logs
+        self._index = index
+
+    def __getitem__(self, motor):
+        return self._logs.statistics(motor)[self._index]
+
+    def __contains__(self, motor):
+        # Only check the name, without reading the log
+        return motor in self._logs.names
+
+    def __iter__(self):
+        return iter(self._logs.names)
+
+    def __len__(self):
+        return len(self._logs.names)
+
+
 class NexusData(object):
     """
     Read a nexus file with multiple cross-section data.
@@ -116,6 +276,8 @@ class NexusData(object):
         self.configuration = configuration
         self.cross_sections = {}
         self.main_cross_section = None
+        # Angles and wave vectors shared by the cross-sections for the off-specular and GISANS calculations
+        self.geometries = GeometryCache()
 
     def get_highest_cross_section(self, n_points=10):
         """
@@ -152,6 +314,26 @@ class NexusData(object):
                     q_max = max(q_max, self.cross_sections[xs].q.max())
         return q_min, q_max
 
+    def get_memory_size(self):
+        """
+        Approximate number of bytes held in memory by the loaded cross-sections,
+        including the Mantid workspaces they own.
+        """
+        return self.geometries.get_memory_size() + sum(
+            self.cross_sections[xs].get_memory_size() for xs in self.cross_sections
+        )
+
+    def get_workspace_names(self):
+        """
+        Names of the Mantid workspaces owned by the loaded cross-sections
+        """
+        names = set()
+        for xs in self.cross_sections:
+            names.update(self.cross_sections[xs].get_workspace_names())
+        if self.number:
+            names.add("r%s" % self.number)
+        return names
+
     def get_reflectivity_workspace_group(self):
         ws_list = [self.cross_sections[xs]._reflectivity_workspace for xs in self.cross_sections]
         wsg = api.GroupWorkspaces(InputWorkspaces=ws_list)
@@ -173,7 +355,7 @@ class NexusData(object):
             logging.error("Could not set parameter %s %s", param, value)
         return has_changed
 
-    def calculate_reflectivity(self, direct_beam=None, configuration=None, ws_suffix: str = ""):
+    def calculate_reflectivity(self, direct_beam=None, configuration=None, ws_suffix: str = "", cache=None):
         """
         Loop through the cross-section data sets and update
         the reflectivity.
@@ -186,6 +368,8 @@ class NexusData(object):
             The configuration
         ws_suffix: str
             String to add to reflectivity workspace name
+        cache: ReflectivityCache | None
+            If given, reuse the result of a previous reduction with the same inputs, and store the new result
 
         Example
         -------
@@ -221,13 +405,26 @@ class NexusData(object):
 
         output_ws = "r%s" % self.number
 
+        cache_key = None
+        if cache is not None:
+            cache_key = reflectivity_cache.reduction_key(self, direct_beam if apply_norm else None)
+            if cache.restore(self, output_ws + ws_suffix, cache_key):
+                return
+
+        # Runs restored from a session file are reduced from their events, loaded when first needed
+        for xs in self.cross_sections:
+            self.cross_sections[xs].restore_workspaces(events=True)
+        if apply_norm:
+            direct_beam.restore_workspaces(events=True)
+
         ws_norm = None
         if apply_norm and direct_beam._event_workspace is not None:
             ws_norm = direct_beam._event_workspace
 
         ws_list = [self.cross_sections[xs]._event_workspace for xs in self.cross_sections]
         conf = self.cross_sections[self.main_cross_section].configuration
-        wsg = api.GroupWorkspaces(InputWorkspaces=ws_list)
+        # The input group is named after the run, since runs may be reduced in worker threads
+        wsg = api.GroupWorkspaces(InputWorkspaces=ws_list, OutputWorkspace="%s_events%s" % (output_ws, ws_suffix))
 
         _dirpix = conf.direct_pixel_overwrite if conf.set_direct_pixel else None
         _dangle0 = conf.direct_angle_offset_overwrite if conf.set_direct_angle_offset else None
@@ -272,6 +469,7 @@ class NexusData(object):
             DirectPixelOverwrite=_dirpix,
             OutputWorkspace=output_ws,
         )
+        api.UnGroupWorkspace(str(wsg))
 
         # If there's an empty reflectivity curve, add a small value to it so that it can be plotted.
         _xs_ws = [ws] if isinstance(ws, Workspace2D) else ws
@@ -309,6 +507,9 @@ class NexusData(object):
             self.cross_sections[xs_id]._dr = np.ma.masked_equal(xs.readE(0)[:].copy(), 0)
             self.cross_sections[xs_id]._reflectivity_workspace = str(xs)
 
+        if cache is not None:
+            cache.store(self, output_ws + ws_suffix, cache_key)
+
     def calculate_gisans(self, direct_beam, progress=None):
         """
         Compute GISANS
@@ -319,7 +520,7 @@ class NexusData(object):
             progress(1, "Computing GISANS", out_of=100.0)
         for i, xs in enumerate(self.cross_sections):
             try:
-                self.cross_sections[xs].gisans(direct_beam=direct_beam)
+                self.cross_sections[xs].gisans(direct_beam=direct_beam, geometries=self.geometries)
             except:
                 has_errors = True
                 detailed_msg += "Could not calculate GISANS reflectivity for %s\n  %s\n\n" % (
@@ -361,7 +562,7 @@ class NexusData(object):
         detailed_msg = ""
         for xs in self.cross_sections:
             try:
-                self.cross_sections[xs].offspec(direct_beam=direct_beam)
+                self.cross_sections[xs].offspec(direct_beam=direct_beam, geometries=self.geometries)
             except Exception:
                 has_errors = True
                 detailed_msg += "Could not calculate off-specular reflectivity for %s\n  %s\n\n" % (
@@ -377,6 +578,8 @@ class NexusData(object):
         Loop through the cross-section data sets and update
         the reflectivity.
         """
+        # The angle, pixel and TOF parameters may have changed
+        self.geometries.clear()
         for xs in self.cross_sections:
             try:
                 self.cross_sections[xs].update_configuration(configuration)
@@ -433,7 +636,9 @@ class NexusData(object):
                 continue
 
             name = ws.getRun().getProperty("cross_section_id").value
-            cross_section = CrossSectionData(name, self.configuration, entry_name=channel, workspace=ws)
+            cross_section = CrossSectionData(
+                name, self.configuration, entry_name=channel, workspace=ws, file_path=self.file_path
+            )
             self.cross_sections[name] = cross_section
             self.number = cross_section.number  # e.g '1234:1238+1239' if more than one run made up this cross section
             if cross_section.total_counts > _max_counts:
@@ -443,7 +648,12 @@ class NexusData(object):
         # Now that we know which cross section has the most data,
         # use that one to get the reduction parameters
         self.main_cross_section = _max_xs
-        self.cross_sections[_max_xs].get_reduction_parameters(update_parameters=update_parameters)
+        other_cross_sections = sorted(
+            [xs for name, xs in self.cross_sections.items() if name != _max_xs], key=lambda xs: -xs.total_counts
+        )
+        self.cross_sections[_max_xs].get_reduction_parameters(
+            update_parameters=update_parameters, other_cross_sections=other_cross_sections
+        )
 
         # Push the configuration (reduction options and peak regions) from the
         # cross-section with the most data to all other cross-sections.
@@ -459,6 +669,21 @@ class NexusData(object):
 
         return self.cross_sections
 
+    def load_events(self):
+        """
+        Load the events of cross-sections restored from a session file, which only hold
+        their binned data. The reduction parameters of the cross-sections are kept.
+        """
+        xs_list = self.configuration.instrument.load_data(self.file_path, self.configuration)
+        for ws in xs_list:
+            name = ws.getRun().getProperty("cross_section_id").value
+            if name in self.cross_sections:
+                self.cross_sections[name]._event_workspace = str(ws)
+                # The events are the ones the restored data was reduced from: a cross-section restored
+                # with an identifier keeps it, so that the reflectivity cache still matches
+                if self.cross_sections[name]._event_workspace_id is None:
+                    self.cross_sections[name]._event_workspace_id = next_event_workspace_id()
+
     def is_direct_beam(self):
         """Returns True if the main cross-section is a direct beam"""
         return self.cross_sections[self.main_cross_section].is_direct_beam
@@ -481,9 +706,12 @@ class CrossSectionData(object):
     det_size_y = 0.0007
     lambda_center = 0
 
-    def __init__(self, name, configuration, entry_name="entry", workspace=None):
+    def __init__(self, name, configuration, entry_name="entry", workspace=None, file_path=None):
         self.name = name
         self.entry_name = entry_name
+        self.file_path = file_path
+        # Key of this cross-section in the cube cache, if caching is turned on
+        self._cache_key = None
         self.cross_section_label = entry_name
         self.measurement_type = "polarized"
         self.configuration = copy.deepcopy(configuration)
@@ -492,6 +720,7 @@ class CrossSectionData(object):
         self._r = None
         self._dr = None
         self._event_workspace = None
+        self._event_workspace_id = None
         # Flag to tell us whether we succeeded in using the meta data ROI
         self.use_roi_actual = True
         # Flag to tell us whether we found this data to be a direct beam data set
@@ -501,6 +730,8 @@ class CrossSectionData(object):
         self.logs = {}
         self.log_minmax = {}
         self.log_units = {}
+        # Summary of the DAS logs that logs and log_minmax are read from, if they are read from the workspace
+        self._das_logs = None
         self.proton_charge = 0
         self.total_counts = 0
         self.total_time = 0
@@ -514,6 +745,8 @@ class CrossSectionData(object):
         self.xydata = None
         self.xtofdata = None
         self.raw_error = None
+        # Counts per (x, y) pixel summed over all TOF values, used to find the peaks
+        self.detector_image = None
 
         self.meta_data_roi_peak = None
         self.meta_data_roi_bck = None
@@ -528,6 +761,9 @@ class CrossSectionData(object):
         # GISANS data
         self.gisans_data = None
 
+        # Workspaces of a cross-section restored from a session file, created when first needed
+        self.restored_workspaces = None
+
         if workspace:
             self.collect_info(workspace)
 
@@ -536,12 +772,14 @@ class CrossSectionData(object):
     # pylint: disable=missing-docstring
     @property
     def event_workspace(self):
+        self.restore_workspaces(events=True)
         if str(self._event_workspace) in api.mtd:
             return api.mtd[self._event_workspace]
         return None
 
     @property
     def reflectivity_workspace(self):
+        self.restore_workspaces()
         if str(self._reflectivity_workspace) in api.mtd:
             return api.mtd[self._reflectivity_workspace]
         return None
@@ -677,6 +915,55 @@ class CrossSectionData(object):
 
     # pylint: enable=missing-docstring
     # Properties for easy data access #
+    def get_memory_size(self):
+        """
+        Approximate number of bytes held in memory by this cross-section,
+        including its event and reflectivity workspaces.
+        """
+        size = _array_memory_size(
+            self.data,
+            self.raw_error,
+            self.xydata,
+            self.xtofdata,
+            self.detector_image,
+            self.q,
+            self._r,
+            self._dr,
+            self.off_spec,
+            self.gisans_data,
+        )
+        # Workspaces that are not created yet, for a restored session, are not counted
+        for name in self.get_workspace_names():
+            if name in api.mtd:
+                size += api.mtd[name].getMemorySize()
+        return size
+
+    def get_workspace_names(self):
+        """
+        Names of the Mantid workspaces owned by this cross-section
+        """
+        return {str(name) for name in [self._event_workspace, self._reflectivity_workspace] if name is not None}
+
+    def read_logs(self):
+        """
+        Compute the statistics of all the DAS logs, which are read from the event workspace.
+        To be called before the event workspace is deleted.
+        """
+        if self._das_logs is not None:
+            self._das_logs.read_all()
+            # Keep the statistics for the next time the file is loaded
+            cache = cube_cache.get_cube_cache(self.configuration)
+            if cache is not None and self._cache_key is not None:
+                cache.put_meta(self._cache_key, self._das_logs.to_meta())
+
+    def restore_workspaces(self, events=False):
+        """
+        Create the Mantid workspaces of a cross-section restored from a session file, see session.py
+        :param bool events: if True, also load the events from the data files
+        """
+        if self.restored_workspaces is not None:
+            self.restored_workspaces.restore(events)
+
     def collect_info(self, workspace):
         """
         Extract meta data from DASLogs.
@@ -684,30 +971,30 @@ class CrossSectionData(object):
         TODO: get average of values post filtering so that it truly represents the data
         """
         self._event_workspace = str(workspace)
+        self._event_workspace_id = next_event_workspace_id()
         data = workspace.getRun()
         self.logs = {}
         self.log_minmax = {}
         self.log_units = {}
 
-        for motor in data.keys():
-            if motor in ["proton_charge", "frequency", "Veto_pulse"]:
-                continue
-            item = data[motor]
+        cache = cube_cache.get_cube_cache(self.configuration)
+        self._cache_key = None
+        if cache is not None and self.file_path is not None:
             try:
-                self.log_units[motor] = str(item.units)
-                if item.type == "string":
-                    pass
-                    # self.logs[motor] = item.value
-                    # self.log_minmax[motor] = (item.value, item.value)
-                elif item.type == "number":
-                    self.logs[motor] = np.float64(item.value)
-                    self.log_minmax[motor] = (np.float64(item.value), np.float64(item.value))
-                else:
-                    stats = item.getStatistics()
-                    self.logs[motor] = np.float64(stats.mean)
-                    self.log_minmax[motor] = (np.float64(stats.minimum), np.float64(stats.maximum))
-            except:
-                logging.error("Error reading DASLogs %s", motor)
+                self._cache_key = cube_cache.meta_data_key(self.file_path, self.name, self.configuration)
+            except OSError:
+                logging.error("Could not compute cache key for %s", self.file_path)
+        cached_logs = cache.get_meta(self._cache_key) if self._cache_key is not None else None
+
+        # The cache holds the names and units of the logs, and the statistics read before the
+        # workspace was deleted. The others are read from the workspace when first used.
+        das_logs = DASLogs(workspace, meta=cached_logs)
+        self._das_logs = das_logs
+        self.logs = das_logs.mean
+        self.log_minmax = das_logs.minmax
+        self.log_units = das_logs.units
+        if cached_logs is None and self._cache_key is not None:
+            cache.put_meta(self._cache_key, das_logs.to_meta())
 
         self.proton_charge = data["gd_prtn_chrg"].value
         self.total_counts = workspace.getNumberEvents()
@@ -726,8 +1013,13 @@ class CrossSectionData(object):
         :param bool update_parameters: If true, we will determine reduction parameters
         """
         self.scattering_angle = self.configuration.instrument.scattering_angle_from_data(self)
+        self.tof_edges = self.compute_tof_edges()
 
-        # Determine binning
+    def compute_tof_edges(self):
+        """
+        Determine the TOF binning from the configuration
+        :return: array of TOF bin edges
+        """
         # TODO: only the TOF binning is implemented
         if self.configuration.tof_overwrite is not None:
             tof_edges = self.configuration.tof_overwrite
@@ -750,56 +1042,149 @@ class CrossSectionData(object):
                 tof_edges = np.arange(
                     self.configuration.tof_range[0], self.configuration.tof_range[1], self.configuration.tof_bins
                 )
-        self.tof_edges = tof_edges
+        return tof_edges
 
     def prepare_plot_data(self):
         """
         Bin events to be used for plotting and in-app calculations
         """
-        workspace = api.mtd[self._event_workspace]
         if self.xtofdata is None:
             t_0 = time.time()
-            binning_ws = api.CreateWorkspace(DataX=self.tof_edges, DataY=np.zeros(len(self.tof_edges) - 1))
-            data_rebinned = api.RebinToWorkspace(WorkspaceToRebin=workspace, WorkspaceToMatch=binning_ws)
-            Ixyt, Ixyt_error = getIxyt(data_rebinned)
+            if self._read_cached_plot_data():
+                logging.info("Plot data read from cache: %s sec", time.time() - t_0)
+                return
+            cache = cube_cache.get_cube_cache(self.configuration)
+            key = None
+            if cache is not None and self._cache_key is not None:
+                key = cube_cache.cube_key(self._cache_key, self.tof_edges)
+
+            self.restore_workspaces(events=True)
+            workspace = api.mtd[self._event_workspace]
+            # Add an underflow and an overflow bin, so that all the events are binned at once:
+            # the detector image used to find the peaks is then a by-product of the cube.
+            tof_edges = np.concatenate(
+                [
+                    [min(workspace.getTofMin(), self.tof_edges[0]) - 1.0],
+                    self.tof_edges,
+                    [max(workspace.getTofMax(), self.tof_edges[-1]) + 1.0],
+                ]
+            )
+            # Temporary workspaces are kept out of the ADS, since files may be loaded in worker threads
+            binning_ws = api.CreateWorkspace(DataX=tof_edges, DataY=np.zeros(len(tof_edges) - 1), StoreInADS=False)
+            data_rebinned = api.RebinToWorkspace(
+                WorkspaceToRebin=workspace, WorkspaceToMatch=binning_ws, StoreInADS=False
+            )
+            Ixyt_all, Ixyt_all_error = getIxyt(data_rebinned)
+            Ixyt = Ixyt_all[:, :, 1:-1]
+            Ixyt_error = Ixyt_all_error[:, :, 1:-1]
 
             # Create projections for the 2D datasets
             Ixy = Ixyt.sum(axis=2)
             Ixt = Ixyt.sum(axis=1)
+            self.detector_image = Ixy + Ixyt_all[:, :, 0] + Ixyt_all[:, :, -1]
             # Store the data
-            self.data = Ixyt.astype(float)  # 3D dataset
-            self.raw_error = Ixyt_error.astype(float)  # 3D dataset
+            self.data, self.raw_error = cube_storage.store_cube(  # 3D datasets
+                Ixyt,
+                Ixyt_error,
+                compact=self.configuration.compact_cubes,
+                sparse_fill_factor=self.configuration.sparse_cube_fill_factor,
+            )
             self.xydata = Ixy.transpose().astype(float)  # 2D dataset
             self.xtofdata = Ixt.astype(float)  # 2D dataset
             logging.info("Plot data generated: %s sec", time.time() - t_0)
+            if key is not None:
+                data, raw_error = cube_storage.to_stored_arrays(self.data, self.raw_error)
+                arrays = dict(data=data, xydata=self.xydata, xtofdata=self.xtofdata)
+                if raw_error is not None:
+                    arrays["raw_error"] = raw_error
+                cache.put_arrays(key, **arrays)
+
+    def _read_cached_plot_data(self):
+        """
+        Read the binned data from the cube cache, if it holds the cube of the current TOF binning
+        :return: True if the binned data was read from the cache
+        """
+        cache = cube_cache.get_cube_cache(self.configuration)
+        if cache is None or self._cache_key is None:
+            return False
+        arrays = cache.get_arrays(cube_cache.cube_key(self._cache_key, self.tof_edges))
+        if arrays is None:
+            return False
+        self.data, self.raw_error = cube_storage.from_stored_arrays(arrays["data"], arrays.get("raw_error"))
+        self.xydata = arrays["xydata"]
+        self.xtofdata = arrays["xtofdata"]
+        return True
 
-    def get_reduction_parameters(self, update_parameters=True):
+    def get_reduction_parameters(self, update_parameters=True, other_cross_sections=None):
         """
         Determine reduction parameter
         :param bool update_parameters: if True, we will find peak ranges
+        :param list other_cross_sections: other cross-sections of the run, most counts first, whose
+            x-projections are scanned for peaks along with that of this cross-section
         """
-        workspace = api.mtd[self._event_workspace]
-        data_info = DataInfo(workspace, self.name, self.configuration)
-        self.configuration.tof_range = data_info.tof_range
+        data_info = self._get_data_info(other_cross_sections)
+        self.configuration.tof_range = data_info["tof_range"]
         if update_parameters:
-            # data_info = DataInfo(workspace, self.name, self.configuration)
-            self.use_roi_actual = data_info.use_roi_actual
-            self.is_direct_beam = data_info.is_direct_beam
+            self.use_roi_actual = data_info["use_roi_actual"]
+            self.is_direct_beam = data_info["is_direct_beam"]
 
-            self.meta_data_roi_peak = data_info.roi_peak
-            self.meta_data_roi_bck = data_info.roi_background
+            self.meta_data_roi_peak = data_info["roi_peak"]
+            self.meta_data_roi_bck = data_info["roi_background"]
 
             if not self.configuration.force_peak_roi:
-                self.configuration.peak_roi = data_info.peak_range
+                self.configuration.peak_roi = data_info["peak_range"]
 
             if not self.configuration.force_low_res_roi:
-                self.configuration.low_res_roi = data_info.low_res_range
+                self.configuration.low_res_roi = data_info["low_res_range"]
 
             if self.configuration.force_bck_roi:
-                self.configuration.bck_roi = data_info.background
-        self.configuration.bck_roi = data_info.background
+                self.configuration.bck_roi = data_info["background"]
+        self.configuration.bck_roi = data_info["background"]
         self.process_configuration()
 
+    def _get_data_info(self, other_cross_sections=None):
+        """
+        Run DataInfo on the event workspace, or read its results from the cube cache.
+        :param list other_cross_sections: other cross-sections of the run, most counts first
+        :return: dictionary of DataInfo results
+        """
+        cache = cube_cache.get_cube_cache(self.configuration)
+        key = None
+        if cache is not None and self._cache_key is not None:
+            key = cube_cache.data_info_key(self._cache_key, self.configuration)
+            results = cache.get_meta(key)
+            if results is not None:
+                return results
+
+        self.restore_workspaces(events=True)
+        workspace = api.mtd[self._event_workspace]
+        # Bin the events before looking for the peaks, to find them in the detector image of the cube
+        self.configuration.tof_range = get_tof_range(workspace, self.configuration.wl_bandwidth)
+        self.tof_edges = self.compute_tof_edges()
+        self.prepare_plot_data()
+        # The x-projections of the other cross-sections are scanned along with this one, but only
+        # when their cubes were already binned or are in the cube cache: their events are not binned here
+        other_x_profiles = []
+        for cross_section in other_cross_sections or []:
+            if cross_section.xtofdata is None:
+                # Look for the cube binned with the TOF range they get from this cross-section
+                cross_section.configuration.tof_range = self.configuration.tof_range
+                cross_section.tof_edges = cross_section.compute_tof_edges()
+                if not cross_section._read_cached_plot_data():
+                    continue
+            other_x_profiles.append(cross_section.xydata.sum(axis=0))
+        data_info = DataInfo(
+            workspace,
+            self.name,
+            self.configuration,
+            detector_image=self.detector_image,
+            other_x_profiles=other_x_profiles,
+        )
+        results = {attr: getattr(data_info, attr) for attr in DATA_INFO_RESULTS}
+        if key is not None:
+            cache.put_meta(key, results)
+        return results
+
     def get_counts_vs_TOF(self):
         """
         Used for normalization, returns ROI counts vs TOF.
@@ -1027,7 +1412,7 @@ class CrossSectionData(object):
         # DeleteWorkspace(ws)
         self._reflectivity_workspace = str(ws)
 
-    def offspec(self, direct_beam=None):
+    def offspec(self, direct_beam=None, geometries=None):
         """
         Extract off-specular scattering from 4D dataset (x,y,ToF,I).
         Uses a window in y to filter the 4D data
@@ -1036,23 +1421,25 @@ class CrossSectionData(object):
         together with the tth-bank and direct pixel values.
 
         :param CrossSectionData direct_beam: if given, this data will be used to normalize the output
+        :param GeometryCache geometries: geometries shared with the other cross-sections of the run, if any
         """
         self.prepare_plot_data()
         if direct_beam:
             direct_beam.prepare_plot_data()
-        self.off_spec = OffSpecular(self)
+        self.off_spec = OffSpecular(self, geometries.get(self) if geometries is not None else None)
         return self.off_spec(direct_beam)
 
-    def gisans(self, direct_beam=None):
+    def gisans(self, direct_beam=None, geometries=None):
         """
         Compute GISANS
 
         :param CrossSectionData direct_beam: if given, this data will be used to normalize the output
+        :param GeometryCache geometries: geometries shared with the other cross-sections of the run, if any
         """
         self.prepare_plot_data()
         if direct_beam:
             direct_beam.prepare_plot_data()
-        self.gisans_data = GISANS(self)
+        self.gisans_data = GISANS(self, geometries.get(self) if geometries is not None else None)
         self.gisans_data(direct_beam)
 
         self.SGrid = self.gisans_data.SGrid
@@ -0,0 +1,169 @@
+"""
+Scattering geometry shared by the cross-sections of a run.
+
+The angles of the detector pixels and the wavelengths of the TOF bins only depend on
+the instrument geometry, the angle and pixel parameters and the TOF binning. These are
+the same for all the cross-sections of a run, so the off-specular and GISANS
+calculations of the cross-sections use a single RunGeometry, kept by the NexusData
+object of the run, instead of computing their own copy.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+H_OVER_M_NEUTRON = 3.956034e-7  # h/m_n [m^2/s]
+
+
+def geometry_key(cross_section):
+    """
+    Values of the parameters of a cross-section that the geometry depends on.
+    Cross-sections with the same key share the same geometry.
+    :param CrossSectionData cross_section: processed data object
+    """
+    tof_edges = np.asarray(cross_section.tof_edges, dtype=float)
+    return (
+        float(cross_section.direct_pixel),
+        float(cross_section.dangle),
+        float(cross_section.angle_offset),
+        float(cross_section.configuration.peak_position),
+        float(cross_section.configuration.low_res_position),
+        float(cross_section.det_size_x),
+        float(cross_section.dist_sam_det),
+        float(cross_section.dist_mod_det),
+        tuple(cross_section.xydata.shape),
+        tuple(cross_section.data.shape[:2]),
+        tof_edges.tobytes(),
+    )
+
+
+def _read_only(*arrays):
+    """Protect arrays shared between cross-sections from being modified in place"""
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays
+
+
+class RunGeometry(object):
+    """
+    Angles of the detector pixels and wave vectors of the TOF bins of a run
+    """
+
+    def __init__(self, cross_section):
+        """
+        :param CrossSectionData cross_section: processed data object of one of the cross-sections of the run
+        """
+        self.key = geometry_key(cross_section)
+
+        rad_per_pixel = cross_section.det_size_x / cross_section.dist_sam_det / cross_section.xydata.shape[1]
+
+        # Angles of all the pixels in the scattering direction
+        xtth = cross_section.direct_pixel - np.arange(cross_section.data.shape[0])
+        pix_offset_spec = cross_section.direct_pixel - cross_section.configuration.peak_position
+        delta_dangle = cross_section.dangle - cross_section.angle_offset
+        tth_spec = delta_dangle * np.pi / 180.0 + pix_offset_spec * rad_per_pixel
+        self.af = delta_dangle * np.pi / 180.0 + xtth * rad_per_pixel - tth_spec / 2.0
+        self.ai = np.ones_like(self.af) * tth_spec / 2.0
+
+        # Angles of all the pixels in the low-resolution direction
+        self.phi = (
+            np.arange(cross_section.data.shape[1]) - cross_section.configuration.low_res_position
+        ) * rad_per_pixel
+
+        v_edges = cross_section.dist_mod_det / np.asarray(cross_section.tof_edges) * 1e6  # m/s
+        self.lambda_edges = H_OVER_M_NEUTRON / v_edges * 1e10  # A
+        self.wavelengths = np.asarray((self.lambda_edges[:-1] + self.lambda_edges[1:]) / 2.0)
+        # The resolution for lambda is digital range with equal probability
+        # therefore it is the bin size divided by sqrt(12)
+        self.d_wavelength = np.abs(self.lambda_edges[:-1] - self.lambda_edges[1:]) / np.sqrt(12)
+        self.k = 2.0 * np.pi / self.wavelengths
+        _read_only(self.af, self.ai, self.phi, self.lambda_edges, self.wavelengths, self.d_wavelength, self.k)
+
+        # [pixel][TOF] arrays computed for a range of pixels, see offspec_coordinates() and gisans_factors()
+        self._offspec_coordinates = {}
+        self._gisans_factors = {}
+        # Assignments of off-specular data points to bins, see off_specular.binned_grid()
+        self.binned_grids = {}
+
+    def offspec_coordinates(self, x_min, x_max):
+        """
+        Qx, Qz, ki_z and kf_z, indexed as [x][TOF], for a range of pixels in the scattering direction
+        :param int x_min: first pixel
+        :param int x_max: pixel after the last one
+        """
+        area = (int(x_min), int(x_max))
+        if area not in self._offspec_coordinates:
+            af = self.af[area[0] : area[1]]
+            ai = self.ai[area[0] : area[1]]
+            k = self.k[np.newaxis, :]
+            self._offspec_coordinates[area] = _read_only(
+                k * (np.cos(af) - np.cos(ai))[:, np.newaxis],
+                k * (np.sin(af) + np.sin(ai))[:, np.newaxis],
+                k * np.sin(ai)[:, np.newaxis],
+                k * np.sin(af)[:, np.newaxis],
+            )
+        return self._offspec_coordinates[area]
+
+    def gisans_factors(self, active_area_x, active_area_y):
+        """
+        Factors of the GISANS coordinates that depend on the pixel position: the Qy factor,
+        indexed as [x][y], and sin(ai) and sin(af), indexed as [x]
+        :param active_area_x: first pixel and pixel after the last one in the scattering direction
+        :param active_area_y: first pixel and pixel after the last one in the low-resolution direction
+        """
+        area = (int(active_area_x[0]), int(active_area_x[1]), int(active_area_y[0]), int(active_area_y[1]))
+        if area not in self._gisans_factors:
+            af = self.af[area[0] : area[1]]
+            ai = self.ai[area[0] : area[1]]
+            phi = self.phi[area[2] : area[3]]
+            self._gisans_factors[area] = _read_only(np.sin(phi) * np.cos(af)[:, np.newaxis], np.sin(ai), np.sin(af))
+        return self._gisans_factors[area]
+
+    def get_memory_size(self):
+        """
+        Number of bytes held in memory by the geometry arrays
+        """
+        arrays = [value for value in vars(self).values() if isinstance(value, np.ndarray)]
+        for cached in [self._offspec_coordinates, self._gisans_factors]:
+            for item in cached.values():
+                arrays.extend(item)
+        grids_size = sum(grid.get_memory_size() for grid in self.binned_grids.values())
+        return sum(array.nbytes for array in arrays) + grids_size
+
+
+class GeometryCache(object):
+    """
+    Geometries of the cross-sections of a run. Cross-sections with the same angle, pixel
+    and TOF parameters share one geometry, which is computed again when these parameters change.
+    """
+
+    def __init__(self, max_size=4):
+        """
+        :param int max_size: number of geometries to keep, the oldest ones are dropped first
+        """
+        self.max_size = max_size
+        self._geometries = OrderedDict()
+
+    def __len__(self):
+        return len(self._geometries)
+
+    def clear(self):
+        self._geometries = OrderedDict()
+
+    def get(self, cross_section):
+        """
+        Geometry of a cross-section, computed if no other cross-section of the run has the same parameters
+        :param CrossSectionData cross_section: processed data object
+        """
+        key = geometry_key(cross_section)
+        if key not in self._geometries:
+            self._geometries[key] = RunGeometry(cross_section)
+            while len(self._geometries) > self.max_size:
+                self._geometries.popitem(last=False)
+        return self._geometries[key]
+
+    def get_memory_size(self):
+        """
+        Number of bytes held in memory by the geometries
+        """
+        return sum(geometry.get_memory_size() for geometry in self._geometries.values())
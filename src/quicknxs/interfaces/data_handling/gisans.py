@@ -3,13 +3,16 @@ Computations for GISANS
 """
 
 import logging
-from multiprocessing import Pool
+from types import SimpleNamespace
 
 import numpy as np
 
 from quicknxs.interfaces.configuration import get_direct_beam_low_res_roi
+from quicknxs.interfaces.data_handling.geometry import RunGeometry
+from quicknxs.interfaces.data_handling.worker_pool import SharedArrays, attached_arrays, get_worker_pool
 
-H_OVER_M_NEUTRON = 3.956034e-7  # h/m_n [m^2/s]
+# Number of data points for which the Q coordinates are computed at once when rebinning
+CHUNK_POINTS = 2**21
 
 
 class GISANS(object):
@@ -17,9 +20,11 @@ class GISANS(object):
     Compute grazing-incident SANS
     """
 
-    def __init__(self, cross_section_data):
+    def __init__(self, cross_section_data, geometry=None):
         """
         :param CrossSectionData cross_section_data: processed data object
+        :param RunGeometry geometry: geometry of the run, shared with the other cross-sections.
+            If None, it is computed for this cross-section.
 
         The calculations here are meant to match QuickNXS v1. The following are
         items to improve on:
@@ -28,50 +33,35 @@ class GISANS(object):
 
         """
         self.data_set = cross_section_data
+        self.geometry = geometry
 
     def __call__(self, direct_beam=None):
-        x_pos = self.data_set.configuration.peak_position
-        y_pos = self.data_set.configuration.low_res_position
         scale = 1.0 / self.data_set.proton_charge * self.data_set.configuration.scaling_factor
 
-        rad_per_pixel = self.data_set.det_size_x / self.data_set.dist_sam_det / self.data_set.xydata.shape[1]
-
         # QuickNXS v1 uses the whole detector for GISANS calculations and doesn't trim the edges
         # active_area_x = self.data_set.active_area_x
         # active_area_y = self.data_set.active_area_y
         active_area_x = [0, 304]
         active_area_y = [0, 256]
-        xtth = self.data_set.direct_pixel - np.arange(self.data_set.data.shape[0])[active_area_x[0] : active_area_x[1]]
-        pix_offset_spec = self.data_set.direct_pixel - x_pos
-        delta_dangle = self.data_set.dangle - self.data_set.angle_offset
-        tth_spec = delta_dangle * np.pi / 180.0 + pix_offset_spec * rad_per_pixel
-        af = delta_dangle * np.pi / 180.0 + xtth * rad_per_pixel - tth_spec / 2.0
-        ai = np.ones_like(af) * tth_spec / 2.0
-
-        phi = (np.arange(self.data_set.data.shape[1])[active_area_y[0] : active_area_y[1]] - y_pos) * rad_per_pixel
 
         # To be compatible with QuickNXS v1, take the whole TOF range rather than trimming the edges
         # ws = self.data_set.event_workspace
         # tof_edges = np.arange(ws.getTofMin(), ws.getTofMax(), self.data_set.configuration.tof_bins)
-        tof_edges = self.data_set.tof_edges
+        if self.geometry is None:
+            self.geometry = RunGeometry(self.data_set)
 
-        v_edges = self.data_set.dist_mod_det / tof_edges * 1e6  # m/s
-        lambda_edges = H_OVER_M_NEUTRON / v_edges * 1e10  # A
-
-        wavelengths = np.asarray((lambda_edges[:-1] + lambda_edges[1:]) / 2.0)
-        k = 2.0 * np.pi / wavelengths
         # calculate ROI intensities and normalize by number of points
         # Note: the number of points here may need to be adjusted from the specular reflectivity
         # calculation if we used a final rebining.
         P0 = self.data_set.configuration.cut_first_n_points
         PN = len(self.data_set.tof) - self.data_set.configuration.cut_last_n_points
-        self.wavelengths = wavelengths[P0:PN]
+        self.wavelengths = self.geometry.wavelengths[P0:PN]
 
-        # calculate reciprocal space, incident and outgoing perpendicular wave vectors
-        self.Qy = k[np.newaxis, np.newaxis, P0:PN] * (np.sin(phi) * np.cos(af)[:, np.newaxis])[:, :, np.newaxis]
-        p_i = k[np.newaxis, np.newaxis, P0:PN] * ((0.0 * phi) + np.sin(ai)[:, np.newaxis])[:, :, np.newaxis]
-        self.p_f = k[np.newaxis, np.newaxis, P0:PN] * ((0.0 * phi) + np.sin(af)[:, np.newaxis])[:, :, np.newaxis]
-        self.Qz = p_i + self.p_f
+        # The reciprocal space coordinates, incident and outgoing perpendicular wave vectors
+        # are outer products of k with functions of the pixel position: keep the factors
+        # and compute the [x][y][wavelength] arrays when needed, see q_coordinates()
+        self.k = self.geometry.k[P0:PN]
+        self._factors = self.geometry.gisans_factors(active_area_x, active_area_y)
 
         raw = self.data_set.data[active_area_x[0] : active_area_x[1], active_area_y[0] : active_area_y[1], P0:PN]
 
@@ -111,22 +101,194 @@ class GISANS(object):
 
         # Create plotting data
         # TODO: use options to plot the right data (for instance: qz or pf)
-        self.SGrid, qy, qz = np.histogram2d(
-            self.Qy.flatten(), self.Qz.flatten(), bins=(50, 50), weights=intensity.flatten()
-        )
-        npoints, _, _ = np.histogram2d(self.Qy.flatten(), self.Qz.flatten(), bins=(50, 50))
-        self.SGrid[npoints > 0] /= npoints[npoints > 0]
-        self.SGrid = self.SGrid.transpose()
+        histogram = Histogram2D.for_runs([self], -np.inf, np.inf, (50, 50), use_pf=False)
+        npoints, sgrid = histogram.sums()[:2]
+        sgrid[npoints > 0] /= npoints[npoints > 0]
+        self.SGrid = sgrid.transpose()
+        qy, qz = histogram.edges
         qy = (qy[:-1] + qy[1:]) / 2.0
         qz = (qz[:-1] + qz[1:]) / 2.0
         self.QyGrid, self.QzGrid = np.meshgrid(qy, qz)
 
+    @property
+    def qy_factor(self):
+        return self._factors[0]
+
+    @property
+    def sin_ai(self):
+        return self._factors[1]
+
+    @property
+    def sin_af(self):
+        return self._factors[2]
+
+    def q_coordinates(self, rows=slice(None), selected=slice(None)):
+        """
+        Qy, Qz and pf arrays, indexed as [x][y][wavelength]
+        :param slice rows: detector rows (x pixels) to compute
+        :param selected: indices of the wavelengths to compute
+        """
+        return _band_data(self, rows, selected)[:3]
+
+    @property
+    def Qy(self):
+        return self.q_coordinates()[0]
+
+    @property
+    def Qz(self):
+        return self.q_coordinates()[1]
+
+    @property
+    def p_f(self):
+        return self.q_coordinates()[2]
+
+
+def _band_selection(wavelengths, wl_min, wl_max):
+    """
+    Indices of the wavelengths within a band, as a slice if they are contiguous
+    """
+    selected = np.flatnonzero((wavelengths >= wl_min) & (wavelengths <= wl_max))
+    if len(selected) > 0 and selected[-1] - selected[0] + 1 == len(selected):
+        # A contiguous band can be selected with views rather than copies
+        selected = slice(selected[0], selected[-1] + 1)
+    return selected
+
+
+def _band_data(gisans, rows, selected):
+    """
+    Qy, Qz, pf, S, dS and wavelength of the points of a GISANS data set for a range of
+    detector rows and a selection of wavelengths, as [x][y][wavelength] arrays.
+    The values are computed as k * sin(phi) * cos(af), k * sin(ai) + k * sin(af) and k * sin(af).
+    """
+    k = gisans.k[selected]
+    qy = k * gisans.qy_factor[rows][:, :, np.newaxis]
+    p_i = k * gisans.sin_ai[rows][:, np.newaxis, np.newaxis]
+    p_f = k * gisans.sin_af[rows][:, np.newaxis, np.newaxis]
+    # Qz and pf do not depend on y
+    qz = np.broadcast_to(p_i + p_f, qy.shape)
+    p_f = np.broadcast_to(p_f, qy.shape)
+    wavelengths = np.broadcast_to(gisans.wavelengths[selected], qy.shape)
+    return qy, qz, p_f, gisans.S[rows][:, :, selected], gisans.dS[rows][:, :, selected], wavelengths
+
+
+def _iter_chunks(runs, wl_min, wl_max, use_pf, dtype=None):
+    """
+    Iterate over the data points of GISANS data sets within a wavelength band, in blocks of
+    detector rows of about CHUNK_POINTS points. Yields flat Qy, Qz or pf, S and dS arrays, in the
+    order of the points in the merged arrays.
+    """
+    z_index = 2 if use_pf else 1
+    for run in runs:
+        selected = _band_selection(run.wavelengths, wl_min, wl_max)
+        n_rows, n_y = run.qy_factor.shape
+        n_points_per_row = max(n_y * len(run.k[selected]), 1)
+        step = max(CHUNK_POINTS // n_points_per_row, 1)
+        for start in range(0, n_rows, step):
+            data = _band_data(run, slice(start, start + step), selected)
+            yield tuple(np.ravel(np.asarray(data[i], dtype=dtype)) for i in (0, z_index, 3, 4))
+
+
+class Histogram2D(object):
+    """
+    2D histogram of data points given in chunks, with the same bins and sums as np.histogram2d
+    over all the points at once: the weighted sums are accumulated in the order of the points.
+    """
+
+    def __init__(self, qy_edges, z_edges):
+        self.edges = (qy_edges, z_edges)
+        # Bins include an outlier on each end, as in np.histogramdd
+        self._nbin = (len(qy_edges) + 1, len(z_edges) + 1)
+        size = self._nbin[0] * self._nbin[1]
+        self._n_points = np.zeros(size, dtype=np.intp)
+        self._intensity_summed = np.zeros(size)
+        self._intensity_err = np.zeros(size)
+
+    @classmethod
+    def for_runs(cls, runs, wl_min, wl_max, binning, use_pf, dtype=None):
+        """
+        Histogram of the data points of GISANS data sets within a wavelength band, with the bins
+        np.histogram2d would use for the merged points. The Q coordinates are computed twice,
+        to find the range of the bins and then to fill them, rather than stored.
+        :param list runs: GISANS objects
+        :param tuple binning: number of bins along Qy and Qz
+        """
+        lower, upper = None, None
+        for qy, _z_axis, _, _ in _iter_chunks(runs, wl_min, wl_max, use_pf, dtype):
+            if qy.size > 0:
+                chunk_lower, chunk_upper = [qy.min(), _z_axis.min()], [qy.max(), _z_axis.max()]
+                lower = chunk_lower if lower is None else [min(a, b) for a, b in zip(lower, chunk_lower)]
+                upper = chunk_upper if upper is None else [max(a, b) for a, b in zip(upper, chunk_upper)]
+        value_range = None if lower is None else list(zip(lower, upper))
+        empty = np.empty(0, dtype=dtype)
+        _, qy_edges, z_edges = np.histogram2d(empty, empty, bins=binning, range=value_range)
+
+        histogram = cls(qy_edges, z_edges)
+        for chunk in _iter_chunks(runs, wl_min, wl_max, use_pf, dtype):
+            histogram.add(*chunk)
+        return histogram
+
+    def add(self, qy, _z_axis, intensity, d_intensity):
+        """
+        Add data points to the histogram
+        """
+        index = []
+        for values, edges in zip((qy, _z_axis), self.edges):
+            # Values on the last edge belong to the last bin
+            bins = np.searchsorted(edges, values, side="right")
+            bins[values == edges[-1]] -= 1
+            index.append(bins)
+        flat_index = np.ravel_multi_index(index, self._nbin)
+        self._n_points += np.bincount(flat_index, minlength=len(self._n_points))
+        np.add.at(self._intensity_summed, flat_index, intensity)
+        np.add.at(self._intensity_err, flat_index, d_intensity**2)
+
+    def sums(self):
+        """
+        Number of points, sum of the intensities and sum of the squared errors in each bin
+        """
+        core = (slice(1, -1), slice(1, -1))
+        return [
+            values.reshape(self._nbin)[core].astype(float)
+            for values in (self._n_points, self._intensity_summed, self._intensity_err)
+        ]
+
+    def result(self):
+        """
+        Average intensity and error in each bin, and bin centers
+        """
+        n_points, intensity_summed, intensity_err = self.sums()
+        intensity_summed[n_points > 0] /= n_points[n_points > 0]
+        intensity_err = np.sqrt(intensity_err)
+        intensity_err[n_points > 0] /= n_points[n_points > 0]
+
+        qy_edges, qz_edges = self.edges
+        _qy = (qy_edges[:-1] + qy_edges[1:]) / 2.0
+        _qz_axis = (qz_edges[:-1] + qz_edges[1:]) / 2.0
+
+        return intensity_summed, _qy, _qz_axis, intensity_err
+
+
+def iter_merge(reduction_list, pol_state, wl_min=0, wl_max=100, dtype=None):
+    """
+    Iterate over the GISANS data of the runs of a reduction list, without merging them.
+    For each run, yields the same arrays as merge() for the run alone.
+    :param list reduction_list: list of NexusData objects
+    :param string pol_state: polarization state to consider
+    :param dtype: type of the arrays, the type of the data by default
+    """
+    for item in reduction_list:
+        gisans = item.cross_sections[pol_state].gisans_data
+        data = _band_data(gisans, slice(None), _band_selection(gisans.wavelengths, wl_min, wl_max))
+        yield tuple(np.ravel(np.asarray(array, dtype=dtype)) for array in data)
 
-def merge(reduction_list, pol_state, wl_min=0, wl_max=100):
+
+def merge(reduction_list, pol_state, wl_min=0, wl_max=100, dtype=float):
     """
     Merge the off-specular data from a reduction list.
     :param list reduction_list: list of NexusData objects
     :param string pol_state: polarization state to consider
+    :param dtype: type of the merged arrays
+    :returns: Qy, Qz, pf, S, dS and wavelength of each data point
 
     The scaling factors should have been determined at this point. Just use them
     to merge the different runs in a set.
@@ -134,105 +296,88 @@ def merge(reduction_list, pol_state, wl_min=0, wl_max=100):
     TODO: This doesn't deal with the overlap properly. It assumes that the user
     cut the overlapping points by hand.
     """
-    _qy = np.zeros(0)
-    _qz = np.zeros(0)
-    _pf = np.zeros(0)
-    _s = np.zeros(0)
-    _ds = np.zeros(0)
-    _wl = np.zeros(0)
-
+    run_data = []
     for item in reduction_list:
         gisans = item.cross_sections[pol_state].gisans_data
-        Qy, Qz, pf, S, dS = (gisans.Qy, gisans.Qz, gisans.p_f, gisans.S, gisans.dS)
-
-        # Filter according to wavelength
-        filtered = np.where((gisans.wavelengths >= wl_min) & (gisans.wavelengths <= wl_max))
-        _qy = np.concatenate((_qy, Qy[:, :, filtered].flatten()))
-        _qz = np.concatenate((_qz, Qz[:, :, filtered].flatten()))
-        _pf = np.concatenate((_pf, pf[:, :, filtered].flatten()))
-        _s = np.concatenate((_s, S[:, :, filtered].flatten()))
-        _ds = np.concatenate((_ds, dS[:, :, filtered].flatten()))
-        _wl = np.concatenate((_wl, gisans.wavelengths[filtered]))
-
+        run_data.append(_band_data(gisans, slice(None), _band_selection(gisans.wavelengths, wl_min, wl_max)))
+    n_points = sum(data[0].size for data in run_data)
+    merged = [np.empty(n_points, dtype=dtype) for _ in range(6)]
+
+    # Copy each run into its section of the merged arrays
+    start = 0
+    for data in run_data:
+        stop = start + data[0].size
+        for output, array in zip(merged, data):
+            output[start:stop].reshape(array.shape)[...] = array
+        start = stop
+
+    _qy, _qz, _pf, _s, _ds, _wl = merged
     return _qy, _qz, _pf, _s, _ds, _wl
 
 
-def rebin_extract(reduction_list, pol_state, wl_min, wl_max, qy_npts=50, qz_npts=50, use_pf=False):
-    binning = (qy_npts + 1, qz_npts + 1)
-    qy, qz, pf, intensity, d_intensity, _ = merge(reduction_list, pol_state, wl_min=wl_min, wl_max=wl_max)
-    if use_pf:
-        _z_axis = pf
-    else:
-        _z_axis = qz
-
-    n_points, _qy, _qz_axis = np.histogram2d(qy, _z_axis, bins=binning)
-    _intensity_summed, _, _ = np.histogram2d(qy, _z_axis, bins=(_qy, _qz_axis), weights=intensity)
-    _intensity_err, _, _ = np.histogram2d(qy, _z_axis, bins=(_qy, _qz_axis), weights=d_intensity**2)
+def rebin_extract(reduction_list, pol_state, wl_min, wl_max, qy_npts=50, qz_npts=50, use_pf=False, dtype=float):
+    """
+    Rebin the GISANS data of a wavelength band.
+    The result is that of np.histogram2d over the merged data, but the Q coordinates
+    of the runs are computed chunk by chunk rather than merged.
 
-    _intensity_summed[n_points > 0] /= n_points[n_points > 0]
-    _intensity_err = np.sqrt(_intensity_err)
-    _intensity_err[n_points > 0] /= n_points[n_points > 0]
+    :param dtype: type of the data points
+    """
+    binning = (qy_npts + 1, qz_npts + 1)
+    runs = [item.cross_sections[pol_state].gisans_data for item in reduction_list]
+    return Histogram2D.for_runs(runs, wl_min, wl_max, binning, use_pf, dtype).result()
 
-    _qy = (_qy[:-1] + _qy[1:]) / 2.0
-    _qz_axis = (_qz_axis[:-1] + _qz_axis[1:]) / 2.0
 
-    return _intensity_summed, _qy, _qz_axis, _intensity_err
+# Arrays of a GISANS data set needed to rebin it
+_RUN_ARRAYS = ["k", "wavelengths", "qy_factor", "sin_ai", "sin_af", "S", "dS"]
 
 
 def _rebin_proc(data):
-    # Filter data
-    wl = data["wl"]
-    filtered = np.where((wl >= data["wl_min"]) & (wl <= data["wl_max"]))
-    qy = data["qy"][filtered]
-    _z_axis = data["qz"][filtered]
-    intensity = data["intensity"][filtered]
-    d_intensity = data["d_intensity"][filtered]
-
-    # Perform binning
-    n_points, _qy, _qz_axis = np.histogram2d(qy, _z_axis, bins=data["binning"])
-    _intensity_summed, _, _ = np.histogram2d(qy, _z_axis, bins=(_qy, _qz_axis), weights=intensity)
-    _intensity_err, _, _ = np.histogram2d(qy, _z_axis, bins=(_qy, _qz_axis), weights=d_intensity**2)
-
-    _intensity_summed[n_points > 0] /= n_points[n_points > 0]
-    _intensity_err = np.sqrt(_intensity_err)
-    _intensity_err[n_points > 0] /= n_points[n_points > 0]
-
-    _qy = (_qy[:-1] + _qy[1:]) / 2.0
-    _qz_axis = (_qz_axis[:-1] + _qz_axis[1:]) / 2.0
-
-    return _intensity_summed, _qy, _qz_axis, _intensity_err
-
-
-def rebin_parallel(reduction_list, pol_state, wl_min, wl_max, wl_npts=2, qy_npts=50, qz_npts=50, use_pf=False):
     """
-    Process the wavelength bands in parallel.
+    Rebin a wavelength band in a worker process, reading the GISANS data from shared memory
+    """
+    with attached_arrays(data["arrays"]) as arrays:
+        runs = [
+            SimpleNamespace(**{name: arrays["%s_%s" % (name, i)] for name in _RUN_ARRAYS})
+            for i in range(data["n_runs"])
+        ]
+        histogram = Histogram2D.for_runs(runs, data["wl_min"], data["wl_max"], data["binning"], **data["options"])
+        return histogram.result()
+
+
+def rebin_parallel(
+    reduction_list, pol_state, wl_min, wl_max, wl_npts=2, qy_npts=50, qz_npts=50, use_pf=False, dtype=float
+):
+    """
+    Process the wavelength bands in parallel, with the application-wide worker pool.
+    The data is shared with the workers rather than copied to each of them.
+
+    :param dtype: type of the data points
     """
-    # First, merge all the data
     binning = (qy_npts + 1, qz_npts + 1)
-    qy, qz, pf, intensity, d_intensity, wl_array = merge(reduction_list, pol_state, wl_min=0, wl_max=100.0)
-    if use_pf:
-        _z_axis = pf
-    else:
-        _z_axis = qz
-
-    # Create one job per wavelength band
-    inputs = []
-    for i in range(wl_npts):
-        wl_step = (wl_max - wl_min) / wl_npts
-        _wl_min = wl_min + i * wl_step
-        _wl_max = wl_min + (i + 1) * wl_step
-        _d = dict(
-            qy=qy,
-            qz=_z_axis,
-            intensity=intensity,
-            d_intensity=d_intensity,
-            wl=wl_array,
-            wl_min=_wl_min,
-            wl_max=_wl_max,
-            binning=binning,
-        )
-        inputs.append(_d)
-
-    pool = Pool(wl_npts)
-    results = pool.map(_rebin_proc, inputs)
-    return results
+    runs = [item.cross_sections[pol_state].gisans_data for item in reduction_list]
+
+    # One job per wavelength band
+    wl_step = (wl_max - wl_min) / wl_npts
+    bands = [(wl_min + i * wl_step, wl_min + (i + 1) * wl_step) for i in range(wl_npts)]
+
+    pool = get_worker_pool()
+    if pool is None:
+        return [Histogram2D.for_runs(runs, _min, _max, binning, use_pf, dtype).result() for _min, _max in bands]
+
+    run_arrays = {}
+    for i, run in enumerate(runs):
+        run_arrays.update({"%s_%s" % (name, i): getattr(run, name) for name in _RUN_ARRAYS})
+    with SharedArrays(**run_arrays) as arrays:
+        inputs = [
+            dict(
+                arrays=arrays,
+                n_runs=len(runs),
+                wl_min=_wl_min,
+                wl_max=_wl_max,
+                binning=binning,
+                options=dict(use_pf=use_pf, dtype=dtype),
+            )
+            for _wl_min, _wl_max in bands
+        ]
+        return pool.map(_rebin_proc, inputs)
@@ -12,6 +12,7 @@ import math
 import random
 import string
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import mantid.simpleapi as api
 import numpy as np
@@ -104,9 +105,10 @@ def get_dead_time_correction(ws, configuration, error_ws=None):
         DeadTime=configuration.deadtime_value,
         TOFStep=configuration.deadtime_tof_step,
         TOFRange=[tof_min, tof_max],
-        OutputWorkspace="corr",
+        OutputWorkspace="%s_corr" % str(ws),
     )
-    corr_ws = api.Rebin(corr_ws, [tof_min, 10, tof_max])
+    # the correction is only kept until it is applied, so it is not stored in the ADS
+    corr_ws = api.Rebin(corr_ws, [tof_min, 10, tof_max], StoreInADS=False)
     return corr_ws
 
 
@@ -166,6 +168,8 @@ class Instrument(object):
     legacy_search_template = "/SNS/REF_M/*/data/REF_M_%s"
     # Option to use the slow flipper logs rather than the Analyzer/Polarizer logs
     USE_SLOW_FLIPPER_LOG = False
+    # Maximum number of data files loaded concurrently when adding runs together
+    MAX_LOAD_WORKERS = 4
 
     def __init__(self):
         # Filtering
@@ -228,56 +232,116 @@ class Instrument(object):
         # type: (unicode) -> WorkspaceGroup
         @brief Load one or more data sets according to the needs ot the instrument.
         @details This function assumes that when loading more than one data file, the files are congruent and their
-        events will be added together.
+        events will be added together. Files are loaded, filtered and corrected concurrently, and their
+        cross-sections are then summed pairwise.
         @param file_path: absolute path to one or more data files. If more than one, paths should be concatenated
         with the plus symbol '+'.
         @returns WorkspaceGroup with any number of cross-sections
         """
         fp_instance = FilePath(file_path)
-        xs_list = list()
-        temp_workspace_root_name = "".join(random.sample(string.ascii_letters, 12))  # random string of 12 characters
+        single_paths = fp_instance.single_paths
+        # random string of 12 characters for each file, used as the root name of its temporary workspaces
+        temp_workspace_root_names = ["".join(random.sample(string.ascii_letters, 12)) for _ in single_paths]
         workspace_root_name = fp_instance.run_numbers(string_representation="short")
-        _use_slow_flipper_log = self.USE_SLOW_FLIPPER_LOG
+        n_workers = max(1, min(len(single_paths), self.MAX_LOAD_WORKERS))
+
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            event_workspaces = list(pool.map(self._load_events, single_paths, temp_workspace_root_names))
+
+            # Once a file is found to be missing the analyzer/polarizer meta data,
+            # it and all the files that follow it are filtered using the slow logs.
+            use_slow_flipper_log = []
+            _use_slow_flipper_log = self.USE_SLOW_FLIPPER_LOG
+            for event_ws, path in zip(event_workspaces, single_paths):
+                if self._is_missing_flipper_meta_data(event_ws):
+                    _use_slow_flipper_log = True
+                    print("\n\nMISSING POLARIZER/ANALYZER META-DATA: USING SLOW LOGS\n\n")
+                use_slow_flipper_log.append(_use_slow_flipper_log)
+
+            path_xs_lists = list(
+                pool.map(
+                    lambda args: self._filter_cross_sections(*args, configuration=configuration),
+                    zip(single_paths, event_workspaces, temp_workspace_root_names, use_slow_flipper_log),
+                )
+            )
+            xs_list = self._sum_cross_sections(path_xs_lists, pool)
 
-        for path in fp_instance.single_paths:
-            event_ws = api.LoadEventNexus(Filename=path, OutputWorkspace="raw_events")
+        for ws in xs_list:  # replace the temporary names with the run number(s)
+            name_new = str(ws).replace(temp_workspace_root_names[0], workspace_root_name)
+            api.RenameWorkspace(str(ws), name_new)
 
-            # If the meta data is corrupted and we are missing analyzer/polarizer data, use the
-            # simple filtering.
-            polarizer = event_ws.getRun().getProperty("Polarizer").value[0]
-            analyzer = event_ws.getRun().getProperty("Analyzer").value[0]
-            missing_keys = (polarizer > 0 and self.pol_state not in event_ws.getRun()) or (
-                analyzer > 0 and self.ana_state not in event_ws.getRun()
+        # Insert a log indicating which run numbers contributed to this cross-section
+        for ws in xs_list:
+            api.AddSampleLog(
+                Workspace=str(ws),
+                LogName="run_numbers",
+                LogText=fp_instance.run_numbers(string_representation="short"),
+                LogType="String",
             )
 
-            if missing_keys:
-                _use_slow_flipper_log = True
-                print("\n\nMISSING POLARIZER/ANALYZER META-DATA: USING SLOW LOGS\n\n")
-
-            if _use_slow_flipper_log:
-                _path_xs_list = self.dummy_filter_cross_sections(event_ws, name_prefix=temp_workspace_root_name)
-            else:
-                _path_xs_list = api.MRFilterCrossSections(
-                    InputWorkspace=event_ws,
-                    PolState=self.pol_state,
-                    AnaState=self.ana_state,
-                    PolVeto=self.pol_veto,
-                    AnaVeto=self.ana_veto,
-                    CrossSectionWorkspaces="%s_entry" % temp_workspace_root_name,
-                )
+        return xs_list
 
-            # Remove workspaces with too few events
-            _path_xs_list = remove_low_event_workspaces(_path_xs_list, configuration.nbr_events_min)
+    def _is_missing_flipper_meta_data(self, event_ws):
+        """
+        Returns True if the polarizer or analyzer is in use but its state log is missing
+        :param EventWorkspace event_ws: workspace containing the unfiltered events
+        """
+        polarizer = event_ws.getRun().getProperty("Polarizer").value[0]
+        analyzer = event_ws.getRun().getProperty("Analyzer").value[0]
+        return (polarizer > 0 and self.pol_state not in event_ws.getRun()) or (
+            analyzer > 0 and self.ana_state not in event_ws.getRun()
+        )
+
+    @staticmethod
+    def _load_events(path, temp_workspace_root_name):
+        """
+        Load the events of a single data file
+        :param str path: absolute path to the data file
+        :param str temp_workspace_root_name: root name of the temporary workspaces for this file
+        """
+        return api.LoadEventNexus(Filename=path, OutputWorkspace="%s_raw_events" % temp_workspace_root_name)
 
-            if configuration is not None and configuration.apply_deadtime:
-                # Load error events from the bank_error_events entry
-                err_ws = api.LoadErrorEventsNexus(path)
+    def _filter_cross_sections(
+        self, path, event_ws, temp_workspace_root_name, use_slow_flipper_log, configuration=None
+    ):
+        """
+        Split the events of a single data file into cross-sections and apply the dead-time correction
+        :param str path: absolute path to the data file
+        :param EventWorkspace event_ws: workspace containing the unfiltered events
+        :param str temp_workspace_root_name: root name of the temporary workspaces for this file
+        :param bool use_slow_flipper_log: if True, filter using the slow flipper logs
+        :param Configuration configuration: configuration holding the dead-time options
+        :returns list of cross-section workspaces
+        """
+        if use_slow_flipper_log:
+            _path_xs_list = self.dummy_filter_cross_sections(event_ws, name_prefix=temp_workspace_root_name)
+        else:
+            _path_xs_list = api.MRFilterCrossSections(
+                InputWorkspace=event_ws,
+                PolState=self.pol_state,
+                AnaState=self.ana_state,
+                PolVeto=self.pol_veto,
+                AnaVeto=self.ana_veto,
+                CrossSectionWorkspaces="%s_entry" % temp_workspace_root_name,
+            )
+        api.DeleteWorkspace(str(event_ws))
+
+        # Remove workspaces with too few events
+        _path_xs_list = remove_low_event_workspaces(_path_xs_list, configuration.nbr_events_min)
+
+        if configuration is not None and configuration.apply_deadtime:
+            # Load error events from the bank_error_events entry
+            err_events_ws = api.LoadErrorEventsNexus(path, OutputWorkspace="%s_err_events" % temp_workspace_root_name)
+            _err_list = None
+            try:
                 # Split error events by cross-section for compatibility with normal events
-                if _use_slow_flipper_log:
-                    _err_list = self.dummy_filter_cross_sections(err_ws, name_prefix=temp_workspace_root_name + "_err")
+                if use_slow_flipper_log:
+                    _err_list = self.dummy_filter_cross_sections(
+                        err_events_ws, name_prefix=temp_workspace_root_name + "_err"
+                    )
                 else:
                     _err_list = api.MRFilterCrossSections(
-                        InputWorkspace=err_ws,
+                        InputWorkspace=err_events_ws,
                         PolState=self.pol_state,
                         AnaState=self.ana_state,
                         PolVeto=self.pol_veto,
@@ -301,32 +365,46 @@ class Instrument(object):
                             print("Could not find error events for [%s]" % xs_name)
                             _ws = apply_dead_time_correction(ws, configuration, error_ws=None)
                             path_xs_list.append(_ws)
-            else:
-                path_xs_list = [ws for ws in _path_xs_list if not ws.getRun()["cross_section_id"].value == "unfiltered"]
-
-            if len(xs_list) == 0:  # initialize xs_list with the cross sections of the first data file
-                xs_list = path_xs_list
-                for ws in xs_list:  # replace the temporary names with the run number(s)
-                    name_new = str(ws).replace(temp_workspace_root_name, workspace_root_name)
-                    api.RenameWorkspace(str(ws), name_new)
-            else:
-                for i, ws in enumerate(xs_list):
-                    api.Plus(
-                        LHSWorkspace=str(ws),
-                        RHSWorkspace=str(path_xs_list[i]),
-                        OutputWorkspace=str(ws),
-                    )
+            finally:
+                # the error events are only needed for the correction of this file
+                for err_ws in (_err_list, err_events_ws):
+                    if err_ws is not None and str(err_ws) in api.mtd:
+                        api.DeleteWorkspace(str(err_ws))
+        else:
+            path_xs_list = [ws for ws in _path_xs_list if not ws.getRun()["cross_section_id"].value == "unfiltered"]
+        return path_xs_list
 
-        # Insert a log indicating which run numbers contributed to this cross-section
-        for ws in xs_list:
-            api.AddSampleLog(
-                Workspace=str(ws),
-                LogName="run_numbers",
-                LogText=fp_instance.run_numbers(string_representation="short"),
-                LogType="String",
-            )
+    @staticmethod
+    def _sum_cross_sections(path_xs_lists, pool):
+        """
+        Add the cross-sections of each file together. Pairs of files are summed concurrently, in a
+        tree whose leaves are ordered as the files, so that the events of each cross-section are in
+        the same order as when summing the files one after the other.
+        The sum is stored in the workspaces of the first file.
+        :param list path_xs_lists: list of cross-section workspaces for each file
+        :param Executor pool: worker pool
+        :returns list of summed cross-section workspaces
+        """
 
-        return xs_list
+        def _plus(xs_lists):
+            lhs_list, rhs_list = xs_lists
+            for i, ws in enumerate(lhs_list):
+                api.Plus(
+                    LHSWorkspace=str(ws),
+                    RHSWorkspace=str(rhs_list[i]),
+                    OutputWorkspace=str(ws),
+                )
+            for ws in rhs_list:
+                api.DeleteWorkspace(str(ws))
+            return lhs_list
+
+        while len(path_xs_lists) > 1:
+            pairs = list(zip(path_xs_lists[0::2], path_xs_lists[1::2]))
+            summed = list(pool.map(_plus, pairs))
+            if len(path_xs_lists) % 2 == 1:
+                summed.append(path_xs_lists[-1])
+            path_xs_lists = summed
+        return path_xs_lists[0]
 
     @classmethod
     def mid_q_value(cls, ws):
@@ -456,9 +534,9 @@ class Instrument(object):
             NXPixel=self.n_x_pixel,
             NYPixel=self.n_y_pixel,
             ConvertToQ=False,
-            OutputWorkspace="ws_summed",
+            StoreInADS=False,
         )
 
-        integrated = api.Integration(ws_summed)
-        integrated = api.Transpose(integrated)
+        integrated = api.Integration(ws_summed, StoreInADS=False)
+        integrated = api.Transpose(integrated, StoreInADS=False)
         return integrated
@@ -4,15 +4,21 @@ Class to execute and hold the off-specular reflectivity calculation.
 """
 
 import logging
-from functools import reduce
-from multiprocessing import Pool
+import threading
 
 import numpy as np
-import scipy.stats
+from scipy.spatial import cKDTree
 
 from quicknxs.interfaces.configuration import Configuration, get_direct_beam_low_res_roi
+from quicknxs.interfaces.data_handling.geometry import RunGeometry
+from quicknxs.interfaces.data_handling.worker_pool import SharedArrays, attached_arrays, get_pool_size, get_worker_pool
 
-H_OVER_M_NEUTRON = 3.956034e-7  # h/m_n [m^2/s]
+# Below this number of data points, smoothing in the worker pool costs more than it saves
+PARALLEL_SMOOTHING_MIN_POINTS = 100000
+
+# The cross-sections of a run may be rebinned in several threads: the first one to need
+# the bin assignments of a geometry computes them, and the others wait to reuse them
+_grids_lock = threading.Lock()
 
 
 class OffSpecular(object):
@@ -20,19 +26,41 @@ class OffSpecular(object):
     Compute off-specular reflectivity
     """
 
-    d_wavelength = 0
-    Qx = None
-    Qz = None
-    ki_z = None
-    kf_z = None
     S = None
     dS = None
 
-    def __init__(self, cross_section_data):
+    def __init__(self, cross_section_data, geometry=None):
         """
         :param CrossSectionData cross_section_data: processed data object
+        :param RunGeometry geometry: geometry of the run, shared with the other cross-sections.
+            If None, it is computed for this cross-section.
         """
         self.data_set = cross_section_data
+        self.geometry = geometry
+        # First pixel and pixel after the last one of the coordinates, in the scattering direction
+        self.area_x = None
+        # Qx, Qz, ki_z and kf_z, owned by the geometry
+        self._coordinates = (None, None, None, None)
+
+    @property
+    def d_wavelength(self):
+        return self.geometry.d_wavelength if self.geometry is not None else 0
+
+    @property
+    def Qx(self):
+        return self._coordinates[0]
+
+    @property
+    def Qz(self):
+        return self._coordinates[1]
+
+    @property
+    def ki_z(self):
+        return self._coordinates[2]
+
+    @property
+    def kf_z(self):
+        return self._coordinates[3]
 
     def __call__(self, direct_beam=None):
         """
@@ -45,41 +73,19 @@ class OffSpecular(object):
         :param CrossSectionData direct_beam: if given, this data will be used to normalize the output
         """
         # TODO: correct for detector sensitivity
-        x_pos = self.data_set.configuration.peak_position
         scale = 1.0 / self.data_set.proton_charge
 
         # Range in low-res direction
         y_min, y_max = self.data_set.configuration.low_res_roi
 
-        rad_per_pixel = self.data_set.det_size_x / self.data_set.dist_sam_det / self.data_set.xydata.shape[1]
-
-        xtth = (
-            self.data_set.direct_pixel
-            - np.arange(self.data_set.data.shape[0])[self.data_set.active_area_x[0] : self.data_set.active_area_x[1]]
-        )
-        pix_offset_spec = self.data_set.direct_pixel - x_pos
-        delta_dangle = self.data_set.dangle - self.data_set.angle_offset
-        tth_spec = delta_dangle * np.pi / 180.0 + pix_offset_spec * rad_per_pixel
-        af = delta_dangle * np.pi / 180.0 + xtth * rad_per_pixel - tth_spec / 2.0
-        ai = np.ones_like(af) * tth_spec / 2.0
-
         # Background
         bck = self.data_set.get_background_vs_TOF() * scale
 
-        v_edges = self.data_set.dist_mod_det / self.data_set.tof_edges * 1e6  # m/s
-        lambda_edges = H_OVER_M_NEUTRON / v_edges * 1e10  # A
-
-        wl = (lambda_edges[:-1] + lambda_edges[1:]) / 2.0
-        # The resolution for lambda is digital range with equal probability
-        # therefore it is the bin size divided by sqrt(12)
-        self.d_wavelength = np.abs(lambda_edges[:-1] - lambda_edges[1:]) / np.sqrt(12)
-        k = 2.0 * np.pi / wl
-
-        # calculate reciprocal space, incident and outgoing perpendicular wave vectors
-        self.Qz = k[np.newaxis, :] * (np.sin(af) + np.sin(ai))[:, np.newaxis]
-        self.Qx = k[np.newaxis, :] * (np.cos(af) - np.cos(ai))[:, np.newaxis]
-        self.ki_z = k[np.newaxis, :] * np.sin(ai)[:, np.newaxis]
-        self.kf_z = k[np.newaxis, :] * np.sin(af)[:, np.newaxis]
+        # reciprocal space, incident and outgoing perpendicular wave vectors
+        if self.geometry is None:
+            self.geometry = RunGeometry(self.data_set)
+        self.area_x = (int(self.data_set.active_area_x[0]), int(self.data_set.active_area_x[1]))
+        self._coordinates = self.geometry.offspec_coordinates(*self.area_x)
 
         # calculate ROI intensities and normalize by number of points
         raw_multi_dim = self.data_set.data[
@@ -126,11 +132,39 @@ class OffSpecular(object):
             self.dS[:, np.logical_not(idxs)] = 0.0
 
 
-def merge(reduction_list, pol_state):
+def _cut_data(cross_section):
+    """
+    Qx, Qz, ki_z, kf_z, S and dS of a cross-section, as [pixel][TOF] views within the TOF cut range
+    """
+    offspec = cross_section.off_spec
+    n_total = len(offspec.S[0])
+    p_0 = cross_section.configuration.cut_first_n_points
+    p_n = n_total - cross_section.configuration.cut_last_n_points
+    return [array[:, p_0:p_n] for array in (offspec.Qx, offspec.Qz, offspec.ki_z, offspec.kf_z, offspec.S, offspec.dS)]
+
+
+def iter_merge(reduction_list, pol_state, dtype=None):
+    """
+    Iterate over the off-specular data of the runs of a reduction list, without merging them.
+    For each run, yields the same arrays as merge() for the run alone.
+    :param list reduction_list: list of NexusData objects
+    :param string pol_state: polarization state to consider
+    :param dtype: type of the arrays, the type of the data by default
+    """
+    for item in reduction_list:
+        # NOTE: need to unravel the arrays from [TOF][pixel] to [q_points]
+        Qx, Qz, ki_z, kf_z, S, dS = [
+            np.ravel(np.asarray(array, dtype=dtype)) for array in _cut_data(item.cross_sections[pol_state])
+        ]
+        yield Qx, Qz, ki_z, kf_z, ki_z - kf_z, S, dS
+
+
+def merge(reduction_list, pol_state, dtype=float):
     """
     Merge the off-specular data from a reduction list.
     :param list reduction_list: list of NexusData objects
     :param string pol_state: polarization state to consider
+    :param dtype: type of the merged arrays
 
     The scaling factors should have been determined at this point. Just use them
     to merge the different runs in a set.
@@ -138,35 +172,17 @@ def merge(reduction_list, pol_state):
     TODO: This doesn't deal with the overlap properly. It assumes that the user
     cut the overlapping points by hand.
     """
-    _qx = np.empty(0)
-    _qz = np.empty(0)
-    _ki_z = np.empty(0)
-    _kf_z = np.empty(0)
-    _s = np.empty(0)
-    _ds = np.empty(0)
-
-    for item in reduction_list:
-        offspec = item.cross_sections[pol_state].off_spec
-        Qx, Qz, ki_z, kf_z, S, dS = (offspec.Qx, offspec.Qz, offspec.ki_z, offspec.kf_z, offspec.S, offspec.dS)
-
-        n_total = len(S[0])
-        p_0 = item.cross_sections[pol_state].configuration.cut_first_n_points
-        p_n = n_total - item.cross_sections[pol_state].configuration.cut_last_n_points
-
-        # NOTE: need to unravel the arrays from [TOF][pixel] to [q_points]
-        Qx = np.ravel(Qx[:, p_0:p_n])
-        Qz = np.ravel(Qz[:, p_0:p_n])
-        ki_z = np.ravel(ki_z[:, p_0:p_n])
-        kf_z = np.ravel(kf_z[:, p_0:p_n])
-        S = np.ravel(S[:, p_0:p_n])
-        dS = np.ravel(dS[:, p_0:p_n])
-
-        _qx = np.concatenate((_qx, Qx))
-        _qz = np.concatenate((_qz, Qz))
-        _ki_z = np.concatenate((_ki_z, ki_z))
-        _kf_z = np.concatenate((_kf_z, kf_z))
-        _s = np.concatenate((_s, S))
-        _ds = np.concatenate((_ds, dS))
+    run_data = [_cut_data(item.cross_sections[pol_state]) for item in reduction_list]
+    n_points = sum(data[0].size for data in run_data)
+    _qx, _qz, _ki_z, _kf_z, _s, _ds = merged = [np.empty(n_points, dtype=dtype) for _ in range(6)]
+
+    # Copy each run into its section of the merged arrays, unravelled from [TOF][pixel] to [q_points]
+    start = 0
+    for data in run_data:
+        stop = start + data[0].size
+        for output, array in zip(merged, data):
+            output[start:stop].reshape(array.shape)[...] = array
+        start = stop
 
     return _qx, _qz, _ki_z, _kf_z, _ki_z - _kf_z, _s, _ds
 
@@ -183,6 +199,113 @@ def closest_bin(q, bin_edges):
     return None
 
 
+def _bin_edges(values, n_bins, value_range):
+    """
+    Edges of regular bins over a range, as computed by scipy.stats.binned_statistic_2d
+    """
+    v_min, v_max = value_range
+    if v_min == v_max:
+        v_min, v_max = v_min - 0.5, v_max + 0.5
+    dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else float
+    return np.linspace(v_min, v_max, n_bins + 1, dtype=dtype)
+
+
+def _bin_numbers(values, edges):
+    """
+    Bin of each value, -1 below the first edge and len(edges) - 1 above the last one.
+    Values on the last edge belong to the last bin, rounded as in scipy.stats.binned_statistic_2d.
+    """
+    index = np.digitize(values, edges)
+    decimal = int(-np.log10(np.diff(edges).min())) + 6
+    on_edge = (values >= edges[-1]) & (np.around(values, decimal) == np.around(edges[-1], decimal))
+    index[on_edge] -= 1
+    return index - 1
+
+
+class BinnedGrid(object):
+    """
+    Assignment of data points to a regular 2D grid of bins. It is computed once, and any
+    number of statistics are then accumulated with a single np.bincount each.
+    """
+
+    def __init__(self, x, y, bins, value_range):
+        """
+        :param numpy.ndarray x: x-values of the data points
+        :param numpy.ndarray y: y-values of the data points
+        :param list bins: number of bins along x and y
+        :param list value_range: [[x_min, x_max], [y_min, y_max]]
+        """
+        self.bins = (int(bins[0]), int(bins[1]))
+        self.value_range = (tuple(value_range[0]), tuple(value_range[1]))
+        self.edges = [_bin_edges(x, self.bins[0], value_range[0]), _bin_edges(y, self.bins[1], value_range[1])]
+        x_index = _bin_numbers(x, self.edges[0])
+        y_index = _bin_numbers(y, self.edges[1])
+        inside = (x_index >= 0) & (x_index < self.bins[0]) & (y_index >= 0) & (y_index < self.bins[1])
+        # Points within the grid, and their flat bin index
+        self._points = np.flatnonzero(inside)
+        self._flat_index = x_index[self._points] * self.bins[1] + y_index[self._points]
+
+    def sum(self, values=None):
+        """
+        Sum of the values of the points in each bin, or number of points in each bin
+        :param numpy.ndarray values: value of each data point
+        """
+        weights = None if values is None else values[self._points]
+        sums = np.bincount(self._flat_index, weights=weights, minlength=self.bins[0] * self.bins[1])
+        return sums.reshape(self.bins).astype(float, copy=False)
+
+    def get_memory_size(self):
+        """
+        Number of bytes held in memory by the grid
+        """
+        return sum(array.nbytes for array in [self._points, self._flat_index] + self.edges)
+
+
+# Number of grids kept by each geometry, the oldest ones are dropped first
+MAX_GRIDS_PER_GEOMETRY = 4
+
+
+def _coordinates_key(reduction_list, pol_state):
+    """
+    Parameters that the coordinates of the cut off-specular data of each run depend on,
+    or None if there are no runs or the geometry of one of them is not known
+    """
+    keys = []
+    for item in reduction_list:
+        cross_section = item.cross_sections[pol_state]
+        offspec = cross_section.off_spec
+        if offspec.geometry is None:
+            return None
+        configuration = cross_section.configuration
+        keys.append(
+            (offspec.geometry.key, offspec.area_x, configuration.cut_first_n_points, configuration.cut_last_n_points)
+        )
+    return tuple(keys) if keys else None
+
+
+def binned_grid(x, y, bins, value_range, geometry=None, key=None):
+    """
+    BinnedGrid for the given points and bins. With a geometry, the grid is kept by the geometry
+    and reused for the same key and bins, so that it is released with the run.
+    :param numpy.ndarray x: x-values of the data points
+    :param numpy.ndarray y: y-values of the data points
+    :param list bins: number of bins along x and y
+    :param list value_range: [[x_min, x_max], [y_min, y_max]]
+    :param RunGeometry geometry: geometry of the first run of the data points
+    :param tuple key: parameters that the values of the data points depend on
+    """
+    if geometry is None:
+        return BinnedGrid(x, y, bins, value_range)
+    key = (key, (int(bins[0]), int(bins[1])), (tuple(value_range[0]), tuple(value_range[1])))
+    grids = geometry.binned_grids
+    with _grids_lock:
+        if key not in grids:
+            grids[key] = BinnedGrid(x, y, bins, value_range)
+            while len(grids) > MAX_GRIDS_PER_GEOMETRY:
+                del grids[next(iter(grids))]
+        return grids[key]
+
+
 def rebin_extract(
     reduction_list,
     pol_state,
@@ -194,72 +317,76 @@ def rebin_extract(
     x_max=0.015,
     y_min=0,
     y_max=0.1,
+    chunked=False,
+    dtype=float,
 ):
     """
     Rebin off-specular data and extract cut at given Qz values.
-    Note: the analysis computers with RHEL7 have Scipy 0.12 installed, which makes
-    this code uglier. Refactor once we get a more recent version.
-    """
-    Qx, Qz, ki_z, kf_z, delta_k, S, dS = merge(reduction_list, pol_state)
+    The bins are the same as those of scipy.stats.binned_statistic_2d, and the assignment
+    of the data points to bins is kept by the geometry of the first run, to be reused by
+    the cross-sections sharing the same geometry.
 
+    :param bool chunked: if True, accumulate the runs one by one instead of merging them first.
+        The result may then differ from the merged one by rounding errors.
+    :param dtype: type of the merged data
+    """
     # Specify how many bins we want in each direction.
     _bins = [n_bins_x, n_bins_y]
+    _range = [[x_min, x_max], [y_min, y_max]]
 
-    # Specify the axes
+    # Specify the axes, as indices in the merged arrays Qx, Qz, ki_z, kf_z, ki_z-kf_z, S, dS
     if axes is None:
         axes = reduction_list[0].cross_sections[pol_state].configuration.off_spec_x_axis
     x_label = "ki_z-kf_z"
     y_label = "Qz"
-    x_values = delta_k
-    y_values = Qz
+    x_index, y_index = 4, 1
     if axes == Configuration.QX_VS_QZ:
         x_label = "Qx"
-        x_values = Qx
+        x_index = 0
     elif axes == Configuration.KZI_VS_KZF:
         x_label = "ki_z"
         y_label = "kf_z"
-        x_values = ki_z
-        y_values = kf_z
-
-    # Find the indices of S[TOF][main_axis_pixel] where we have non-zero data.
-    if use_weights:
-        # Compute the weighted average
-        # - Weighted sum
-        _r = S / dS**2
-        statistic, x_edge, y_edge, _ = scipy.stats.binned_statistic_2d(
-            x_values, y_values, _r, statistic="sum", range=[[x_min, x_max], [y_min, y_max]], bins=_bins
-        )
-        # - Sum of weights
-        _w = 1 / dS**2
-        w_statistic, _, _, _ = scipy.stats.binned_statistic_2d(
-            x_values, y_values, _w, statistic="sum", range=[[x_min, x_max], [y_min, y_max]], bins=[x_edge, y_edge]
-        )
+        x_index, y_index = 2, 3
 
-        result = statistic / w_statistic
-        result = result.T
-        error = np.sqrt(1.0 / w_statistic).T
-        result = np.nan_to_num(result)
-        error = np.nan_to_num(error)
+    if chunked and reduction_list:
+        chunks = iter_merge(reduction_list, pol_state, dtype=dtype)
+        chunk_runs = [[item] for item in reduction_list]
     else:
-        # Compute the simple average, with errors
-        statistic, x_edge, y_edge, _ = scipy.stats.binned_statistic_2d(
-            x_values, y_values, S, statistic="mean", range=[[x_min, x_max], [y_min, y_max]], bins=_bins
-        )
-        # Compute the errors
-        _w = dS**2
-        w_statistic, _, _, _ = scipy.stats.binned_statistic_2d(
-            x_values, y_values, _w, statistic="sum", range=[[x_min, x_max], [y_min, y_max]], bins=[x_edge, y_edge]
-        )
-
-        _c = np.ones(len(x_values))
-        counts, _, _, _ = scipy.stats.binned_statistic_2d(
-            x_values, y_values, _c, statistic="sum", range=[[x_min, x_max], [y_min, y_max]], bins=[x_edge, y_edge]
-        )
-
-        result = statistic.T
-        error = (np.sqrt(w_statistic) / counts).T
-        result = np.nan_to_num(result)
-        error = np.nan_to_num(error)
+        chunks = [merge(reduction_list, pol_state, dtype=dtype)]
+        chunk_runs = [reduction_list]
+
+    # Sum the statistics of each chunk: with use_weights, the weighted sum and the sum of weights,
+    # otherwise the number of points, the sum and the sum of the squared errors.
+    sums = None
+    for runs, chunk in zip(chunk_runs, chunks):
+        # The grid of a chunk is kept by the geometry of its first run
+        coordinates_key = _coordinates_key(runs, pol_state)
+        geometry = None if coordinates_key is None else runs[0].cross_sections[pol_state].off_spec.geometry
+        key = (x_index, y_index, np.dtype(dtype).str, coordinates_key)
+        grid = binned_grid(chunk[x_index], chunk[y_index], _bins, _range, geometry=geometry, key=key)
+        S, dS = chunk[5], chunk[6]
+        if use_weights:
+            chunk_sums = [grid.sum(S / dS**2), grid.sum(1 / dS**2)]
+        else:
+            chunk_sums = [grid.sum(), grid.sum(S), grid.sum(dS**2)]
+        sums = chunk_sums if sums is None else [total + value for total, value in zip(sums, chunk_sums)]
+    x_edge, y_edge = grid.edges
+
+    # Empty bins give NaN, set to zero below
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if use_weights:
+            # Compute the weighted average
+            statistic, w_statistic = sums
+            result = statistic / w_statistic
+            result = result.T
+            error = np.sqrt(1.0 / w_statistic).T
+        else:
+            # Compute the simple average, with errors
+            counts, statistic, w_statistic = sums
+            result = (statistic / counts).T
+            error = (np.sqrt(w_statistic) / counts).T
+    result = np.nan_to_num(result)
+    error = np.nan_to_num(error)
 
     x_middle = x_edge[:-1] + (x_edge[1] - x_edge[0]) / 2.0
     y_middle = y_edge[:-1] + (y_edge[1] - y_edge[0]) / 2.0
@@ -354,30 +481,20 @@ def _smooth_data(
     return Xout, Yout, Iout
 
 
-def proc(data):
-    """
-    Serializable function to be called by each thread
-    """
-    return _smooth_data(
-        x=data["x"],
-        y=data["y"],
-        I=data["I"],
-        sigmas=data["sigmas"],
-        gridx=data["gridx"],
-        gridy=data["gridy"],
-        sigmax=data["sigmax"],
-        sigmay=data["sigmay"],
-        x1=data["x1"],
-        x2=data["x2"],
-        y1=data["y1"],
-        y2=data["y2"],
-        axis_sigma_scaling=data["axis_sigma_scaling"],
-        xysigma0=data["xysigma0"],
-        indices=data["indices"],
-    )
+def _sigma_axis_values(X, Y, axis_sigma_scaling):
+    """
+    Value at each grid point that the sigmas are proportional to, for a given axis_sigma_scaling mode
+    """
+    if axis_sigma_scaling == 1:
+        return X
+    if axis_sigma_scaling == 2:
+        return Y
+    if axis_sigma_scaling == 3:
+        return X + Y
+    raise ValueError("Unknown axis_sigma_scaling: %s" % axis_sigma_scaling)
 
 
-def smooth_data(
+def smooth_data_kdtree(
     x,
     y,
     I,
@@ -392,45 +509,138 @@ def smooth_data(
     y2=0.1,
     axis_sigma_scaling=None,
     xysigma0=0.06,
-    pool=5,
+    rows=None,
 ):
     """
-    Execute legacy smoothing process by spreading it to a pool
-    of processes.
+    Smooth a irregular spaced dataset onto a regular grid, like _smooth_data.
+
+    Instead of computing the distance from each grid point to every data point, the data
+    points within sigmas*sigma of each grid point are gathered with a KD-tree built in units
+    of sigma. The weights are then computed exactly as in _smooth_data, over the same points
+    and in the same order.
+
+    :param numpy.ndarray x: x-values of the original data
+    :param numpy.ndarray y: y-values of the original data
+    :param numpy.ndarray I: Intensity values of the original data
+    :param float sigmas: Range in units of sigma to search around a grid point
+    :param int axis_sigma_scaling: Defines how the sigmas change with the x/y value
+    :param float xysigma0: x/y value where the given sigmas are used
+    :param tuple rows: first and last+1 grid rows to compute, all the rows by default
     """
-    pool = int(pool)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    I = np.asarray(I)
     xout = np.linspace(x1, x2, gridx)
-    p = Pool(pool)
-    n = len(xout)
-    step = int(n / pool)
-    indices = [[step * i, step * (i + 1)] for i in range(pool)]
-    indices[-1][1] = n
-
-    inputs = []
-    for i in range(pool):
-        _d = dict(
-            x=x,
-            y=y,
-            I=I,
-            sigmas=sigmas,
-            gridx=gridx,
-            gridy=gridy,
-            sigmax=sigmax,
-            sigmay=sigmay,
-            x1=x1,
-            x2=x2,
-            y1=y1,
-            y2=y2,
-            axis_sigma_scaling=axis_sigma_scaling,
-            xysigma0=xysigma0,
-            indices=indices[i],
-        )
-        inputs.append(_d)
+    yout = np.linspace(y1, y2, gridy)
+    Xout, Yout = np.meshgrid(xout, yout)
+    Iout = np.zeros_like(Xout)
+    ssigmax, ssigmay = sigmax**2, sigmay**2
+    if axis_sigma_scaling:
+        XYout = _sigma_axis_values(Xout, Yout, axis_sigma_scaling)
+        scale = XYout / xysigma0
+    else:
+        scale = np.ones_like(Xout)
+
+    # Points with undefined coordinates are never within range
+    valid = np.where(np.isfinite(x) & np.isfinite(y))[0]
+    tree = cKDTree(np.column_stack((x[valid] / sigmax, y[valid] / sigmay)))
+
+    for i in range(*(rows or (0, gridy))):
+        # The squared sigmas are multiplied by the scale, so the search radius by its square root.
+        # The radius is widened slightly so that rounding never drops a point: the exact
+        # selection is made below, on the distances computed as in _smooth_data.
+        radius = sigmas * np.sqrt(np.clip(scale[i], 0, None)) * (1.0 + 1e-9)
+        neighbours = tree.query_ball_point(np.column_stack((xout / sigmax, Yout[i] / sigmay)), radius)
+        for j in range(gridx):
+            if axis_sigma_scaling and XYout[i, j] == 0:
+                continue
+            xij = Xout[i, j]
+            yij = Yout[i, j]
+            if scale[i, j] < 0:
+                # Negative sigmas select every point: keep the behaviour of _smooth_data
+                candidates = np.arange(len(x))
+            else:
+                candidates = valid[np.sort(np.asarray(neighbours[j], dtype=int))]
+            if len(candidates) == 0:
+                continue
+            if axis_sigma_scaling:
+                ssigmaxi = ssigmax / xysigma0 * XYout[i, j]
+                ssigmayi = ssigmay / xysigma0 * XYout[i, j]
+            else:
+                ssigmaxi, ssigmayi = ssigmax, ssigmay
+            rij = (x[candidates] - xij) ** 2 / ssigmaxi + (y[candidates] - yij) ** 2 / ssigmayi
+            take = np.where(rij < sigmas**2)
+            if len(take[0]) == 0:
+                continue
+            Pij = np.exp(-0.5 * rij[take])
+            Pij /= Pij.sum()
+            Iout[i, j] = (Pij * I[candidates[take]]).sum()
+    return Xout, Yout, Iout
 
-    results = p.map(proc, inputs)
-    x_out = results[0][0]
-    y_out = results[0][1]
-    _data = [r[2] for r in results]
-    intensity_out = reduce((lambda x, y: x + y), _data)
 
-    return x_out, y_out, intensity_out
+def _smooth_rows(data):
+    """
+    Smooth a block of grid rows in a worker process, reading the data points from shared memory
+    """
+    row_min, row_max = data["rows"]
+    with attached_arrays(data["arrays"]) as arrays:
+        _, _, intensity = smooth_data_kdtree(rows=data["rows"], **arrays, **data["options"])
+    return data["rows"], intensity[row_min:row_max]
+
+
+def smooth_data(
+    x,
+    y,
+    I,
+    sigmas=3.0,
+    gridx=150,
+    gridy=50,
+    sigmax=0.0005,
+    sigmay=0.0005,
+    x1=-0.03,
+    x2=0.03,
+    y1=0.0,
+    y2=0.1,
+    axis_sigma_scaling=None,
+    xysigma0=0.06,
+    pool=None,
+):
+    """
+    Smooth a irregular spaced dataset onto a regular grid.
+    See smooth_data_kdtree for the parameters.
+
+    Large data sets are smoothed by the application-wide worker pool, each worker computing
+    a block of grid rows from data points shared with it.
+
+    :param int pool: number of blocks of grid rows, by default the number of worker processes
+    """
+    options = dict(
+        sigmas=sigmas,
+        gridx=gridx,
+        gridy=gridy,
+        sigmax=sigmax,
+        sigmay=sigmay,
+        x1=x1,
+        x2=x2,
+        y1=y1,
+        y2=y2,
+        axis_sigma_scaling=axis_sigma_scaling,
+        xysigma0=xysigma0,
+    )
+    n_blocks = min(int(pool) if pool else get_pool_size(), gridy)
+    worker_pool = get_worker_pool() if n_blocks > 1 and len(I) >= PARALLEL_SMOOTHING_MIN_POINTS else None
+    if worker_pool is None:
+        return smooth_data_kdtree(x, y, I, **options)
+
+    bounds = np.linspace(0, gridy, n_blocks + 1).astype(int)
+    with SharedArrays(x=x, y=y, I=I) as arrays:
+        inputs = [
+            dict(arrays=arrays, rows=(int(bounds[k]), int(bounds[k + 1])), options=options) for k in range(n_blocks)
+        ]
+        results = worker_pool.map(_smooth_rows, inputs)
+
+    Xout, Yout = np.meshgrid(np.linspace(x1, x2, gridx), np.linspace(y1, y2, gridy))
+    Iout = np.zeros_like(Xout)
+    for (row_min, row_max), intensity in results:
+        Iout[row_min:row_max] = intensity
+    return Xout, Yout, Iout
@@ -1,9 +1,10 @@
 """
-Bare bones version of the scipy 1.1.0 code to find peaks, which we use on a system that cannot
-run version 1.1.0 but only runs an old version.
-
 Functions for identifying peaks in signals.
 
+The compiled implementations of SciPy (>= 1.1.0) are used when they are available.
+Otherwise, this module falls back on a bare bones version of the scipy 1.1.0 code
+to find peaks, which we used on a system that could only run an old version.
+
 https://github.com/scipy/scipy/blob/master/LICENSE.txt
 
 Copyright (c) 2001, 2002 Enthought, Inc.
@@ -17,10 +18,10 @@ import math
 
 import numpy as np
 
-__all__ = ["peak_prominences", "peak_widths", "find_peaks"]
+__all__ = ["peak_prominences", "peak_widths", "find_peaks", "find_peaks_by_row"]
 
 
-def peak_prominences(x, peaks, wlen=None):
+def _backport_peak_prominences(x, peaks, wlen=None):
     """Calculate the prominence of each peak in a signal.
 
     .. versionadded:: 1.1.0
@@ -58,7 +59,7 @@ def peak_prominences(x, peaks, wlen=None):
     return _peak_prominences(x, peaks, wlen)
 
 
-def peak_widths(x, peaks, rel_height=0.5, prominence_data=None, wlen=None):
+def _backport_peak_widths(x, peaks, rel_height=0.5, prominence_data=None, wlen=None):
     """
     Calculate the width of each peak in a signal.
     .. versionadded:: 1.1.0
@@ -81,7 +82,7 @@ def peak_widths(x, peaks, rel_height=0.5, prominence_data=None, wlen=None):
 
     if prominence_data is None:
         # Calculate prominence if not supplied and use wlen if supplied.
-        prominence_data = peak_prominences(x, peaks, wlen)
+        prominence_data = _backport_peak_prominences(x, peaks, wlen)
 
     return _peak_widths(x, peaks, rel_height, *prominence_data)
 
@@ -142,7 +143,9 @@ def _select_by_peak_threshold(x, peaks, tmin, tmax):
     return keep, stacked_thresholds[0], stacked_thresholds[1]
 
 
-def find_peaks(x, height=None, threshold=None, distance=None, prominence=None, width=None, wlen=None, rel_height=0.5):
+def _backport_find_peaks(
+    x, height=None, threshold=None, distance=None, prominence=None, width=None, wlen=None, rel_height=0.5
+):
     """
     Find peaks inside a signal based on peak properties.
     .. versionadded:: 1.1.0
@@ -179,7 +182,9 @@ def find_peaks(x, height=None, threshold=None, distance=None, prominence=None, w
 
     if prominence is not None or width is not None:
         # Calculate prominence (required for both conditions)
-        properties.update(zip(["prominences", "left_bases", "right_bases"], peak_prominences(x, peaks, wlen=wlen)))
+        properties.update(
+            zip(["prominences", "left_bases", "right_bases"], _backport_peak_prominences(x, peaks, wlen=wlen))
+        )
 
     if prominence is not None:
         # Evaluate prominence condition
@@ -193,7 +198,7 @@ def find_peaks(x, height=None, threshold=None, distance=None, prominence=None, w
         properties.update(
             zip(
                 ["widths", "width_heights", "left_ips", "right_ips"],
-                peak_widths(
+                _backport_peak_widths(
                     x,
                     peaks,
                     rel_height,
@@ -216,41 +221,19 @@ def find_peaks(x, height=None, threshold=None, distance=None, prominence=None, w
 def _argmaxima1d(x):
     """
     Find local maxima in a 1D array.
+    Flat maxima are reported at their midpoint, rounded down.
     .. versionadded:: 1.1.0
     """
-    # Preallocate, there can't be more maxima than half the size of `x`
-    midpoints = np.empty(x.shape[0] // 2, dtype=np.intp)
-    left_edges = np.empty(x.shape[0] // 2, dtype=np.intp)
-    right_edges = np.empty(x.shape[0] // 2, dtype=np.intp)
-    m = 0  # Pointer to the end of valid area in allocated arrays
-
-    i = 1  # Pointer to current sample, first one can't be maxima
-    i_max = x.shape[0] - 1  # Last sample can't be maxima
-    while i < i_max:
-        # Test if previous sample is smaller
-        if x[i - 1] < x[i]:
-            i_ahead = i + 1  # Index to look ahead of current sample
-
-            # Find next sample that is unequal to x[i]
-            while i_ahead < i_max and x[i_ahead] == x[i]:
-                i_ahead += 1
-
-            # Maxima is found if next unequal sample is smaller than x[i]
-            if x[i_ahead] < x[i]:
-                left_edges[m] = i
-                right_edges[m] = i_ahead - 1
-                midpoints[m] = (left_edges[m] + right_edges[m]) // 2
-                m += 1
-                # Skip samples that can't be maximum
-                i = i_ahead
-        i += 1
-
-    # Keep only valid part of array memory.
-    midpoints.resize(m, refcheck=False)
-    left_edges.resize(m, refcheck=False)
-    right_edges.resize(m, refcheck=False)
-
-    return midpoints  # , left_edges, right_edges
+    if x.shape[0] < 3:
+        return np.array([], dtype=np.intp)
+    # Collapse runs of equal samples: a run is a maximum if both its neighbors are smaller.
+    # The first and last runs hold the edges of `x`, which can't be maxima.
+    starts = np.flatnonzero(np.concatenate([[True], x[1:] != x[:-1]]))
+    ends = np.append(starts[1:], x.shape[0]) - 1
+    values = x[starts]
+    is_maximum = (values[1:-1] > values[:-2]) & (values[1:-1] > values[2:])
+    midpoints = (starts[1:-1][is_maximum] + ends[1:-1][is_maximum]) // 2
+    return midpoints.astype(np.intp)
 
 
 def _peak_prominences(x, peaks, wlen):
@@ -356,3 +339,33 @@ def _peak_widths(x, peaks, rel_height, prominences, left_bases, right_bases):
     if show_warning:
         print("some peaks have a width of 0")
     return np.asarray(widths), width_heights, left_ips, right_ips
+
+
+try:
+    from scipy.signal import find_peaks, peak_prominences, peak_widths
+except ImportError:
+    find_peaks = _backport_find_peaks
+    peak_prominences = _backport_peak_prominences
+    peak_widths = _backport_peak_widths
+
+
+def find_peaks_by_row(signals):
+    """
+    Find the peaks of each of a set of signals, along with their prominences and widths.
+    The signals are processed one row at a time with find_peaks, peak_prominences and peak_widths.
+    :param ndarray signals: 2D array with one signal per row
+    :return: list of (peaks, prominences, widths) tuples, one for each signal
+    """
+    signals = np.asarray(signals, dtype=np.float64)
+    if signals.ndim == 1:
+        signals = signals[np.newaxis, :]
+    if signals.ndim != 2:
+        raise ValueError("`signals` must have exactly two dimensions")
+
+    results = []
+    for signal in signals:
+        peaks, _ = find_peaks(signal)
+        prominence_data = peak_prominences(signal, peaks)
+        widths = peak_widths(signal, peaks, prominence_data=prominence_data)[0]
+        results.append((peaks, prominence_data[0], widths))
+    return results
@@ -12,6 +12,7 @@ import smtplib
 import sys
 import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.image import MIMEImage
@@ -22,6 +23,7 @@ import numpy as np
 
 from ..configuration import Configuration
 from . import data_manipulation, gisans, off_specular, quicknxs_io
+from .worker_pool import get_worker_pool
 
 DEFAULT_OPTIONS = dict(
     export_specular=True,
@@ -33,6 +35,7 @@ DEFAULT_OPTIONS = dict(
     format_mantid=True,
     format_numpy=False,
     format_5cols=False,
+    format_hdf5=False,
     output_sample_size=10,
     output_directory="",
     output_file_template="{instrument}_{numbers}_{peak}_{item}_{state}.{type}",
@@ -47,6 +50,33 @@ DEFAULT_OPTIONS = dict(
 )
 
 
+def _write_output_file(unit):
+    """
+    Write an output file made of a header and a data block.
+    Runs in a worker process when the output files are written in the background.
+    :param dict unit: output path, header text, data, column names and format option
+    :returns: output path and time spent writing the file, in seconds
+    """
+    t_0 = time.time()
+    if unit["header"] is not None:
+        with open(unit["path"], "w") as fd:
+            fd.write(unit["header"])
+    quicknxs_io.write_reflectivity_data(unit["path"], unit["data"], unit["col_names"], as_5col=unit["as_5col"])
+    return unit["path"], time.time() - t_0
+
+
+def _write_hdf5_file(unit):
+    """
+    Write the cross-sections of an output type in a single HDF5 file.
+    Runs in a worker process when the output files are written in the background.
+    :param dict unit: output path, list of (state, header, data) items and column names
+    :returns: output path and time spent writing the file, in seconds
+    """
+    t_0 = time.time()
+    quicknxs_io.write_reflectivity_hdf5(unit["path"], unit["items"], unit["col_names"])
+    return unit["path"], time.time() - t_0
+
+
 class ProcessingWorkflow(object):
     """
     Carry out the reduction process for a set of data runs and manages outputs
@@ -60,6 +90,12 @@ class ProcessingWorkflow(object):
         self.output_options = output_options if output_options else DEFAULT_OPTIONS
         self.exported_data_files = []
         self.exported_data_plots = []
+        # Time spent on each step and each output file: list of (description, seconds)
+        self.timings = []
+        # Worker pool writing the output files in the background, or None to write them in this process
+        self._pool = None
+        # Output files being written by the pool, oldest first: list of AsyncResult
+        self._pending_files = []
 
     def execute(self, progress=None):
         """
@@ -72,6 +108,10 @@ class ProcessingWorkflow(object):
         # store current peak shown in the UI
         active_peak = self.data_manager.active_reduction_list_index
 
+        # The data are computed in this process, and each output file is written by the worker pool
+        # while the next outputs are computed
+        self._pool = get_worker_pool() if Configuration.export_processes > 1 else None
+
         for peak_index in self.data_manager.peak_reduction_lists.keys():
             # set active data based on peak index
             self.data_manager.set_active_reduction_list_index(peak_index)
@@ -80,30 +120,100 @@ class ProcessingWorkflow(object):
             if self.output_options["export_specular"]:
                 if progress is not None:
                     progress(10, "Computing reflectivity")
+                t_0 = time.time()
                 self.specular_reflectivity()
+                self._report_timing("Peak %s specular" % peak_index, time.time() - t_0)
 
             if self.output_options["export_offspec"] or self.output_options["export_offspec_smooth"]:
                 if progress is not None:
                     progress(20, "Computing off-specular reflectivity")
+                t_0 = time.time()
                 self.offspec(
                     raw=self.output_options["export_offspec"], binned=self.output_options["export_offspec_smooth"]
                 )
+                self._report_timing("Peak %s off-specular" % peak_index, time.time() - t_0)
 
             if progress is not None:
                 progress(60, "Computing GISANS")
             if self.output_options["export_gisans"]:
                 # FIXME 66 - could be an AttributeError from self.gisans().  Catch it!
+                t_0 = time.time()
                 self.gisans(progress=progress)
+                self._report_timing("Peak %s GISANS" % peak_index, time.time() - t_0)
 
         # restore current peak shown in the UI
         self.data_manager.set_active_reduction_list_index(active_peak)
 
+        if self._pending_files:
+            if progress is not None:
+                progress(90, "Writing output files")
+            self.wait_for_pending_files()
+        self._pool = None
+
         if self.output_options["email_send"]:
             self.send_email()
 
         if progress is not None:
             progress(100, "Complete")
 
+    def _report_timing(self, description, elapsed):
+        self.timings.append((description, elapsed))
+        logging.info("%s: %s sec", description, elapsed)
+
+    @staticmethod
+    def _map_cross_sections(function, pol_states):
+        """
+        Compute an output for each cross-section. With Configuration.export_processes larger than 1,
+        that many cross-sections are computed at the same time by threads, which hand their parallel
+        stages to the worker pool together, so that the pool is kept busy from one cross-section to the next.
+        :param function function: function computing the output of a cross-section
+        :param list pol_states: cross-sections to compute
+        :returns: list of the outputs, in the order of the cross-sections
+        """
+        pol_states = list(pol_states)
+        if Configuration.export_processes > 1 and len(pol_states) > 1:
+            with ThreadPoolExecutor(max_workers=min(Configuration.export_processes, len(pol_states))) as executor:
+                return list(executor.map(function, pol_states))
+        return [function(pol_state) for pol_state in pol_states]
+
+    def _write_file(self, output_path, header, data, col_names, as_5col):
+        """
+        Write an output file, in the background if the worker pool writes the output files
+        :param str output_path: output file path
+        :param str header: header text, or None if the file has no header
+        :param ndarray or list data: data to be written
+        :param list col_names: list of column names
+        :param bool as_5col: if True, a 5-column ascii will be written
+        """
+        unit = dict(path=output_path, header=header, data=data, col_names=col_names, as_5col=as_5col)
+        self._submit(_write_output_file, unit)
+
+    def _submit(self, write_function, unit):
+        """
+        Write an output file with one of the module write functions, either in this process or
+        in the worker pool. At most Configuration.export_processes files are written at a time,
+        so that the data of only a few files are held by the pool.
+        :param function write_function: _write_output_file or _write_hdf5_file
+        :param dict unit: arguments of the write function
+        """
+        if self._pool is None:
+            self._report_timing(*write_function(unit))
+        else:
+            if len(self._pending_files) >= Configuration.export_processes:
+                self._report_timing(*self._pending_files.pop(0).get())
+            self._pending_files.append(self._pool.apply_async(write_function, (unit,)))
+        self.exported_data_files.append(unit["path"])
+
+    def wait_for_pending_files(self):
+        """
+        Wait for the output files written in the background
+        """
+        t_0 = time.time()
+        n_files = len(self._pending_files)
+        while self._pending_files:
+            self._report_timing(*self._pending_files.pop(0).get())
+        self._report_timing("Waiting for %s output files" % n_files, time.time() - t_0)
+
     def get_file_name(self, run_list=None, pol_state=None, data_type="dat", process_type="Specular"):
         """
         Construct a file name according to the measurement type.
@@ -125,12 +235,15 @@ class ProcessingWorkflow(object):
         base_name = base_name.replace("{peak}", f"peak{self.data_manager.active_reduction_list_index}")
         return os.path.join(self.output_options["output_directory"], base_name)
 
-    def write_quicknxs(self, output_data, output_file_base, xs=None):
+    def write_quicknxs(self, output_data, output_file_base, xs=None, keep_ascii=False):
         """
         Write QuickNXS output reflectivity file.
+        When the HDF5 format is selected, the cross-sections are written only in the HDF5 file,
+        unless keep_ascii is True.
         :param dict output_data: dictionary of numpy arrays
         :param str output_file_base: template for output file paths
         :param list xs: list of cross sections available in the output_data
+        :param bool keep_ascii: if True, also write the ASCII file of each cross-section with the HDF5 file
         """
         # Get the column names
         units = output_data["units"]
@@ -151,6 +264,8 @@ class ProcessingWorkflow(object):
 
         # Write out the cross-section data
         five_cols = self.output_options["format_5cols"]
+        write_hdf5 = self.output_options["format_hdf5"]
+        hdf5_items = []
         for pol_state in output_states:
             # The cross-sections might have different names
             if pol_state in self.data_manager.reduction_list[0].cross_sections:
@@ -162,15 +277,20 @@ class ProcessingWorkflow(object):
                 continue
 
             state_output_path = output_file_base.replace("{state}", pol_state)
-            quicknxs_io.write_reflectivity_header(
+            header = quicknxs_io.get_reflectivity_header(
                 self.data_manager.peak_reduction_lists,
                 self.data_manager.active_reduction_list_index,
                 self.data_manager.direct_beam_list,
-                state_output_path,
                 _pol_state,
             )
-            quicknxs_io.write_reflectivity_data(state_output_path, output_data[pol_state], col_names, as_5col=five_cols)
-            self.exported_data_files.append(state_output_path)
+            if keep_ascii or not write_hdf5:
+                self._write_file(state_output_path, header, output_data[pol_state], col_names, five_cols)
+            hdf5_items.append((pol_state, header, output_data[pol_state]))
+
+        # All the cross-sections in a single HDF5 file
+        if write_hdf5 and hdf5_items:
+            output_path = os.path.splitext(output_file_base.replace("{state}", "all"))[0] + ".h5"
+            self._submit(_write_hdf5_file, dict(path=output_path, items=hdf5_items, col_names=col_names))
 
     def specular_reflectivity(self):
         """
@@ -186,9 +306,9 @@ class ProcessingWorkflow(object):
 
         output_data = self.get_output_data()
 
-        # QuickNXS format
+        # QuickNXS format. The specular ASCII files are always written, since they are the ones reloaded as sessions.
         output_file_base = self.get_file_name(run_list)
-        self.write_quicknxs(output_data, output_file_base)
+        self.write_quicknxs(output_data, output_file_base, keep_ascii=True)
 
         # Numpy arrays
         if self.output_options["format_numpy"]:
@@ -307,8 +427,8 @@ class ProcessingWorkflow(object):
             logging.error("List of cross-sections is empty")
             return {}
 
-        for pol_state in self.data_manager.reduction_states:
-            r, dr, x, y, labels = off_specular.rebin_extract(
+        def _rebin(pol_state):
+            return off_specular.rebin_extract(
                 self.data_manager.reduction_list,
                 pol_state,
                 axes=self.data_manager.active_channel.configuration.off_spec_x_axis,
@@ -319,7 +439,12 @@ class ProcessingWorkflow(object):
                 x_max=self.data_manager.active_channel.configuration.off_spec_x_max,
                 y_min=self.data_manager.active_channel.configuration.off_spec_y_min,
                 y_max=self.data_manager.active_channel.configuration.off_spec_y_max,
+                chunked=Configuration.low_memory_merge,
+                dtype=np.float32 if Configuration.low_memory_merge else float,
             )
+
+        rebinned = self._map_cross_sections(_rebin, self.data_manager.reduction_states)
+        for pol_state, (r, dr, x, y, labels) in zip(self.data_manager.reduction_states, rebinned):
             if data_dict is None:
                 data_dict = dict(
                     units=["1/A", "1/A", "a.u.", "a.u."], columns=[labels[0], labels[1], "I", "dI"], cross_sections={}
@@ -368,11 +493,13 @@ class ProcessingWorkflow(object):
             return data_dict
 
         t_0 = time.time()
-        _parallel = False
-        slice_data_dict = {}
-        for pol_state in self.data_manager.reduction_states:
+        # Rebin the wavelength bands in the worker pool, if there is one
+        _parallel = get_worker_pool() is not None
+        wl_step = (wl_max - wl_min) / wl_npts
+
+        def _rebin(pol_state):
             if _parallel:
-                binned_data = gisans.rebin_parallel(
+                return gisans.rebin_parallel(
                     self.data_manager.reduction_list,
                     pol_state,
                     wl_min=wl_min,
@@ -381,18 +508,28 @@ class ProcessingWorkflow(object):
                     qy_npts=qy_npts,
                     qz_npts=qz_npts,
                     use_pf=use_pf,
+                    dtype=np.float32 if Configuration.low_memory_merge else float,
                 )
+            return [
+                self.data_manager.rebin_gisans(
+                    pol_state,
+                    wl_min=wl_min + i * wl_step,
+                    wl_max=wl_min + (i + 1) * wl_step,
+                    qy_npts=qy_npts,
+                    qz_npts=qz_npts,
+                    use_pf=use_pf,
+                )
+                for i in range(wl_npts)
+            ]
+
+        rebinned = self._map_cross_sections(_rebin, self.data_manager.reduction_states)
+        slice_data_dict = {}
+        for pol_state, binned_data in zip(self.data_manager.reduction_states, rebinned):
             data_dict["cross_section_bins"][pol_state] = []
             for i in range(wl_npts):
-                wl_step = (wl_max - wl_min) / wl_npts
                 _wl_min = wl_min + i * wl_step
                 _wl_max = wl_min + (i + 1) * wl_step
-                if _parallel:
-                    _intensity, _qy, _qz_axis, _intensity_err = binned_data[i]
-                else:
-                    _intensity, _qy, _qz_axis, _intensity_err = self.data_manager.rebin_gisans(
-                        pol_state, wl_min=_wl_min, wl_max=_wl_max, qy_npts=qy_npts, qz_npts=qz_npts, use_pf=use_pf
-                    )
+                _intensity, _qy, _qz_axis, _intensity_err = binned_data[i]
 
                 qz, qy = np.meshgrid(_qz_axis, _qy)
                 rdata = np.array([qy, qz, _intensity, _intensity_err]).transpose((1, 2, 0))
@@ -500,7 +637,7 @@ class ProcessingWorkflow(object):
         output_data = dict(cross_sections=dict())
         slice_data_dict = {}
 
-        for channel in data_dict["cross_sections"].keys():
+        def _smooth(channel):
             data = np.hstack(data_dict[channel])
             I = data[:, :, 5].flatten()
             Qzmax = data[:, :, 2].max() * 2.0
@@ -528,7 +665,7 @@ class ProcessingWorkflow(object):
                 axis_sigma_scaling = 2
                 xysigma0 = Qzmax / 3.0
 
-            x, y, I = off_specular.smooth_data(
+            smoothed = off_specular.smooth_data(
                 x,
                 y,
                 I,
@@ -544,6 +681,10 @@ class ProcessingWorkflow(object):
                 axis_sigma_scaling=axis_sigma_scaling,
                 xysigma0=xysigma0,
             )
+            return smoothed, y_label
+
+        channels = list(data_dict["cross_sections"].keys())
+        for channel, ((x, y, I), y_label) in zip(channels, self._map_cross_sections(_smooth, channels)):
             output_data[channel] = [np.array([x, y, I]).transpose((1, 2, 0))]
             output_data["cross_sections"][channel] = data_dict["cross_sections"][channel]
 
@@ -4,18 +4,26 @@ Read and write quicknxs reduced files
 """
 
 import copy
+import io
 import logging
 import math
 import os
 import sys
 import time
 
+import h5py
 import mantid
 import numpy as np
 
 from ... import __version__
 from ..configuration import Configuration
 
+# Number of values formatted at once when writing off-specular and GISANS data
+WRITE_CHUNK_VALUES = 2**16
+
+# Approximate number of values in a chunk of the datasets of HDF5 reduced files
+HDF5_CHUNK_VALUES = 2**16
+
 
 def _find_h5_data(filename):
     """
@@ -49,9 +57,35 @@ def write_reflectivity_header(peak_reduction_lists, active_list_index, direct_be
     pol_state: str
         Descriptor for the polarization state
     """
+    header = get_reflectivity_header(peak_reduction_lists, active_list_index, direct_beam_list, pol_state)
+    if header is not None:
+        with open(output_path, "w") as fd:
+            fd.write(header)
+
+
+def get_reflectivity_header(peak_reduction_lists, active_list_index, direct_beam_list, pol_state):
+    """
+    Build the reflectivity header in a format readable by QuickNXS
+
+    Parameters
+    ----------
+    peak_reduction_lists: dict[int, list[~quicknxs.interfaces.data_handling.data_set.NexusData]]
+        All reduction lists to include as additional peaks in the header
+    active_list_index: int
+        The index of the reduction list that the output reflectivity data is for
+    direct_beam_list: list[~quicknxs.interfaces.data_handling.data_set.NexusData]
+        Direct beam list
+    pol_state: str
+        Descriptor for the polarization state
+
+    Returns
+    -------
+    str | None
+        Header text, or None if the active reduction list is empty
+    """
     # Sanity check
     if active_list_index not in peak_reduction_lists or not peak_reduction_lists[active_list_index]:
-        return
+        return None
 
     reduction_list = peak_reduction_lists[active_list_index]
 
@@ -88,7 +122,7 @@ def write_reflectivity_header(peak_reduction_lists, active_list_index, direct_be
         "File",
     ]
 
-    fd = open(output_path, "w")
+    fd = io.StringIO()
     fd.write("# Datafile created by QuickNXS %s\n" % __version__)
     fd.write("# Datafile created using Mantid %s\n" % mantid.__version__)
     fd.write("# Date: %s\n" % time.strftime("%Y-%m-%d %H:%M:%S"))
@@ -105,7 +139,7 @@ def write_reflectivity_header(peak_reduction_lists, active_list_index, direct_be
     pol_list = list(reduction_list[0].cross_sections.keys())
     if not pol_list:
         logging.error("No data found in run %s", reduction_list[0].number)
-        return
+        return fd.getvalue()
 
     # Direct beam section
     i_direct_beam = 0
@@ -186,7 +220,7 @@ def write_reflectivity_header(peak_reduction_lists, active_list_index, direct_be
     fd.write("# sample_length      %s\n" % str(sample_size))
     fd.write("# lock_direct_beam_y %s\n" % str(Configuration.lock_direct_beam_y))
     fd.write("#\n")
-    fd.close()
+    return fd.getvalue()
 
 
 def _get_cross_section_config_values(cross_section_data, i_direct_beam):
@@ -256,6 +290,99 @@ def _get_cross_section_config_values(cross_section_data, i_direct_beam):
     return parameter_values
 
 
+def _format_values(values):
+    """
+    Format values as "%-18e" would, as an array of 18 ASCII characters per value.
+
+    The mantissa digits are computed with numpy. Values for which this could differ from the
+    correctly rounded output of "%e", which are zeros, values that are not finite or have
+    extreme exponents, and values close to a rounding tie, are formatted by python.
+    :param ndarray values: 1D array of float values
+    """
+    magnitude = np.abs(values)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        exponent = np.floor(np.log10(magnitude))
+        fast = np.isfinite(exponent) & (np.abs(exponent) < 290)
+        exponent[~fast] = 0
+        exponent = exponent.astype(np.int32)
+        # Scale the magnitude to [1e6, 1e7), so that its integer part holds the 7 significant digits
+        scaled = magnitude * 10.0 ** (6 - exponent)
+        # The logarithm may be rounded to the wrong side of an integer
+        for outside, shift in [(scaled < 1e6, -1), (scaled >= 1e7, 1)]:
+            if outside.any():
+                exponent[outside] += shift
+                scaled[outside] = magnitude[outside] * 10.0 ** (6 - exponent[outside])
+        fast &= np.abs(scaled - np.floor(scaled) - 0.5) > 1e-6
+    scaled[~fast] = 1e6
+
+    mantissa = np.floor(scaled + 0.5).astype(np.int32)
+    # 9.9999995 is rounded to 1.000000e+01
+    carry = mantissa == 10000000
+    mantissa[carry] = 1000000
+    exponent[carry] += 1
+
+    # Characters of the unsigned representation, d.dddddde+XX followed by a space or d.dddddde+XXX,
+    # with one row per character. Characters are selected arithmetically, which is much faster than
+    # with boolean masks.
+    body = np.empty((14, len(values)), dtype=np.uint8)
+    for row in [7, 6, 5, 4, 3, 2, 0]:
+        quotient = mantissa // 10
+        body[row] = mantissa - 10 * quotient + ord("0")
+        mantissa = quotient
+    body[1] = ord(".")
+    body[8] = ord("e")
+    body[9] = ord("+") + (ord("-") - ord("+")) * (exponent < 0)
+    exponent = np.abs(exponent)
+    long_exponent = exponent >= 100
+    characters = [exponent // 100 + ord("0"), exponent // 10 % 10 + ord("0"), exponent % 10 + ord("0"), ord(" ")]
+    for row in range(3):
+        body[10 + row] = characters[row + 1] + (characters[row] - characters[row + 1]) * long_exponent
+    body[13] = ord(" ")
+
+    # The minus sign of negative values shifts the other characters
+    negative = np.signbit(values).astype(np.uint8)
+    fields = np.full((18, len(values)), ord(" "), dtype=np.uint8)
+    fields[0] = body[0] + (ord("-") - body[0]) * negative
+    fields[1:14] = body[1:] + (body[:13] - body[1:]) * negative
+
+    # Format the other values with python, once for each distinct value
+    slow = np.flatnonzero(~fast)
+    if len(slow):
+        bits, inverse = np.unique(values[slow].view(np.int64), return_inverse=True)
+        formatted = [("%-18e" % value).encode("ascii") for value in bits.view(np.float64).tolist()]
+        fields[:, slow] = np.frombuffer(b"".join(formatted), dtype=np.uint8).reshape(-1, 18)[inverse].T
+    return fields.T
+
+
+def _write_blocks(fd, blocks):
+    """
+    Write a series of 2D blocks, each one as np.savetxt(fd, block, delimiter="\\t", fmt="%-18e")
+    would write it, followed by an empty line.
+
+    The values of many blocks are formatted at once, see _format_values(), and written with a
+    single call, so that large data sets are not written as millions of small pieces.
+    :param file fd: open output file
+    :param ndarray blocks: data indexed as [block][row][column], or [block][row] for single-column rows
+    """
+    blocks = np.asarray(blocks, dtype=float)
+    if blocks.ndim == 2:
+        # np.savetxt writes 1D blocks as a column
+        blocks = blocks[:, :, np.newaxis]
+    n_blocks, n_rows, n_columns = blocks.shape
+    blocks_per_write = max(1, WRITE_CHUNK_VALUES // max(1, n_rows * n_columns))
+    for start in range(0, n_blocks, blocks_per_write):
+        chunk = blocks[start : start + blocks_per_write]
+        # Each value takes 18 characters, followed by a tab or, for the last column, a new line
+        lines = np.empty(chunk.shape + (19,), dtype=np.uint8)
+        lines[..., :18] = _format_values(chunk.ravel()).reshape(chunk.shape + (18,))
+        lines[..., :-1, 18] = ord("\t")
+        lines[..., -1, 18] = ord("\n")
+        output = np.empty((len(chunk), n_rows * n_columns * 19 + 1), dtype=np.uint8)
+        output[:, :-1] = lines.reshape(len(chunk), -1)
+        output[:, -1] = ord("\n")
+        fd.write(output.tobytes().decode("ascii"))
+
+
 def write_reflectivity_data(output_path, data, col_names, as_5col=True):
     """
     Write out reflectivity header in a format readable by QuickNXS
@@ -279,11 +406,9 @@ def write_reflectivity_data(output_path, data, col_names, as_5col=True):
         fd.write("# %s\n" % "\t".join(toks))
 
         if isinstance(data, list):
-            # [TOF][pixel][parameter]
-            for tof_item in data:
-                for pixel_item in tof_item:
-                    np.savetxt(fd, pixel_item, delimiter="\t", fmt="%-18e")
-                    fd.write("\n")
+            # [run][pixel][TOF][parameter]: one block of lines per pixel, followed by an empty line
+            for run_item in data:
+                _write_blocks(fd, run_item)
         else:
             if four_cols:
                 np.savetxt(fd, data[:, :4], delimiter=" ", fmt="%-18e")
@@ -291,17 +416,126 @@ def write_reflectivity_data(output_path, data, col_names, as_5col=True):
                 np.savetxt(fd, data, delimiter="\t", fmt="%-18e")
 
 
+def write_reflectivity_hdf5(output_path, output_items, col_names):
+    """
+    Write reduced data of several cross-sections in an HDF5 file.
+
+    Each cross-section is a group holding its header, as written at the top of the ASCII
+    files, and its data as compressed, chunked float datasets: "data" for a [point][column]
+    array, or "data_0", "data_1", ... for the [pixel][TOF][column] arrays of each run
+    of off-specular and GISANS data.
+    :param str output_path: output file path
+    :param list output_items: (cross-section name, header text, data) for each cross-section
+    :param list col_names: list of column names
+    """
+    with h5py.File(output_path, "w") as h5_file:
+        h5_file.attrs["creator"] = "QuickNXS %s" % __version__
+        h5_file.attrs["columns"] = list(col_names)
+        h5_file.attrs["cross_sections"] = [item[0] for item in output_items]
+        for pol_state, header, data in output_items:
+            group = h5_file.create_group(pol_state)
+            # Headers of long reduction lists do not fit in an attribute
+            group.create_dataset("header", data=header if header is not None else "")
+            arrays = {"data_%s" % i: item for i, item in enumerate(data)} if isinstance(data, list) else {"data": data}
+            for name, array in arrays.items():
+                array = np.asarray(array)
+                if array.size == 0:
+                    group.create_dataset(name, data=array)
+                    continue
+                # Chunks hold whole rows, so that rows can be read without decompressing the full array
+                row_size = max(1, int(np.prod(array.shape[1:])))
+                chunks = (min(array.shape[0], max(1, HDF5_CHUNK_VALUES // row_size)),) + array.shape[1:]
+                group.create_dataset(
+                    name, data=array, chunks=chunks, compression="gzip", compression_opts=4, shuffle=True
+                )
+
+
+class ReducedHDF5File(object):
+    """
+    Read access to a reduced HDF5 file written by write_reflectivity_hdf5().
+    Datasets are only read when they are accessed, so that large off-specular
+    and GISANS files can be opened quickly and read in parts.
+
+        with ReducedHDF5File(file_path) as reduced_file:
+            for pol_state in reduced_file.cross_sections:
+                specular = reduced_file.load(pol_state)
+    """
+
+    def __init__(self, file_path):
+        self._file = h5py.File(file_path, "r")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def cross_sections(self):
+        """Names of the cross-sections, in the order they were written"""
+        return [str(name) for name in self._file.attrs["cross_sections"]]
+
+    @property
+    def columns(self):
+        return [str(name) for name in self._file.attrs["columns"]]
+
+    def header(self, pol_state=None):
+        """
+        Header text of a cross-section, of the first one by default
+        :param str pol_state: name of the cross-section
+        """
+        if pol_state is None:
+            pol_state = self.cross_sections[0]
+        return self._file[pol_state]["header"].asstr()[()]
+
+    def get_datasets(self, pol_state):
+        """
+        HDF5 datasets of a cross-section, read when sliced.
+        Returns a dataset for specular data, or a list of datasets for data split in runs.
+        :param str pol_state: name of the cross-section
+        """
+        group = self._file[pol_state]
+        if "data" in group:
+            return group["data"]
+        n_runs = len([name for name in group if name.startswith("data_")])
+        return [group["data_%s" % i] for i in range(n_runs)]
+
+    def load(self, pol_state):
+        """
+        Data of a cross-section, as written: an array or a list of arrays
+        :param str pol_state: name of the cross-section
+        """
+        datasets = self.get_datasets(pol_state)
+        if isinstance(datasets, list):
+            return [dataset[()] for dataset in datasets]
+        return datasets[()]
+
+
+def _open_header(file_path):
+    """
+    Open a reduced file for reading its header. The header of HDF5 files is returned as a text stream.
+    :param str file_path: reduced data file, in ASCII or HDF5 format
+    """
+    if h5py.is_hdf5(file_path):
+        with ReducedHDF5File(file_path) as reduced_file:
+            return io.StringIO(reduced_file.header())
+    return open(file_path, "r")
+
+
 def read_reduced_file(file_path, configuration=None):
     """
     Read in configurations from a reduced data file.
-    :param str file_path: reduced data file
+    :param str file_path: reduced data file, in ASCII or HDF5 format
     """
     direct_beam_runs = []
     data_runs = []
     additional_peaks = []
 
     # reading is mocked. The file_path is the prefix of the path. File name is obtained from the mocked data
-    with open(file_path, "r") as file_content:
+    with _open_header(file_path) as file_content:
         # Section identifier
         #   0: None
         #   1: direct beams
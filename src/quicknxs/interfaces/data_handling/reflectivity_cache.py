@@ -0,0 +1,173 @@
+"""
+Memoization of the specular reflectivity computed by MagnetismReflectometryReduction.
+
+The reduction is the slowest step of an interactive session, and it is often requested again
+for inputs that have not changed: reloading a run from the data cache, switching data tabs,
+re-adding a run to the reduction list, or changing parameters that are applied after the
+reduction, such as the scaling factor or the cut points.
+
+A result is identified by the event workspaces of the data, a fingerprint of the configuration
+parameters passed to the reduction, and the event workspace and configuration of the direct beam.
+Results are stored for each set of output workspaces, so that a result is only reused while the
+reflectivity workspaces it refers to still hold it.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+
+import mantid.simpleapi as api
+
+from quicknxs.interfaces.configuration import get_direct_beam_low_res_roi
+from quicknxs.interfaces.data_handling.serialization import to_json
+
+# Configuration parameters of the data that are passed to MagnetismReflectometryReduction
+REDUCTION_PARAMETERS = [
+    "peak_roi",
+    "subtract_background",
+    "bck_roi",
+    "low_res_roi",
+    "do_final_rebin",
+    "final_rebin_step",
+    "tof_bins",
+    "use_dangle",
+    "tof_range",
+    "peak_position",
+    "use_constant_q",
+    "sample_size",
+    "set_direct_pixel",
+    "direct_pixel_overwrite",
+    "set_direct_angle_offset",
+    "direct_angle_offset_overwrite",
+]
+
+# Configuration parameters of the direct beam that are passed to MagnetismReflectometryReduction
+NORMALIZATION_PARAMETERS = ["peak_roi", "bck_roi"]
+
+
+def configuration_fingerprint(configuration, parameters=None):
+    """
+    Stable hash of the reduction parameters of a configuration
+
+    :param Configuration configuration: configuration to hash
+    :param list parameters: names of the parameters to include, REDUCTION_PARAMETERS by default
+    """
+    if parameters is None:
+        parameters = REDUCTION_PARAMETERS
+    values = {name: getattr(configuration, name) for name in parameters}
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=to_json).encode()).hexdigest()
+
+
+def reduction_key(nexus_data, direct_beam=None):
+    """
+    Key identifying the reflectivity computed for a data set and a direct beam
+
+    :param NexusData nexus_data: data set
+    :param CrossSectionData direct_beam: direct beam used for normalization, if any
+    """
+    conf = nexus_data.cross_sections[nexus_data.main_cross_section].configuration
+    # The events are identified by their serial number, which is kept when the events of a run
+    # restored from a session file are loaded
+    events = [(xs, nexus_data.cross_sections[xs]._event_workspace_id) for xs in nexus_data.cross_sections]
+    norm = None
+    if direct_beam is not None and direct_beam._event_workspace_id is not None:
+        norm = (
+            direct_beam._event_workspace_id,
+            configuration_fingerprint(direct_beam.configuration, NORMALIZATION_PARAMETERS),
+            get_direct_beam_low_res_roi(conf, direct_beam.configuration),
+        )
+    key = json.dumps([events, configuration_fingerprint(conf), norm], default=to_json)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _has_workspaces(entry):
+    """
+    True if the reflectivity workspaces of a stored result exist, or are still to be restored from a session file
+    """
+    if entry[2] is not None and entry[2].reflectivity:
+        return True
+    return all(result[3] in api.mtd for result in entry[1].values())
+
+
+class ReflectivityCache(object):
+    """
+    Reflectivity results of the last reduction of each set of output workspaces
+    """
+
+    def __init__(self):
+        # Results for each output workspace name:
+        # (key, {cross-section: (q, r, dr, workspace name)}, restored workspaces of a session file or None)
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+        # Files may be loaded and reduced in worker threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def clear(self):
+        with self._lock:
+            self._results = {}
+
+    def restore(self, nexus_data, output_ws, key):
+        """
+        Set the reflectivity of the cross-sections of a data set from a stored result.
+        Returns True if a valid result was found.
+
+        :param NexusData nexus_data: data set to update
+        :param str output_ws: name of the output workspace of the reduction
+        :param str key: key identifying the reduction inputs, see reduction_key()
+        """
+        with self._lock:
+            entry = self._results.get(output_ws)
+            if entry is not None and entry[0] == key and entry[2] is not None:
+                # Create the reflectivity workspaces of a run restored from a session file
+                entry[2].restore()
+            if (
+                entry is None
+                or entry[0] != key
+                or set(entry[1]) != set(nexus_data.cross_sections)
+                or not all(result[3] in api.mtd for result in entry[1].values())
+            ):
+                # The reduction will be run again and overwrite the stored workspaces
+                self._results.pop(output_ws, None)
+                self.misses += 1
+                logging.info("Reflectivity cache miss for %s [%s hits, %s misses]", output_ws, self.hits, self.misses)
+                return False
+            self.hits += 1
+
+        for xs_id, (q, r, dr, ws_name) in entry[1].items():
+            cross_section = nexus_data.cross_sections[xs_id]
+            cross_section.q = q.copy()
+            cross_section._r = r.copy()
+            cross_section._dr = dr.copy()
+            cross_section._reflectivity_workspace = ws_name
+        logging.info("Reflectivity cache hit for %s [%s hits, %s misses]", output_ws, self.hits, self.misses)
+        return True
+
+    def store(self, nexus_data, output_ws, key, restored_workspaces=None):
+        """
+        Store the reflectivity of the cross-sections of a data set
+
+        :param NexusData nexus_data: data set holding the reflectivity
+        :param str output_ws: name of the output workspace of the reduction
+        :param str key: key identifying the reduction inputs, see reduction_key()
+        :param RestoredWorkspaces restored_workspaces: for a run restored from a session file, the workspaces
+                                                       created when first needed, see session.py
+        """
+        results = {}
+        for xs_id, cross_section in nexus_data.cross_sections.items():
+            if cross_section.q is None or cross_section._reflectivity_workspace is None:
+                return
+            results[xs_id] = (
+                cross_section.q.copy(),
+                cross_section._r.copy(),
+                cross_section._dr.copy(),
+                cross_section._reflectivity_workspace,
+            )
+        with self._lock:
+            # Forget the results whose workspaces have been deleted
+            self._results = {name: entry for name, entry in self._results.items() if _has_workspaces(entry)}
+            self._results[output_ws] = (key, results, restored_workspaces)
@@ -0,0 +1,311 @@
+# pylint: disable=too-many-locals, too-many-arguments
+"""
+Fast preview of the specular reflectivity, computed with NumPy from the binned detector cube.
+
+MagnetismReflectometryReduction works from the events and takes too long to follow the mouse
+while the region of interest is dragged. The preview reproduces its steps on the already-binned
+(x, y, TOF) data of a CrossSectionData object: the signal is summed over the peak and low-resolution
+ranges, the average background is subtracted, the result is normalized by the proton charge and by
+the direct beam, converted to Q with the specular angle and rebinned in Q. The QuickNXS scale factor
+is applied as in NexusData.calculate_reflectivity.
+
+With constant-Q binning, each pixel of the peak is normalized separately and converted to Q with its
+own scattering angle, and the points are then accumulated in the final Q bins.
+
+The preview is meant for display only: the reflectivity used for reduction is always computed by Mantid.
+"""
+
+import math
+
+import numpy as np
+
+from quicknxs.interfaces.configuration import get_direct_beam_low_res_roi
+from quicknxs.interfaces.data_handling.cube_storage import SparseCube
+
+H_OVER_M_NEUTRON = 3.956034e-7  # h/m_n [m^2/s]
+Q_MIN = 0.001  # Lower edge of the final Q binning, as passed to MagnetismReflectometryReduction
+CONST_Q_TRIM = 0.1  # Relative number of points under which constant-Q bins are dropped, as ConstQTrim
+
+
+def _pixel_sums(cross_section, x_min, x_max, low_res_roi):
+    """
+    Counts and variances summed over the low-resolution range, for each pixel of a range along the peak axis.
+    Sparse cubes are summed without being converted to dense arrays.
+    """
+    y_min, y_max = max(0, low_res_roi[0]), low_res_roi[1]
+    counts = cross_section.data[x_min:x_max, y_min:y_max, :].sum(axis=1)
+    errors = cross_section.raw_error[x_min:x_max, y_min:y_max, :]
+    if isinstance(errors, SparseCube):
+        squared = errors.with_values(np.square(errors.values, dtype=np.float64))
+    else:
+        squared = errors * errors
+    return counts, squared.sum(axis=1)
+
+
+def _side_mean(counts, variances, pixel_min, pixel_max):
+    """Mean counts and variance of the mean over a range of pixels, or None if the range is empty"""
+    if pixel_max <= pixel_min:
+        return None
+    n_pixels = pixel_max - pixel_min
+    return counts[pixel_min:pixel_max].mean(axis=0), variances[pixel_min:pixel_max].sum(axis=0) / n_pixels**2
+
+
+def roi_pixel_signal(cross_section, peak_roi, low_res_roi, bck_roi, subtract_background=True):
+    """
+    Background-subtracted counts of each pixel of the peak, as a function of TOF, normalized by the proton charge.
+
+    As in LRSubtractAverageBackground, the background is the average over the pixels of the background
+    range on each side of the peak, and it is subtracted from each pixel of the peak.
+
+    :param CrossSectionData cross_section: data with a binned detector cube
+    :param list peak_roi: pixel range of the peak, [first, last + 1]
+    :param list low_res_roi: pixel range in the low-resolution direction, [first, last + 1]
+    :param list bck_roi: pixel range of the background, [first, last + 1]
+    :param bool subtract_background: if False, the background is not subtracted
+    :returns: signal and variance arrays of shape (number of peak pixels, number of TOF bins)
+    """
+    n_x = cross_section.data.shape[0]
+    peak_min, peak_max = max(0, peak_roi[0]), min(n_x, peak_roi[1])
+    bck_min, bck_max = max(0, bck_roi[0]), min(n_x, bck_roi[1])
+    # Only sum the pixels that are used, and shift the ranges accordingly
+    offset = min(peak_min, bck_min) if subtract_background else peak_min
+    x_max = max(peak_max, bck_max) if subtract_background else peak_max
+    counts, variances = _pixel_sums(cross_section, offset, x_max, low_res_roi)
+    peak_min, peak_max, bck_min, bck_max = [i - offset for i in [peak_min, peak_max, bck_min, bck_max]]
+
+    signal = counts[peak_min:peak_max]
+    variance = variances[peak_min:peak_max]
+
+    if subtract_background:
+        left = _side_mean(counts, variances, bck_min, min(bck_max, peak_min)) if peak_min > bck_min else None
+        right = _side_mean(counts, variances, max(bck_min, peak_max), bck_max) if peak_max < bck_max else None
+        if left is not None and right is not None:
+            background = ((left[0] + right[0]) / 2.0, (left[1] + right[1]) / 4.0)
+        else:
+            background = left or right or _side_mean(counts, variances, bck_min, bck_max)
+        if background is not None:
+            signal = signal - background[0]
+            variance = variance + background[1]
+
+    if cross_section.proton_charge > 0:
+        signal = signal / cross_section.proton_charge
+        variance = variance / cross_section.proton_charge**2
+    return signal, variance
+
+
+def roi_signal(cross_section, peak_roi, low_res_roi, bck_roi, subtract_background=True):
+    """
+    Background-subtracted counts in the region of interest, as a function of TOF, normalized by the proton charge.
+    The background-subtracted counts of the pixels of the peak, see roi_pixel_signal, are summed.
+
+    :param CrossSectionData cross_section: data with a binned detector cube
+    :param list peak_roi: pixel range of the peak, [first, last + 1]
+    :param list low_res_roi: pixel range in the low-resolution direction, [first, last + 1]
+    :param list bck_roi: pixel range of the background, [first, last + 1]
+    :param bool subtract_background: if False, the background is not subtracted
+    :returns: signal and error arrays
+    """
+    signal, variance = roi_pixel_signal(cross_section, peak_roi, low_res_roi, bck_roi, subtract_background)
+    return signal.sum(axis=0), np.sqrt(variance.sum(axis=0))
+
+
+def _normalize(signal, error, norm_signal, norm_error):
+    """
+    Divide by the direct beam, with error propagation. Points where the direct beam has no counts are set to zero.
+    The last axis of the signal is TOF, as for the direct beam.
+    """
+    valid = norm_signal > 0
+    safe_norm = np.where(valid, norm_signal, 1.0)
+    r = np.where(valid, signal / safe_norm, 0.0)
+    dr = np.where(valid, np.sqrt((error / safe_norm) ** 2 + (signal * norm_error / safe_norm**2) ** 2), 0.0)
+    return r, dr
+
+
+def _overlaps(edges_in, edges_out):
+    """
+    Matrix of the overlap widths between the bins of two sets of increasing bin edges, of shape (n_out, n_in)
+    """
+    lower = np.maximum(edges_out[:-1, np.newaxis], edges_in[np.newaxis, :-1])
+    upper = np.minimum(edges_out[1:, np.newaxis], edges_in[np.newaxis, 1:])
+    return np.clip(upper - lower, 0.0, None)
+
+
+def rebin_counts(edges_in, signal, error, edges_out):
+    """
+    Rebin histogram counts onto new increasing bin edges, splitting each bin in proportion to its overlap
+    """
+    fraction = _overlaps(edges_in, edges_out) / np.diff(edges_in)[np.newaxis, :]
+    return fraction.dot(signal), np.sqrt((fraction * fraction).dot(error * error))
+
+
+def rebin_distribution(edges_in, signal, error, edges_out):
+    """
+    Rebin distribution data onto new increasing bin edges, the way Mantid's Rebin does for distributions
+    """
+    overlap = _overlaps(edges_in, edges_out)
+    widths = np.diff(edges_out)
+    return overlap.dot(signal) / widths, np.sqrt((overlap * overlap).dot(error * error)) / widths
+
+
+def final_q_edges(q_min, q_max, q_step):
+    """
+    Bin edges of the final Q binning starting at Q_MIN, logarithmic for a negative step,
+    restricted to the bins overlapping [q_min, q_max]
+    """
+    if q_step < 0:
+        growth = math.log1p(-q_step)
+        k_min = max(0, int(math.floor(math.log(q_min / Q_MIN) / growth)))
+        k_max = int(math.ceil(math.log(q_max / Q_MIN) / growth))
+        return Q_MIN * np.exp(growth * np.arange(k_min, k_max + 1))
+    k_min = max(0, int(math.floor((q_min - Q_MIN) / q_step)))
+    k_max = int(math.ceil((q_max - Q_MIN) / q_step))
+    return Q_MIN + q_step * np.arange(k_min, k_max + 1)
+
+
+def constant_q_binning(q, r, dr, q_step, n_pixels):
+    """
+    Accumulate the reflectivity of the (pixel, TOF) points in the final Q bins.
+
+    The points falling in each bin are averaged and multiplied by the number of pixels of the peak,
+    so that the result compares with the reflectivity summed over the peak. Bins with fewer than
+    CONST_Q_TRIM times the points of the fullest bin are set to zero.
+
+    :param ndarray q: Q value of each point
+    :param ndarray r: reflectivity of each point
+    :param ndarray dr: error of each point
+    :param float q_step: step of the final Q binning, logarithmic if negative
+    :param int n_pixels: number of pixels in the peak
+    :returns: Q bin edges, reflectivity and error
+    """
+    # Points below the start of the final binning are dropped
+    inside = q.ravel() >= Q_MIN
+    q, r, dr = q.ravel()[inside], r.ravel()[inside], dr.ravel()[inside]
+    edges = final_q_edges(q.min(), q.max(), q_step)
+    n_bins = len(edges) - 1
+    indices = np.minimum(np.searchsorted(edges, q, side="right") - 1, n_bins - 1)
+    n_points = np.bincount(indices, minlength=n_bins)
+    kept = n_points >= CONST_Q_TRIM * n_points.max()
+    factor = np.where(kept, n_pixels / np.maximum(n_points, 1), 0.0)
+    r_binned = np.bincount(indices, weights=r, minlength=n_bins) * factor
+    dr_binned = np.sqrt(np.bincount(indices, weights=dr * dr, minlength=n_bins)) * factor
+    return edges, r_binned, dr_binned
+
+
+def pixel_angles(cross_section, configuration, theta, peak_roi):
+    """
+    Scattering angle in radians of each pixel of the peak, from the incident angle at the specular pixel
+
+    :param CrossSectionData cross_section: data providing the detector geometry
+    :param Configuration configuration: reduction parameters
+    :param float theta: incident angle at the specular pixel, in radians
+    :param list peak_roi: pixel range of the peak, [first, last + 1]
+    """
+    pixels = np.arange(max(0, peak_roi[0]), min(cross_section.data.shape[0], peak_roi[1]), dtype=float)
+    ref_pixel = configuration.peak_position
+    if ref_pixel == 0:
+        ref_pixel = (peak_roi[0] + peak_roi[1] - 1) / 2.0
+    # The angle decreases with the pixel index, as in specular_angle
+    return theta + np.arctan((ref_pixel - pixels) * cross_section.pixel_width / cross_section.dist_sam_det) / 2.0
+
+
+def specular_angle(cross_section, configuration):
+    """
+    Incident angle in radians, as computed by MRGetTheta for the reduction parameters of a configuration
+    """
+    if not configuration.use_dangle:
+        return math.fabs(cross_section.sangle * math.pi / 180.0)
+    direct_pixel = (
+        configuration.direct_pixel_overwrite if configuration.set_direct_pixel else cross_section._direct_pixel
+    )
+    angle_offset = (
+        configuration.direct_angle_offset_overwrite
+        if configuration.set_direct_angle_offset
+        else cross_section._angle_offset
+    )
+    ref_pixel = configuration.peak_position if configuration.peak_position != 0 else direct_pixel
+    theta = (cross_section.dangle - angle_offset) * math.pi / 360.0
+    theta += (direct_pixel - ref_pixel) * cross_section.pixel_width / (2.0 * cross_section.dist_sam_det)
+    return math.fabs(theta)
+
+
+def preview_reflectivity(cross_section, direct_beam=None, configuration=None):
+    """
+    Compute a preview of the specular reflectivity from the binned detector cube.
+
+    The returned reflectivity includes the scaling factor of the configuration, like the
+    CrossSectionData.r and CrossSectionData.dr properties. Points with zero reflectivity are masked.
+
+    :param CrossSectionData cross_section: data with a binned detector cube
+    :param CrossSectionData direct_beam: direct beam to normalize with, if any
+    :param Configuration configuration: reduction parameters, instead of the ones of the data
+    :returns: q, r and dr arrays
+    """
+    if configuration is None:
+        configuration = cross_section.configuration
+    cross_section.prepare_plot_data()
+    tof_edges = np.asarray(cross_section.tof_edges, dtype=float)
+
+    peak_roi = configuration.peak_roi
+    low_res_roi = configuration.low_res_roi
+    if peak_roi[1] <= peak_roi[0] or low_res_roi[1] <= low_res_roi[0]:
+        raise ValueError("Empty region of interest")
+    constant_q = configuration.use_constant_q
+    signal, variance = roi_pixel_signal(
+        cross_section, peak_roi, low_res_roi, configuration.bck_roi, configuration.subtract_background
+    )
+    if constant_q:
+        error = np.sqrt(variance)
+    else:
+        signal, error = signal.sum(axis=0), np.sqrt(variance.sum(axis=0))
+
+    norm_configuration = configuration
+    norm_low_res_roi = get_direct_beam_low_res_roi(configuration, configuration)
+    if direct_beam is not None:
+        norm_configuration = direct_beam.configuration
+        norm_low_res_roi = get_direct_beam_low_res_roi(configuration, norm_configuration)
+        direct_beam.prepare_plot_data()
+        norm_signal, norm_error = roi_signal(
+            direct_beam,
+            norm_configuration.peak_roi,
+            norm_low_res_roi,
+            norm_configuration.bck_roi,
+            configuration.subtract_background,
+        )
+        norm_edges = np.asarray(direct_beam.tof_edges, dtype=float)
+        if not np.array_equal(norm_edges, tof_edges):
+            norm_signal, norm_error = rebin_counts(norm_edges, norm_signal, norm_error, tof_edges)
+        r, dr = _normalize(signal, error, norm_signal, norm_error)
+    else:
+        r, dr = signal, error
+
+    # QuickNXS scale factor
+    theta = specular_angle(cross_section, configuration)
+    norm_peak_roi = norm_configuration.peak_roi
+    scale = float(norm_peak_roi[1] - norm_peak_roi[0]) * float(norm_low_res_roi[1] - norm_low_res_roi[0])
+    scale /= float(peak_roi[1] - peak_roi[0]) * float(low_res_roi[1] - low_res_roi[0])
+    if theta > 0.0002:
+        scale *= 0.005 / math.sin(theta)
+    r = r * scale
+    dr = dr * scale
+
+    # Convert TOF to Q, in increasing order
+    wavelength_edges = H_OVER_M_NEUTRON * tof_edges * 1.0e4 / cross_section.dist_mod_det
+    if constant_q:
+        wavelengths = (wavelength_edges[:-1] + wavelength_edges[1:]) / 2.0
+        angles = pixel_angles(cross_section, configuration, theta, peak_roi)
+        q_points = 4.0 * math.pi * np.sin(angles)[:, np.newaxis] / wavelengths[np.newaxis, :]
+        q_edges, r, dr = constant_q_binning(q_points, r, dr, configuration.final_rebin_step, len(angles))
+    else:
+        q_edges = (4.0 * math.pi * math.sin(theta) / wavelength_edges)[::-1]
+        r = r[::-1]
+        dr = dr[::-1]
+
+    if configuration.do_final_rebin and theta > 0 and not constant_q:
+        edges = final_q_edges(q_edges[0], q_edges[-1], configuration.final_rebin_step)
+        r, dr = rebin_distribution(q_edges, r, dr, edges)
+        q_edges = edges
+
+    q = (q_edges[:-1] + q_edges[1:]) / 2.0
+    dr = np.sqrt((dr * configuration.scaling_factor) ** 2 + (configuration.scaling_error * r) ** 2)
+    r = np.ma.masked_equal(r * configuration.scaling_factor, 0)
+    return q, r, np.ma.masked_array(dr, mask=r.mask)
@@ -0,0 +1,410 @@
+"""
+Index of the run meta-data of the event files in a data directory.
+
+The DAS logs needed to sort and match runs (wavelength, angles, slits, data type,
+ROI) are read directly from the NeXus files with h5py, without loading the events,
+and kept in a SQLite database keyed by the file modification time. Updating the index
+for a directory only reads the files that were added or modified since the last update.
+
+The index is kept in memory unless ``Configuration.run_index_file`` is set, in which
+case it persists across sessions.
+"""
+
+import glob
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+
+import h5py
+import numpy as np
+
+from .data_set import NexusMetaData
+
+# DAS logs stored in the index, in addition to the ones compared when summing runs
+INDEXED_LOGS = [
+    "LambdaRequest",
+    "frequency",
+    "data_type",
+    "DANGLE",
+    "DANGLE0",
+    "SANGLE",
+    "DIRPIX",
+    "SampleDetDis",
+    "S1HCenter",
+    "S1VCenter",
+    "S1HWidth",
+    "S1Vheight",
+    "S2HCenter",
+    "S2VCenter",
+    "S2HWidth",
+    "S2Vheight",
+    "S3HCenter",
+    "S3VCenter",
+    "S3HWidth",
+    "S3Vheight",
+    "BL4A:Mot:S1:X:Gap",
+    "BL4A:Mot:S2:X:Gap",
+    "BL4A:Mot:S3:X:Gap",
+    "ROI1StartX",
+    "ROI1StartY",
+    "ROI1SizeX",
+    "ROI1SizeY",
+    "ROI1EndX",
+    "ROI1EndY",
+    "ROI2StartX",
+    "ROI2StartY",
+    "ROI2SizeX",
+    "ROI2SizeY",
+    "ROI2EndX",
+    "ROI2EndY",
+]
+
+_UNITS = {
+    "m": {"mm": 1000.0},
+    "mm": {"m": 0.001},
+    "deg": {"rad": math.pi / 180.0},
+    "rad": {"deg": 180.0 / math.pi},
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mid_q REAL,
+    is_direct_beam INTEGER NOT NULL,
+    lambda_center REAL,
+    slit1_width REAL,
+    slit2_width REAL,
+    slit3_width REAL,
+    logs TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_directory ON runs (directory, file_name);
+CREATE INDEX IF NOT EXISTS runs_direct_beam ON runs (is_direct_beam, lambda_center);
+"""
+
+
+def event_files(directory):
+    """
+    Sorted list of the absolute paths of the event files in a directory
+    :param str directory: data directory
+    """
+    file_list = glob.glob(os.path.join(directory, "*event.nxs"))
+    file_list.extend(glob.glob(os.path.join(directory, "*.nxs.h5")))
+    return sorted(file_list, key=os.path.basename)
+
+
+def _log_entry(nxs):
+    """
+    Return the first entry of an open NeXus file that has DAS logs, or None
+    """
+    for key in sorted(nxs.keys()):
+        if isinstance(nxs[key], h5py.Group) and "DASlogs" in nxs[key]:
+            return nxs[key]
+    return None
+
+
+def _units(dataset):
+    units = dataset.attrs.get("units", "")
+    if isinstance(units, np.ndarray):
+        units = units[0] if units.size else ""
+    if isinstance(units, bytes):
+        units = units.decode(errors="replace")
+    return str(units)
+
+
+def read_run_logs(file_path):
+    """
+    Read the indexed DAS logs of an event file, without loading the events.
+
+    For each log, the first value and the mean of the values are returned, along with the
+    units, as ``{name: [first, mean, units]}``. Logs missing from the file or that are not
+    numerical are skipped.
+
+    :param str file_path: path to the event file
+    """
+    logs = dict()
+    with h5py.File(file_path, mode="r") as nxs:
+        entry = _log_entry(nxs)
+        if entry is None:
+            raise RuntimeError("No DAS logs in data file %s" % file_path)
+        das_logs = entry["DASlogs"]
+        for name in INDEXED_LOGS:
+            if name not in das_logs or "value" not in das_logs[name]:
+                continue
+            dataset = das_logs[name]["value"]
+            try:
+                values = np.asarray(dataset[()], dtype=float).ravel()
+            except (TypeError, ValueError):
+                continue
+            if values.size == 0:
+                continue
+            logs[name] = [float(values[0]), float(values.mean()), _units(dataset)]
+    return logs
+
+
+def log_mean(logs, name, target_units="", assumed_units=""):
+    """
+    Mean value of a log, taking care of units, as data_manipulation.read_log does for workspaces.
+    :param dict logs: logs returned by read_run_logs
+    :param str name: name of the log
+    :param str target_units: units to convert to
+    :param str assumed_units: units of origin, if not specified in the log itself
+    """
+    _, value, units = logs[name]
+    units = units if units in _UNITS else assumed_units
+    if units in _UNITS and target_units in _UNITS[units]:
+        return value * _UNITS[units][target_units]
+    return value
+
+
+def mid_q_value(logs):
+    """
+    Q-value at the requested wavelength, computed the way Instrument.mid_q_value does
+    using the scattering angle from MRGetTheta. Returns None if the logs are missing.
+    :param dict logs: logs returned by read_run_logs
+    """
+    try:
+        wl = logs["LambdaRequest"][0]
+        dangle = log_mean(logs, "DANGLE", target_units="rad", assumed_units="deg")
+        dangle0 = log_mean(logs, "DANGLE0", target_units="rad", assumed_units="deg")
+    except KeyError:
+        return None
+    theta_d = math.fabs((dangle - dangle0) / 2.0)
+    return 4.0 * math.pi * math.sin(theta_d) / wl
+
+
+def _slit_widths(logs):
+    """
+    Slit widths, as read by Instrument.get_info
+    """
+    names = ["BL4A:Mot:S%d:X:Gap" % i for i in range(1, 4)]
+    if names[0] not in logs:
+        names = ["S%dHWidth" % i for i in range(1, 4)]
+    return [logs[name][0] if name in logs else None for name in names]
+
+
+class RunIndex(object):
+    """
+    SQLite index of run meta-data, keyed by file path and modification time.
+    """
+
+    def __init__(self, database=":memory:"):
+        """
+        :param str database: path to the database file, or ":memory:" for an in-memory index
+        """
+        self.database = database
+        if database != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        # Directories indexed during this session
+        self._updated_directories = set()
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def _index_file(self, file_path, stat):
+        """
+        Read the logs of a file and store them. Returns False if the file could not be read.
+        """
+        try:
+            logs = read_run_logs(file_path)
+        except (OSError, KeyError, RuntimeError):
+            # The file may still be being written
+            logging.info("Could not index %s", file_path)
+            return False
+        data_type = logs.get("data_type")
+        row = (
+            file_path,
+            os.path.dirname(file_path),
+            os.path.basename(file_path),
+            stat.st_mtime_ns,
+            stat.st_size,
+            mid_q_value(logs),
+            int(data_type is not None and data_type[0] == 1),
+            logs["LambdaRequest"][0] if "LambdaRequest" in logs else None,
+            *_slit_widths(logs),
+            json.dumps(logs),
+        )
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        return True
+
+    def _is_current(self, file_path, stat):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mtime_ns, size FROM runs WHERE path = ?", (file_path,)
+            ).fetchone()
+        return row is not None and row["mtime_ns"] == stat.st_mtime_ns and row["size"] == stat.st_size
+
+    def update_file(self, file_path):
+        """
+        Index a file if it is new or was modified. Returns False if the file could not be indexed.
+        :param str file_path: path to the event file
+        """
+        file_path = os.path.abspath(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        if self._is_current(file_path, stat):
+            return True
+        return self._index_file(file_path, stat)
+
+    def update(self, directory):
+        """
+        Bring the index of a directory up to date: index new and modified event files and
+        drop the files that were removed.
+        :param str directory: data directory
+        """
+        directory = os.path.abspath(directory)
+        with self._lock:
+            known = {
+                row["path"]: (row["mtime_ns"], row["size"])
+                for row in self._connection.execute(
+                    "SELECT path, mtime_ns, size FROM runs WHERE directory = ?", (directory,)
+                )
+            }
+        found = set()
+        for file_path in event_files(directory):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            found.add(file_path)
+            if known.get(file_path) != (stat.st_mtime_ns, stat.st_size):
+                self._index_file(file_path, stat)
+        removed = [(path,) for path in known if path not in found]
+        if removed:
+            with self._lock, self._connection:
+                self._connection.executemany("DELETE FROM runs WHERE path = ?", removed)
+        self._updated_directories.add(directory)
+
+    def refresh(self, directory):
+        """
+        Update the index of a directory if it was indexed during this session, for instance
+        when the directory watcher reports a change. Only new and modified files are read.
+        :param str directory: data directory
+        """
+        if os.path.abspath(directory) in self._updated_directories:
+            self.update(directory)
+
+    def _ensure_directory(self, directory):
+        """
+        Index a directory the first time it is queried in this session. Later changes
+        are picked up by calls to update() when the directory watcher fires.
+        """
+        directory = os.path.abspath(directory)
+        if directory not in self._updated_directories:
+            self.update(directory)
+        return directory
+
+    def _get_row(self, file_path):
+        file_path = os.path.abspath(file_path)
+        if not self.update_file(file_path):
+            return None
+        with self._lock:
+            return self._connection.execute("SELECT * FROM runs WHERE path = ?", (file_path,)).fetchone()
+
+    def get_meta_data(self, file_path):
+        """
+        Return the NexusMetaData of an event file, or None if it could not be read
+        :param str file_path: path to the event file
+        """
+        row = self._get_row(file_path)
+        if row is None or row["mid_q"] is None:
+            return None
+        meta_data = NexusMetaData()
+        meta_data.mid_q = row["mid_q"]
+        meta_data.is_direct_beam = bool(row["is_direct_beam"])
+        return meta_data
+
+    def get_log_values(self, file_path, log_names):
+        """
+        Return the mean value of DAS logs for an event file, as a dictionary. Logs that
+        are missing from the file are left out. Returns None if the file could not be read.
+        :param str file_path: path to the event file
+        :param list log_names: names of the logs
+        """
+        row = self._get_row(file_path)
+        if row is None:
+            return None
+        logs = json.loads(row["logs"])
+        return {name: logs[name][1] for name in log_names if name in logs}
+
+    def increasing_q_runs(self, file_path, mid_q, is_direct_beam, max_runs=10):
+        """
+        Return the paths of the runs following a run in its directory whose mid q-value keeps
+        increasing from a starting value, among the next max_runs runs, and that have the same
+        data type (direct beam or not).
+        :param str file_path: path to the event file to start from
+        :param float mid_q: starting q-value
+        :param bool is_direct_beam: type of data to select
+        :param int max_runs: maximum number of runs to look at
+        """
+        file_path = os.path.abspath(file_path)
+        directory = self._ensure_directory(os.path.dirname(file_path))
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, mid_q, is_direct_beam FROM runs WHERE directory = ? AND file_name > ? "
+                "ORDER BY file_name LIMIT ?",
+                (directory, os.path.basename(file_path), max_runs),
+            ).fetchall()
+        runs = []
+        for row in rows:
+            if row["mid_q"] is not None and mid_q <= row["mid_q"] and bool(row["is_direct_beam"]) == is_direct_beam:
+                mid_q = row["mid_q"]
+                runs.append(row["path"])
+        return runs
+
+    def direct_beams(self, directory, lambda_center, tolerance=0.02, slit_widths=None):
+        """
+        Return the paths of the direct beams of a directory that match a wavelength and,
+        optionally, slit widths, within a tolerance, in the same way as Instrument.direct_beam_match.
+        :param str directory: data directory
+        :param float lambda_center: requested wavelength
+        :param float tolerance: tolerance on the wavelength and slit widths
+        :param list slit_widths: widths of the three slits, or None to skip the slit check
+        """
+        directory = self._ensure_directory(directory)
+        query = "SELECT path FROM runs WHERE directory = ? AND is_direct_beam = 1 AND abs(lambda_center - ?) < ?"
+        parameters = [directory, lambda_center, tolerance]
+        if slit_widths is not None:
+            for i, width in enumerate(slit_widths):
+                query += " AND abs(slit%d_width - ?) < ?" % (i + 1)
+                parameters.extend([width, tolerance])
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY file_name", parameters).fetchall()
+        return [row["path"] for row in rows]
+
+
+_run_indexes = {}
+
+
+def get_run_index(configuration=None):
+    """
+    Return the run index for a configuration. The index is kept in memory unless
+    ``configuration.run_index_file`` is set.
+    :param Configuration configuration: configuration holding the index options
+    """
+    database = ":memory:"
+    if configuration is not None and configuration.run_index_file:
+        database = configuration.run_index_file
+    index = _run_indexes.get(database)
+    if index is None:
+        try:
+            index = RunIndex(database)
+        except (OSError, sqlite3.Error):
+            logging.error("Could not open run index %s", database)
+            index = RunIndex()
+        _run_indexes[database] = index
+    return index
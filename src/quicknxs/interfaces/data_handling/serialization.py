@@ -0,0 +1,16 @@
+"""
+JSON serialization of the numpy values found in configurations and cache metadata.
+"""
+
+import numpy as np
+
+
+def to_json(item):
+    """
+    Convert numpy types for JSON serialization, to be passed as the default of json.dump()
+    """
+    if isinstance(item, np.ndarray):
+        return item.tolist()
+    if isinstance(item, np.generic):
+        return item.item()
+    raise TypeError("Cannot serialize %s" % type(item))
@@ -0,0 +1,386 @@
+"""
+Snapshot of a reduction session.
+
+A session file holds what the DataManager needs to show, reduce and export a set of runs:
+the reduction lists of each peak, the direct beam list, and for each run the configuration,
+binned detector data and reflectivity of its cross-sections. Restoring a session does not
+read the event files, so it takes about as long as reading the arrays from disk.
+
+Large arrays are memory-mapped from the session file instead of being read. The Mantid
+workspaces are only created when they are needed: the reflectivity workspaces are loaded
+back from the processed NeXus copies stored in the session file, and the events of a run
+are loaded from its data files the first time a reduction has to be computed again. Until
+the reduction parameters change, the stored reflectivity is reused from the reflectivity cache.
+
+Off-specular and GISANS results, and runs that are in the data cache but in none of the
+lists, are not stored.
+"""
+
+import json
+import logging
+import os
+import tempfile
+from collections.abc import Mapping
+
+import h5py
+import mantid.simpleapi as api
+import numpy as np
+
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.cube_storage import CompactCube, SparseCube, SqrtCountsCube
+from quicknxs.interfaces.data_handling import reflectivity_cache
+from quicknxs.interfaces.data_handling.data_set import CrossSectionData, NexusData, next_event_workspace_id
+from quicknxs.interfaces.data_handling.serialization import to_json
+
+from ... import __version__
+
+SESSION_VERSION = 1
+
+# Arrays of at least this number of bytes are memory-mapped from the session file
+MEMORY_MAP_MIN_SIZE = 2**20
+
+# Attributes of CrossSectionData that are not stored. The configuration is stored on its own,
+# the workspaces are restored when needed, and the off-specular and GISANS results are computed again.
+EXCLUDED_ATTRIBUTES = [
+    "configuration",
+    "_event_workspace",
+    "_event_workspace_id",
+    "_das_logs",
+    "restored_workspaces",
+    "off_spec",
+    "gisans_data",
+    "SGrid",
+    "QyGrid",
+    "QzGrid",
+]
+
+
+def configuration_to_json(configuration):
+    """
+    Serialize the reduction options of a configuration
+    :param Configuration configuration: configuration to serialize
+    """
+    values = {name: value for name, value in vars(configuration).items() if name != "instrument"}
+    return json.dumps(values, default=to_json)
+
+
+def configuration_from_json(text):
+    """
+    Create a configuration from its serialized reduction options
+    :param str text: output of configuration_to_json()
+    """
+    configuration = Configuration()
+    for name, value in json.loads(text).items():
+        setattr(configuration, name, value)
+    if configuration.tof_overwrite is not None:
+        configuration.tof_overwrite = np.asarray(configuration.tof_overwrite)
+    return configuration
+
+
+def _write_text(group, name, text):
+    # Attributes are limited in size, so long texts are stored as datasets
+    group.create_dataset(name, data=text)
+
+
+def _read_text(group, name):
+    return group[name].asstr()[()]
+
+
+def _write_array(group, name, array, stored_arrays, identity):
+    """
+    Store an array in a contiguous dataset, which can be memory-mapped. Copies of an array
+    already stored for the same cross-section, as held by the additional peak lists, are
+    stored as links to the first one.
+    :param h5py.Group group: group to store the array in
+    :param str name: name of the dataset
+    :param ndarray array: array to store
+    :param dict stored_arrays: arrays already stored, for each identity
+    :param tuple identity: cross-section and attribute the array belongs to
+    """
+    array = np.ascontiguousarray(array)
+    key = identity + (array.shape, array.dtype.str)
+    for stored, dataset in stored_arrays.get(key, []):
+        if np.array_equal(stored, array):
+            group[name] = dataset
+            return
+    stored_arrays.setdefault(key, []).append((array, group.create_dataset(name, data=array)))
+
+
+def _read_array(file_path, dataset):
+    """
+    Read an array stored by _write_array(), as a read-only memory map of the session file if it is large
+    :param str file_path: session file
+    :param h5py.Dataset dataset: stored array
+    """
+    offset = dataset.id.get_offset()
+    if dataset.nbytes >= MEMORY_MAP_MIN_SIZE and offset is not None and dataset.dtype.isnative:
+        return np.memmap(file_path, mode="r", dtype=dataset.dtype, shape=dataset.shape, offset=offset)
+    return dataset[()]
+
+
+def _write_workspace(group, name, workspace_name):
+    """
+    Store a Mantid workspace, with its logs and history, as the contents of a processed NeXus file
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "workspace.nxs")
+        api.SaveNexusProcessed(InputWorkspace=workspace_name, Filename=path)
+        with open(path, "rb") as fd:
+            return group.create_dataset(name, data=np.frombuffer(fd.read(), dtype=np.uint8))
+
+
+class RestoredWorkspaces(object):
+    """
+    Mantid workspaces of a run restored from a session file, created when first needed.
+    Shared by the cross-sections of the run, see CrossSectionData.restore_workspaces().
+    """
+
+    def __init__(self, nexus_data, reflectivity):
+        """
+        :param NexusData nexus_data: restored run
+        :param dict reflectivity: contents of the processed NeXus file of each reflectivity workspace, by name
+        """
+        self.nexus_data = nexus_data
+        self.reflectivity = reflectivity
+        self.events_loaded = False
+
+    def restore(self, events=False):
+        """
+        Load the reflectivity workspaces, and the events if requested, unless they were already loaded
+        :param bool events: if True, also load the events from the data files
+        """
+        if self.reflectivity:
+            reflectivity, self.reflectivity = self.reflectivity, {}
+            self._load_reflectivity(reflectivity)
+        if events and not self.events_loaded:
+            self.events_loaded = True
+            logging.info("Loading the events of restored run %s", self.nexus_data.number)
+            self.nexus_data.load_events()
+
+    def _load_reflectivity(self, reflectivity):
+        names = []
+        with tempfile.TemporaryDirectory() as directory:
+            for i, (name, contents) in enumerate(reflectivity.items()):
+                names.append(name)
+                if name in api.mtd:
+                    continue
+                path = os.path.join(directory, "workspace_%s.nxs" % i)
+                with open(path, "wb") as fd:
+                    fd.write(contents.tobytes())
+                api.LoadNexusProcessed(Filename=path, OutputWorkspace=name)
+        # The reduction of a run with several cross-sections outputs a group, which the script generation uses
+        if len(names) > 1:
+            api.GroupWorkspaces(InputWorkspaces=names, OutputWorkspace="r%s" % self.nexus_data.number)
+
+
+def _write_run(group, nexus_data, stored_arrays):
+    """
+    Store a run and its cross-sections
+    :param h5py.Group group: group to store the run in
+    :param NexusData nexus_data: run to store
+    :param dict stored_arrays: arrays and workspaces already stored, see _write_array()
+    """
+    cross_sections = list(nexus_data.cross_sections.keys())
+    state = dict(
+        file_path=nexus_data.file_path,
+        number=nexus_data.number,
+        main_cross_section=nexus_data.main_cross_section,
+        cross_sections=cross_sections,
+    )
+    _write_text(group, "state", json.dumps(state))
+    _write_text(group, "configuration", configuration_to_json(nexus_data.configuration))
+    for i, xs in enumerate(cross_sections):
+        cross_section = nexus_data.cross_sections[xs]
+        xs_group = group.create_group("cross_section_%s" % i)
+        _write_text(xs_group, "configuration", configuration_to_json(cross_section.configuration))
+        arrays = xs_group.create_group("arrays")
+        values = {}
+        masked = []
+        compact = []
+        sqrt_count_errors = {}
+        for name, value in vars(cross_section).items():
+            if name in EXCLUDED_ATTRIBUTES:
+                continue
+            if isinstance(value, SqrtCountsCube):
+                # Errors computed from the counts are not stored, see cube_storage.py
+                sqrt_count_errors[name] = next(
+                    counts_name for counts_name, counts in vars(cross_section).items() if counts is value.counts
+                )
+                continue
+            if isinstance(value, SparseCube):
+                # Sparse cubes are stored as dense arrays, which are memory-mapped when restored
+                value = value.toarray()
+                if value.dtype != np.float64:
+                    value = CompactCube(value)
+            if isinstance(value, CompactCube):
+                compact.append(name)
+                value = value.values
+            if isinstance(value, np.ndarray):
+                if isinstance(value, np.ma.MaskedArray):
+                    masked.append(name)
+                    value = np.ma.getdata(value)
+                _write_array(arrays, name, value, stored_arrays, (nexus_data.file_path, xs, name))
+                continue
+            if isinstance(value, Mapping):
+                # The DAS log statistics are computed when read, see DASLogs
+                value = dict(value)
+            try:
+                values[name] = json.loads(json.dumps(value, default=to_json))
+            except (TypeError, ValueError):
+                logging.warning("Could not store %s of %s %s", name, nexus_data.number, xs)
+        values["masked_arrays"] = masked
+        values["compact_arrays"] = compact
+        values["sqrt_count_errors"] = sqrt_count_errors
+        _write_text(xs_group, "state", json.dumps(values))
+        # The copies of a run in the additional peak lists may share its workspaces
+        workspace_name = cross_section._reflectivity_workspace
+        if workspace_name is not None and workspace_name in api.mtd:
+            key = ("workspace", workspace_name)
+            if key in stored_arrays:
+                xs_group["reflectivity_workspace"] = stored_arrays[key]
+            else:
+                stored_arrays[key] = _write_workspace(xs_group, "reflectivity_workspace", workspace_name)
+
+
+def _read_run(file_path, group):
+    """
+    Restore a run stored by _write_run(), without its workspaces
+    :param str file_path: session file
+    :param h5py.Group group: group the run is stored in
+    """
+    state = json.loads(_read_text(group, "state"))
+    nexus_data = NexusData(state["file_path"], configuration_from_json(_read_text(group, "configuration")))
+    nexus_data.number = state["number"]
+    nexus_data.main_cross_section = state["main_cross_section"]
+    reflectivity = {}
+    restored_workspaces = RestoredWorkspaces(nexus_data, reflectivity)
+    for i, xs in enumerate(state["cross_sections"]):
+        xs_group = group["cross_section_%s" % i]
+        values = json.loads(_read_text(xs_group, "state"))
+        masked = values.pop("masked_arrays")
+        compact = values.pop("compact_arrays", [])
+        sqrt_count_errors = values.pop("sqrt_count_errors", {})
+        configuration = configuration_from_json(_read_text(xs_group, "configuration"))
+        cross_section = CrossSectionData(xs, configuration, entry_name=values["entry_name"])
+        for name, value in values.items():
+            setattr(cross_section, name, value)
+        cross_section.log_minmax = {motor: tuple(value) for motor, value in cross_section.log_minmax.items()}
+        for name, dataset in xs_group["arrays"].items():
+            array = _read_array(file_path, dataset)
+            if name in masked:
+                array = np.ma.masked_equal(array, 0)
+            if name in compact:
+                array = CompactCube(array)
+            setattr(cross_section, name, array)
+        for name, counts_name in sqrt_count_errors.items():
+            setattr(cross_section, name, SqrtCountsCube(getattr(cross_section, counts_name)))
+        if "reflectivity_workspace" in xs_group:
+            reflectivity[cross_section._reflectivity_workspace] = _read_array(
+                file_path, xs_group["reflectivity_workspace"]
+            )
+        cross_section.restored_workspaces = restored_workspaces
+        # The events loaded later on are identified as those of the restored data, see NexusData.load_events()
+        cross_section._event_workspace_id = next_event_workspace_id()
+        nexus_data.cross_sections[xs] = cross_section
+    return nexus_data
+
+
+def save_session(data_manager, file_path):
+    """
+    Write the state of a data manager to a session file. The file is replaced in one step,
+    so that a session restored from it can still read its arrays.
+    :param DataManager data_manager: data manager to save
+    :param str file_path: session file
+    """
+    runs = []
+
+    def _run_index(nexus_data):
+        for i, item in enumerate(runs):
+            if item is nexus_data:
+                return i
+        runs.append(nexus_data)
+        return len(runs) - 1
+
+    state = dict(
+        version=SESSION_VERSION,
+        current_directory=data_manager.current_directory,
+        current_file_name=data_manager.current_file_name,
+        active_reduction_list_index=data_manager.active_reduction_list_index,
+        peak_reduction_lists={
+            str(index): [_run_index(nexus_data) for nexus_data in reduction_list]
+            for index, reduction_list in data_manager.peak_reduction_lists.items()
+        },
+        direct_beam_list=[_run_index(nexus_data) for nexus_data in data_manager.direct_beam_list],
+        reduction_states=list(data_manager.reduction_states),
+        active_run=None,
+        active_channel=None,
+    )
+    if data_manager._nexus_data is not None:
+        state["active_run"] = _run_index(data_manager._nexus_data)
+    if data_manager.active_channel is not None:
+        state["active_channel"] = data_manager.active_channel.name
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    os.close(fd)
+    try:
+        with h5py.File(temp_path, "w") as session:
+            session.attrs["creator"] = "QuickNXS %s" % __version__
+            _write_text(session, "state", json.dumps(state))
+            stored_arrays = {}
+            for i, nexus_data in enumerate(runs):
+                _write_run(session.create_group("run_%s" % i), nexus_data, stored_arrays)
+        os.replace(temp_path, file_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def load_session(data_manager, file_path):
+    """
+    Replace the state of a data manager by the one stored in a session file
+    :param DataManager data_manager: data manager to restore
+    :param str file_path: session file
+    """
+    with h5py.File(file_path, "r") as session:
+        state = json.loads(_read_text(session, "state"))
+        if state["version"] > SESSION_VERSION:
+            raise RuntimeError("%s was written by a newer version of QuickNXS" % file_path)
+        runs = []
+        while "run_%s" % len(runs) in session:
+            runs.append(_read_run(file_path, session["run_%s" % len(runs)]))
+
+    # Drop the current session before replacing it
+    data_manager.direct_beam_list = []
+    data_manager.peak_reduction_lists = {data_manager.MAIN_REDUCTION_LIST_INDEX: []}
+    data_manager._nexus_data = None
+    data_manager.active_channel = None
+    data_manager.clear_cache()
+
+    data_manager.current_directory = state["current_directory"]
+    data_manager.current_file_name = state["current_file_name"]
+    data_manager.peak_reduction_lists = {
+        int(index): [runs[i] for i in run_indices] for index, run_indices in state["peak_reduction_lists"].items()
+    }
+    data_manager.direct_beam_list = [runs[i] for i in state["direct_beam_list"]]
+    data_manager.active_reduction_list_index = state["active_reduction_list_index"]
+    data_manager.reduction_states = state["reduction_states"]
+    # The copies of the runs held by the additional peak lists are not in the cache
+    cached = state["peak_reduction_lists"].get(str(data_manager.MAIN_REDUCTION_LIST_INDEX), []) + state[
+        "direct_beam_list"
+    ]
+    if state["active_run"] is not None:
+        cached.append(state["active_run"])
+    data_manager._cache = [run for i, run in enumerate(runs) if i in cached]
+    # Reducing a restored run with unchanged parameters reuses its stored reflectivity, without loading the events
+    for index, reduction_list in data_manager.peak_reduction_lists.items():
+        for nexus_data in reduction_list:
+            key = reflectivity_cache.reduction_key(nexus_data, data_manager._find_direct_beam(nexus_data))
+            restored_workspaces = nexus_data.cross_sections[nexus_data.main_cross_section].restored_workspaces
+            output_ws = "r%s%s" % (nexus_data.number, index)
+            data_manager.reflectivity_cache.store(nexus_data, output_ws, key, restored_workspaces)
+    if state["active_run"] is not None:
+        data_manager._nexus_data = runs[state["active_run"]]
+        data_manager.set_channel(0)
+        if state["active_channel"] in data_manager.data_sets:
+            data_manager.active_channel = data_manager.data_sets[state["active_channel"]]
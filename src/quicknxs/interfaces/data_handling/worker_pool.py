@@ -0,0 +1,157 @@
+"""
+Application-wide pool of worker processes for the parallel stages of the
+off-specular and GISANS calculations.
+
+The pool is created on first use and reused by later calls, so that worker
+processes are not started again for every calculation. Its size is given by
+``Configuration.worker_processes``. Large input arrays are passed to the
+workers through shared memory blocks instead of being pickled for each task.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from quicknxs.interfaces.configuration import Configuration
+
+# Start the workers from a fresh interpreter rather than forking, since the calling
+# process runs Mantid and, in the application, Qt threads.
+_CONTEXT = multiprocessing.get_context("spawn")
+
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+
+def can_start_workers():
+    """
+    False in daemonic processes, such as the workers of ``quicknxs-reduce -j``,
+    which are not allowed to have children.
+    """
+    return not multiprocessing.current_process().daemon
+
+
+def get_pool_size():
+    """
+    Number of worker processes of the pool: ``Configuration.worker_processes``,
+    or the number of CPUs if it is 0.
+    """
+    if Configuration.worker_processes > 0:
+        return Configuration.worker_processes
+    return os.cpu_count() or 1
+
+
+def get_worker_pool():
+    """
+    Return the application-wide worker pool, creating it on first use, or None if
+    the parallel stages should run in the calling process: when a single worker is
+    configured, or when the calling process cannot start workers.
+    """
+    global _pool, _pool_size
+    size = get_pool_size()
+    with _pool_lock:
+        if _pool is not None and _pool_size != size:
+            _close_pool()
+        if size <= 1 or not can_start_workers():
+            return None
+        if _pool is None:
+            # Start the resource tracker first, so that the workers share it with this process
+            # and shared memory blocks are only tracked, and released, once.
+            resource_tracker.ensure_running()
+            _pool = _CONTEXT.Pool(size)
+            _pool_size = size
+            logging.info("Started %s worker processes", size)
+        return _pool
+
+
+def _close_pool():
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+        _pool_size = 0
+
+
+def shutdown_worker_pool():
+    """
+    Stop the worker processes. A new pool is created if it is needed again.
+    """
+    with _pool_lock:
+        _close_pool()
+
+
+atexit.register(shutdown_worker_pool)
+
+
+class SharedArrays(object):
+    """
+    Copies of numpy arrays in shared memory blocks, to be read by worker processes.
+
+    Use as a context manager: the descriptors of the arrays, which are small and can be
+    passed to the workers, are returned on entry and the blocks are released on exit.
+
+        with SharedArrays(x=x, y=y) as arrays:
+            results = pool.map(function, [dict(arrays=arrays, index=i) for i in range(n)])
+    """
+
+    def __init__(self, **arrays):
+        self._blocks = []
+        self.descriptors = {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                self.descriptors[name] = (block.name, array.shape, array.dtype.str)
+        except Exception:
+            self.release()
+            raise
+
+    def __enter__(self):
+        return self.descriptors
+
+    def __exit__(self, *args):
+        self.release()
+
+    def release(self):
+        """Free the shared memory blocks"""
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+class attached_arrays(object):
+    """
+    Context manager giving read-only access, in a worker process, to arrays shared
+    with SharedArrays. The arrays must not be used after exiting the context.
+
+        with attached_arrays(descriptors) as arrays:
+            total = arrays["x"].sum()
+    """
+
+    def __init__(self, descriptors):
+        self.descriptors = descriptors
+        self._blocks = []
+
+    def __enter__(self):
+        arrays = {}
+        for name, (block_name, shape, dtype) in self.descriptors.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            self._blocks.append(block)
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            array.flags.writeable = False
+            arrays[name] = array
+        return arrays
+
+    def __exit__(self, *args):
+        for block in self._blocks:
+            block.close()
+        self._blocks = []
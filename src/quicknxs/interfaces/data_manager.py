@@ -11,16 +11,17 @@ import os
 import sys
 import time
 
+import mantid.simpleapi as api
 import numpy as np
 
 from quicknxs.interfaces.data_handling.data_set import NexusData
 from quicknxs.interfaces.data_handling.filepath import FilePath, RunNumbers
+from quicknxs.interfaces.data_handling.reflectivity_cache import ReflectivityCache
 
-from .data_handling import data_manipulation, gisans, quicknxs_io
+from .data_handling import data_manipulation, gisans, quicknxs_io, reflectivity_preview, session
 
 
 class DataManager(object):
-    MAX_CACHE = 50  # maximum number of loaded datasets (either single-file or merged-files types)
     MAIN_REDUCTION_LIST_INDEX = 1
 
     def __init__(self, current_directory):
@@ -30,7 +31,7 @@ class DataManager(object):
         # Current data set
         self._nexus_data = None
         self.active_channel = None  # type: Optional[CrossSectionData]
-        # Cache of loaded data: list of NexusData instances
+        # Cache of loaded data: list of NexusData instances, from least to most recently used
         self._cache = list()  # type: List[NexusData]
 
         # Current data tab (ROI)
@@ -47,6 +48,8 @@ class DataManager(object):
         # Cached outputs
         self.cached_offspec = None
         self.cached_gisans = None
+        # Results of the specular reduction, reused when the reduction inputs have not changed
+        self.reflectivity_cache = ReflectivityCache()
 
     @property
     def data_sets(self):
@@ -106,20 +109,89 @@ class DataManager(object):
     def get_cachesize(self):
         return len(self._cache)
 
+    def get_cache_memory_size(self):
+        """
+        Approximate number of bytes held in memory by the cached data sets
+        """
+        return sum(nexus_data.get_memory_size() for nexus_data in self._cache)
+
     def clear_cache(self):
+        evicted = self._cache
         self._cache = []
+        self._release_workspaces(evicted)
+        self.reflectivity_cache.clear()
+
+    def is_used_in_reduction(self, nexus_data):
+        """
+        Returns True if the data set is in any of the reduction lists or in the direct beam list
+        :param NexusData nexus_data: data set object
+        """
+        for reduction_list in self.peak_reduction_lists.values():
+            if any(nexus_data is item for item in reduction_list):
+                return True
+        return any(nexus_data is item for item in self.direct_beam_list)
 
     def clear_cached_unused_data(self):
         """
         Delete cached files that are not in the reduction list or direct beam list
         """
+        evicted = [file for file in self._cache if not self.is_used_in_reduction(file)]
+        self._cache[:] = [file for file in self._cache if self.is_used_in_reduction(file)]
+        self._release_workspaces(evicted)
 
-        def is_used_in_reduction(f: NexusData):
-            return (self.find_data_in_reduction_list(f) is not None) or (
-                self.find_data_in_direct_beam_list(f) is not None
-            )
-
-        self._cache[:] = [file for file in self._cache if is_used_in_reduction(file)]
+    def _enforce_cache_memory_budget(self, memory_budget):
+        """
+        Evict the least recently used data sets from the cache until it fits in the memory budget.
+        Data sets in use in a reduction list, the direct beam list, or currently displayed are kept.
+        :param float memory_budget: memory budget, in bytes
+        """
+        sizes = [nexus_data.get_memory_size() for nexus_data in self._cache]
+        total_size = sum(sizes)
+        evicted = []
+        for nexus_data, size in zip(list(self._cache), sizes):
+            if total_size <= memory_budget:
+                break
+            if nexus_data is self._nexus_data or self.is_used_in_reduction(nexus_data):
+                continue
+            self._cache.remove(nexus_data)
+            evicted.append(nexus_data)
+            total_size -= size
+        if evicted:
+            logging.info("Evicted %s data sets from the cache: %s bytes in use", len(evicted), total_size)
+            self._release_workspaces(evicted)
+
+    def _release_workspaces(self, evicted):
+        """
+        Delete the Mantid workspaces owned by evicted data sets, unless another
+        data set still refers to them.
+        :param list[NexusData] evicted: data sets removed from the cache
+        """
+        in_use = set()
+        for nexus_data in self._get_data_in_use():
+            in_use.update(nexus_data.get_workspace_names())
+        names = set()
+        for nexus_data in evicted:
+            names.update(nexus_data.get_workspace_names())
+        released = names - in_use
+        # The log statistics are read from the event workspaces when first used
+        for nexus_data in evicted:
+            for cross_section in nexus_data.cross_sections.values():
+                if str(cross_section._event_workspace) in released:
+                    cross_section.read_logs()
+        for name in released:
+            if name in api.mtd:
+                api.DeleteWorkspace(name)
+
+    def _get_data_in_use(self):
+        """
+        Returns all the data sets held by the data manager
+        """
+        data_sets = list(self._cache) + list(self.direct_beam_list)
+        for reduction_list in self.peak_reduction_lists.values():
+            data_sets.extend(reduction_list)
+        if self._nexus_data is not None:
+            data_sets.append(self._nexus_data)
+        return data_sets
 
     def set_active_data_from_reduction_list(self, index):
         """
@@ -413,82 +485,167 @@ class DataManager(object):
         @param progress: aggregator to estimate percent of time allotted to this function
         @returns True if the data is retrieved from the cache of past loading events
         """
-        # Actions taken in this function:
-        # 1. Find if the file has been loaded in the past. Retrieve the cache when force==False
-        # 2. If file not in cache, or if force==True: invoke NexusData.load()
-        # 3. Update attributes _nexus_data, current_directory, and current_file_name
-        # 4. If we're overwriting cached data that was allocated in the reduction_list and direct_beam_list,
-        #    then assign the new data to the proper indexes in lists reduction_list and direct_beam_list
-        # 5. Compute reflectivity if data is loaded from file
+        nexus_data, is_from_cache = self.prepare_data(
+            file_path, configuration, force=force, update_parameters=update_parameters, progress=progress
+        )
+        self.set_loaded_data(nexus_data, is_from_cache, configuration)
+        if progress is not None:
+            progress(100)
+        return is_from_cache
 
-        nexus_data = None  # type: NexusData
-        is_from_cache = False  # if True, the file has been loaded before
-        reduction_list_id = None
-        direct_beam_list_id = None
-        file_path = FilePath(file_path, sort=True).path  # force sorting by increasing run number
+    def _find_in_cache(self, file_path):
+        """
+        Return the cached data set for a file path, or None
+        :param str file_path: sorted file path
+        """
+        for nexus_data in self._cache:
+            if nexus_data.file_path == file_path:
+                return nexus_data
+        return None
 
+    def get_cached_data(self, file_path):
+        """
+        Returns the cached data for one or more files, or None if they are not in the cache
+        :param str file_path: absolute path to one or more files, joined with the merge symbol '+'
+        """
+        return self._find_in_cache(FilePath(file_path, sort=True).path)
+
+    def is_in_cache(self, file_path):
+        """
+        Returns True if the data for one or more files is in the cache
+        :param str file_path: absolute path to one or more files, joined with the merge symbol '+'
+        """
+        return self.get_cached_data(file_path) is not None
+
+    def add_prefetched_data(self, nexus_data, configuration):
+        """
+        Add data loaded ahead of time to the cache. It is added as the least recently used
+        data set, so that it is evicted first and never displaces data the user has opened.
+        :param NexusData nexus_data: data returned by prepare_data()
+        :param Configuration configuration: configuration used to load the data
+        """
+        if self._find_in_cache(nexus_data.file_path) is not None:
+            return
+        self._cache.insert(0, nexus_data)
+        self._enforce_cache_memory_budget(configuration.cache_memory_budget * 1024**3)
+
+    def prepare_data(self, file_path, configuration, force=False, update_parameters=True, progress=None):
+        # type: (str, Configuration, Optional[bool], Optional[bool], Optional[ProgressReporter]) -> tuple
+        r"""
+        @brief Load one or more Nexus data files and compute their reflectivity, without changing which
+        data is active, the cache, or the reduction lists. The result is applied with set_loaded_data().
+        @param file_path: absolute path to one or more files. If more than one, files are concatenated with the
+        merge symbol '+'.
+        @param configuration: configuration to use to load the data
+        @param force: it True, data in the cache will be ignored and the data will be read from file.
+        @param update_parameters: if True, we will find peak ranges
+        @param progress: aggregator to estimate percent of time allotted to this function
+        @returns the loaded NexusData, and True if the data is retrieved from the cache of past loading events
+        """
+        # Actions taken in this function:
+        # 1. Find if the file has been loaded in the past. Retrieve the cache when force==False
+        # 2. If file not in cache, or if force==True: load the files and compute their reflectivity
         if progress is not None:
             progress(10, "Loading data...")
 
         # Check whether the file has already been loaded (in cache)
-        for i in range(len(self._cache)):
-            if self._cache[i].file_path == file_path:
-                if force:
-                    # Check whether the data is in the reduction list before removing it
-                    reduction_list_id = self.find_data_in_reduction_list(self._cache[i])
-                    direct_beam_list_id = self.find_data_in_direct_beam_list(self._cache[i])
-                    self._cache.pop(i)
-                else:
-                    nexus_data = self._cache[i]
-                    is_from_cache = True
-                break
+        nexus_data = self.get_cached_data(file_path)
+        if nexus_data is not None and not force:
+            return nexus_data, True
+
+        nexus_data = self.read_data(
+            file_path,
+            configuration,
+            list(self.direct_beam_list),
+            ws_suffix=str(self.active_reduction_list_index),
+            update_parameters=update_parameters,
+            progress=progress,
+            cache=self.reflectivity_cache,
+        )
+        return nexus_data, False
 
-        # If we don't have the data, load it
-        if nexus_data is None:
-            nexus_data = NexusData(file_path, configuration)
-            sub_task = progress.create_sub_task(max_value=70) if progress else None
-            nexus_data.load(progress=sub_task, update_parameters=update_parameters)
+    def read_data(
+        self, file_path, configuration, direct_beams, ws_suffix="", update_parameters=True, progress=None, cache=None
+    ):
+        # type: (str, Configuration, list, str, bool, Optional[ProgressReporter], ReflectivityCache) -> NexusData
+        r"""
+        @brief Load one or more Nexus data files and compute their reflectivity. Only the arguments are
+        used: the data manager is neither read nor modified, so that this can be called from a worker thread.
+        @param file_path: absolute path to one or more files, joined with the merge symbol '+'
+        @param configuration: configuration to use to load the data
+        @param direct_beams: direct beams to choose the normalization from
+        @param ws_suffix: suffix of the reflectivity workspace names
+        @param update_parameters: if True, we will find peak ranges
+        @param progress: aggregator to estimate percent of time allotted to this function
+        @param cache: reflectivity cache to store the result in, if any
+        @returns the loaded NexusData
+        """
+        file_path = FilePath(file_path, sort=True).path  # force sorting by increasing run number
+        nexus_data = NexusData(file_path, configuration)
+        sub_task = progress.create_sub_task(max_value=70) if progress else None
+        nexus_data.load(progress=sub_task, update_parameters=update_parameters)
 
         if progress is not None:
             progress(80, "Calculating...")
 
-        if nexus_data is not None:
-            self._nexus_data = nexus_data
-            # Example: '/SNS/REF_M/IPTS-25531/nexus/REF_M_38198.nxs.h5+/SNS/REF_M/IPTS-25531/nexus/REF_M_38199.nxs.h5'
-            # will be split into directory='/SNS/REF_M/IPTS-25531/nexus' and
-            # file_name='REF_M_38198.nxs.h5+REF_M_38199.nxs.h5'
-            directory, file_name = FilePath(file_path).split()
-            self.current_directory = directory
-            self.current_file_name = file_name
-            self.set_channel(0)
+        # Find suitable direct beam
+        if configuration.match_direct_beam:
+            self.find_best_direct_beam(nexus_data, direct_beams=direct_beams)
 
-            # If we didn't get this data set from our cache, add it and compute its reflectivity.
-            if not is_from_cache:
-                # Find suitable direct beam
-                if configuration.match_direct_beam:
-                    self.find_best_direct_beam()
-
-                # Replace reduction and normalization entries as needed
-                if reduction_list_id is not None:
-                    self.reduction_list[reduction_list_id] = nexus_data
-                if direct_beam_list_id is not None:
-                    self.direct_beam_list[direct_beam_list_id] = nexus_data
-
-                # Compute reflectivity
-                if not nexus_data.is_direct_beam():
-                    try:
-                        self.calculate_reflectivity()
-                    except Exception as e:
-                        logging.error("Reflectivity calculation failed for %s exception %s", file_name, e)
-
-                # if cached reduced data exceeds maximum cache size, remove the oldest reduced data
-                while len(self._cache) >= self.MAX_CACHE:
-                    self._cache.pop(0)
-                self._cache.append(nexus_data)
+        # Compute reflectivity
+        if not nexus_data.is_direct_beam():
+            try:
+                nexus_data.calculate_reflectivity(
+                    direct_beam=self._find_direct_beam(nexus_data, direct_beams=direct_beams),
+                    ws_suffix=ws_suffix,
+                    cache=cache,
+                )
+            except Exception as e:
+                logging.error("Reflectivity calculation failed for %s exception %s", file_path, e)
+        return nexus_data
 
-        if progress is not None:
-            progress(100)
-        return is_from_cache
+    def set_loaded_data(self, nexus_data, is_from_cache, configuration):
+        # type: (NexusData, bool, Configuration) -> None
+        r"""
+        @brief Make data returned by prepare_data() the active data and add it to the cache
+        @param nexus_data: loaded data
+        @param is_from_cache: True if the data was retrieved from the cache
+        @param configuration: configuration used to load the data
+        """
+        # Actions taken in this function:
+        # 1. Update attributes _nexus_data, current_directory, and current_file_name
+        # 2. If we're overwriting cached data that was allocated in the reduction_list and direct_beam_list,
+        #    then assign the new data to the proper indexes in lists reduction_list and direct_beam_list
+        # 3. Move the data to the most recently used end of the cache
+        reduction_list_id = None
+        direct_beam_list_id = None
+        cached_data = self._find_in_cache(nexus_data.file_path)
+        if cached_data is not None:
+            if cached_data is not nexus_data:
+                # Check whether the data is in the reduction list before removing it
+                reduction_list_id = self.find_data_in_reduction_list(cached_data)
+                direct_beam_list_id = self.find_data_in_direct_beam_list(cached_data)
+            self._cache.remove(cached_data)
+
+        self._nexus_data = nexus_data
+        # Example: '/SNS/REF_M/IPTS-25531/nexus/REF_M_38198.nxs.h5+/SNS/REF_M/IPTS-25531/nexus/REF_M_38199.nxs.h5'
+        # will be split into directory='/SNS/REF_M/IPTS-25531/nexus' and
+        # file_name='REF_M_38198.nxs.h5+REF_M_38199.nxs.h5'
+        directory, file_name = FilePath(nexus_data.file_path).split()
+        self.current_directory = directory
+        self.current_file_name = file_name
+        self.set_channel(0)
+
+        # Replace reduction and normalization entries as needed
+        if reduction_list_id is not None:
+            self.reduction_list[reduction_list_id] = nexus_data
+        if direct_beam_list_id is not None:
+            self.direct_beam_list[direct_beam_list_id] = nexus_data
+
+        self._cache.append(nexus_data)
+        if not is_from_cache:
+            # if cached reduced data exceeds the memory budget, remove the least recently used data
+            self._enforce_cache_memory_budget(configuration.cache_memory_budget * 1024**3)
 
     def update_configuration(self, configuration, active_only=False, nexus_data=None):
         """
@@ -507,14 +664,17 @@ class DataManager(object):
         """
         return self._find_direct_beam(self._nexus_data)
 
-    def _find_direct_beam(self, nexus_data):
+    def _find_direct_beam(self, nexus_data, direct_beams=None):
         """
         Determine whether we have a direct beam data set available
         for a given reflectivity data set.
         The object returned is a CrossSectionData object.
 
         :param NexusData or CrossSectionData nexus_data: data set to find a direct beam for
+        :param list direct_beams: direct beams to search, instead of the direct beam list
         """
+        if direct_beams is None:
+            direct_beams = self.direct_beam_list
         direct_beam = None
         # Find the CrossSectionData object to work with
         if isinstance(nexus_data, NexusData):
@@ -529,7 +689,7 @@ class DataManager(object):
             data_xs = nexus_data
 
         if data_xs.configuration is not None and data_xs.configuration.normalization is not None:
-            for item in self.direct_beam_list:
+            for item in direct_beams:
                 # convert _run_number to int if it can be
                 try:
                     _run_number = int(data_xs.configuration.normalization)
@@ -641,6 +801,7 @@ class DataManager(object):
         """
         Merge all the off-specular reflectivity data and rebin.
         """
+        low_memory_merge = self.active_channel.configuration.low_memory_merge
         return gisans.rebin_extract(
             self.reduction_list,
             pol_state=pol_state,
@@ -649,6 +810,7 @@ class DataManager(object):
             qy_npts=qy_npts,
             qz_npts=qz_npts,
             use_pf=use_pf,
+            dtype=np.float32 if low_memory_merge else float,
         )
 
     # TODO 67 FInd out whether it can work with merged data
@@ -669,25 +831,51 @@ class DataManager(object):
             self.active_channel.reflectivity(direct_beam=direct_beam, configuration=configuration)
         else:
             nexus_data.calculate_reflectivity(
-                direct_beam=direct_beam, configuration=configuration, ws_suffix=str(self.active_reduction_list_index)
+                direct_beam=direct_beam,
+                configuration=configuration,
+                ws_suffix=str(self.active_reduction_list_index),
+                cache=self.reflectivity_cache,
             )
 
-    def find_best_direct_beam(self):
+    def preview_reflectivity(self, configuration):
+        """
+        Compute a fast preview of the reflectivity of the active channel, from its binned data,
+        for the given reduction parameters. The data sets are not modified.
+        Returns q, r and dr arrays, or None if there is no active data.
+        :param Configuration configuration: reduction parameters
+        """
+        if self.active_channel is None or self.active_channel.tof_edges is None:
+            return None
+        direct_beam = self._find_direct_beam(self.active_channel)
+        return reflectivity_preview.preview_reflectivity(
+            self.active_channel, direct_beam=direct_beam, configuration=configuration
+        )
+
+    def find_best_direct_beam(self, nexus_data=None, direct_beams=None):
         """
         Find the best direct beam in the direct beam list for the active data
         Returns a run number.
         Returns True if we have updated the data with a new normalization run.
+        :param NexusData nexus_data: data to find a direct beam for, instead of the active data
+        :param list direct_beams: direct beams to search, instead of the direct beam list
         """
+        if direct_beams is None:
+            direct_beams = self.direct_beam_list
+        if nexus_data is None:
+            nexus_data = self._nexus_data
+            active_channel = self.active_channel
+        else:
+            active_channel = list(nexus_data.cross_sections.values())[0]
         # TODO 65+ Can it work with merged data?
         # Select the first run number if the active channel cross section is derived from more than one run
-        active_channel_number = RunNumbers(self.active_channel.number).numbers[0]
+        active_channel_number = RunNumbers(active_channel.number).numbers[0]
         closest = None
-        for item in self.direct_beam_list:
+        for item in direct_beams:
             item_number = int(item.number)
             xs_keys = list(item.cross_sections.keys())
             if len(xs_keys) > 0:
                 channel = item.cross_sections[list(item.cross_sections.keys())[0]]
-                if self.active_channel.configuration.instrument.direct_beam_match(self.active_channel, channel):
+                if active_channel.configuration.instrument.direct_beam_match(active_channel, channel):
                     if closest is None:
                         closest = item_number
                     elif abs(item_number - active_channel_number) < abs(closest - active_channel_number):
@@ -695,19 +883,19 @@ class DataManager(object):
 
         if closest is None:
             # If we didn't find a direct beam, try with just the wavelength
-            for item in self.direct_beam_list:
+            for item in direct_beams:
                 xs_keys = list(item.cross_sections.keys())
                 if len(xs_keys) > 0:
                     channel = item.cross_sections[list(item.cross_sections.keys())[0]]
-                    if self.active_channel.configuration.instrument.direct_beam_match(
-                        self.active_channel, channel, skip_slits=True
+                    if active_channel.configuration.instrument.direct_beam_match(
+                        active_channel, channel, skip_slits=True
                     ):
                         if closest is None:
                             closest = item_number
                         elif abs(item_number - active_channel_number) < abs(closest - active_channel_number):
                             closest = item_number
         if closest is not None:
-            return self._nexus_data.set_parameter("normalization", closest)
+            return nexus_data.set_parameter("normalization", closest)
         return False
 
     def get_trim_values(self):
@@ -874,6 +1062,25 @@ class DataManager(object):
         self.load_direct_beam_and_data_files(db_files, data_files, additional_peaks, configuration, progress, t_0)
         logging.info("DONE: %s sec", time.time() - t_0)
 
+    def save_session(self, file_path):
+        """
+        Save the reduction lists, the direct beam list and the data they hold to a session file
+        :param str file_path: session file to write
+        """
+        t_0 = time.time()
+        session.save_session(self, file_path)
+        logging.info("Session saved to %s: %s sec", file_path, time.time() - t_0)
+
+    def load_session(self, file_path):
+        """
+        Restore a session saved with save_session(), without reading the event files.
+        The events are loaded when a reduction needs them.
+        :param str file_path: session file to read
+        """
+        t_0 = time.time()
+        session.load_session(self, file_path)
+        logging.info("Session restored from %s: %s sec", file_path, time.time() - t_0)
+
     def load_direct_beam_and_data_files(
         self, db_files, data_files, additional_peaks=None, configuration=None, progress=None, force=False, t_0=None
     ):
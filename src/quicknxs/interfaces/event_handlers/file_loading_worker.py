@@ -0,0 +1,99 @@
+"""
+Worker thread used to load data files without blocking the user interface.
+"""
+
+import copy
+import logging
+import threading
+import traceback
+
+from PyQt5 import QtCore
+
+from quicknxs.interfaces.event_handlers.progress_reporter import ProgressReporter, TaskCancelledError
+
+# Held by the worker loading files. Workers run their Mantid algorithms one at a time, so that a
+# cancelled worker that has not stopped yet, or a prefetch worker, never writes to the workspaces
+# of the file being loaded.
+_LOADING_LOCK = threading.Lock()
+
+
+class FileLoadingWorker(QtCore.QThread):
+    """
+    Load one or more data files, find their reduction parameters, bin their events for
+    plotting and compute their reflectivity in a worker thread.
+
+    The worker only uses the state of the data manager copied when it is created: the cached
+    data for the file, the direct beams and the suffix of the reflectivity workspaces. It does not
+    modify the data manager or its reflectivity cache, since the main thread may be changing them.
+    The loaded data is passed along with the ``loaded`` signal, and should be applied on the main
+    thread with ``DataManager.set_loaded_data``.
+
+    Only one worker loads files at a time: a worker waits for the previous ones to stop,
+    and does nothing if it is cancelled while waiting.
+    """
+
+    progress = QtCore.pyqtSignal(int, str)
+    """Signal emitted when progress is made, with the progress value and a message."""
+
+    loaded = QtCore.pyqtSignal(object, bool)
+    """Signal emitted when loading is complete, with the loaded data and whether it came from the cache."""
+
+    failed = QtCore.pyqtSignal(str, str)
+    """Signal emitted when loading fails, with the error message and the traceback."""
+
+    def __init__(self, data_manager, file_path, configuration, force=False, parent=None):
+        """
+        :param DataManager data_manager: data manager holding the cache and the direct beams
+        :param str file_path: absolute path to one or more files, joined with the merge symbol '+'
+        :param Configuration configuration: configuration to use to load the data
+        :param bool force: if True, the file will be reloaded even if it was loaded previously
+        :param QObject parent: parent object
+        """
+        super().__init__(parent)
+        self.data_manager = data_manager
+        self.file_path = file_path
+        self.configuration = copy.deepcopy(configuration)
+        self.force = force
+        # State of the data manager used by the worker, copied on the main thread
+        self.cached_data = None if force else data_manager.get_cached_data(file_path)
+        self.direct_beams = list(data_manager.direct_beam_list)
+        self.ws_suffix = str(data_manager.active_reduction_list_index)
+        self.progress_reporter = ProgressReporter(call_back=self._report_progress)
+
+    def _report_progress(self, message):
+        self.progress.emit(self.progress_reporter.get_value(), message)
+
+    def cancel(self):
+        """
+        Cancel loading. The worker stops the next time it reports progress.
+        """
+        self.progress_reporter.cancel()
+
+    def is_cancelled(self):
+        return self.progress_reporter.is_cancelled()
+
+    def run(self):
+        if self.cached_data is not None:
+            self.loaded.emit(self.cached_data, True)
+            return
+        try:
+            with _LOADING_LOCK:
+                self.progress_reporter(10, "Loading data...")
+                nexus_data = self.data_manager.read_data(
+                    self.file_path,
+                    self.configuration,
+                    self.direct_beams,
+                    ws_suffix=self.ws_suffix,
+                    progress=self.progress_reporter,
+                )
+                self.progress_reporter(90, "Preparing plots...")
+                for cross_section in nexus_data.cross_sections.values():
+                    cross_section.prepare_plot_data()
+                self.progress_reporter(100)
+        except TaskCancelledError:
+            logging.info("Loading cancelled: %s", self.file_path)
+            return
+        except Exception as err:
+            self.failed.emit(str(err), traceback.format_exc())
+            return
+        self.loaded.emit(nexus_data, False)
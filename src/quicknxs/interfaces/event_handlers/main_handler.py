@@ -12,6 +12,7 @@ import math
 import os
 import time
 import traceback
+from functools import partial
 
 import numpy as np
 from mantid.simpleapi import DeleteWorkspace, LoadEventNexus
@@ -26,7 +27,10 @@ from quicknxs.interfaces.configuration import Configuration
 from quicknxs.interfaces.data_handling.data_manipulation import NormalizeToUnityQCutoffError
 from quicknxs.interfaces.data_handling.data_set import CrossSectionData, NexusData
 from quicknxs.interfaces.data_handling.filepath import FilePath, RunNumbers
+from quicknxs.interfaces.data_handling.run_index import get_run_index
+from quicknxs.interfaces.event_handlers.file_loading_worker import FileLoadingWorker
 from quicknxs.interfaces.event_handlers.progress_reporter import ProgressReporter
+from quicknxs.interfaces.event_handlers.run_prefetcher import RunPrefetcher
 from quicknxs.interfaces.event_handlers.status_bar_handler import StatusBarHandler
 from quicknxs.interfaces.event_handlers.widgets import AcceptRejectDialog
 
@@ -40,6 +44,8 @@ class MainHandler(object):
     DIRECT_BEAM_TAB_INDEX = 0
     # Index of the first (and always visible) data tab in the reduction table tab widget
     MAIN_DATA_TAB_INDEX = 1
+    # Load files in a worker thread so that the UI remains responsive
+    BACKGROUND_LOADING = True
 
     def __init__(self, main_window):
         self.ui = main_window.ui
@@ -61,6 +67,17 @@ class MainHandler(object):
         button.setFlat(False)
         button.setMaximumSize(150, 20)
 
+        # Button to cancel a file being loaded in the background
+        self._loading_worker = None
+        self.cancel_loading_button = QtWidgets.QPushButton("Cancel Loading")
+        self.ui.statusbar.addPermanentWidget(self.cancel_loading_button)
+        self.cancel_loading_button.pressed.connect(self.cancel_loading)
+        self.cancel_loading_button.setMaximumSize(150, 20)
+        self.cancel_loading_button.setEnabled(False)
+
+        # Loads the runs next to the active run ahead of time
+        self._prefetcher = RunPrefetcher(self._data_manager, parent=self.main_window)
+
         # Create progress bar in statusbar
         self.progress_bar = QtWidgets.QProgressBar(self.ui.statusbar)
         self.progress_bar.setMinimumSize(20, 14)
@@ -144,7 +161,12 @@ class MainHandler(object):
                 )
                 return
 
+        if self.BACKGROUND_LOADING and not silent:
+            self._open_file_in_background(file_path, force=force)
+            return
+
         t_0 = time.time()
+        self.stop_background_loading()
         self.main_window.auto_change_active = True
         try:
             self.report_message("Loading file(s) %s" % file_path)
@@ -166,6 +188,106 @@ class MainHandler(object):
         self.main_window.auto_change_active = False
         logging.info("DONE: %s sec", time.time() - t_0)
 
+    def _open_file_in_background(self, file_path, force=False):
+        r"""
+        @brief Load one or more data files in a worker thread. Loading a file cancels any file
+        currently being loaded. The data manager and the UI are updated once loading is complete.
+        @param file_path: absolute path to data files, joined with the plus symbol '+'
+        @param force: if true, the file will be reloaded even if it was loaded previously
+        """
+        # The file requested by the user takes priority over prefetched runs. The new worker
+        # starts loading once the cancelled workers have stopped, without blocking the UI.
+        self.cancel_loading()
+        self._prefetcher.cancel()
+        self.report_message("Loading file(s) %s" % file_path)
+        worker = FileLoadingWorker(
+            self._data_manager, file_path, self.get_configuration(), force=force, parent=self.main_window
+        )
+        worker.progress.connect(partial(self._background_loading_progress, worker))
+        worker.loaded.connect(partial(self._background_file_loaded, worker))
+        worker.failed.connect(partial(self._background_loading_failed, worker))
+        worker.finished.connect(worker.deleteLater)
+        self._loading_worker = worker
+        self.cancel_loading_button.setEnabled(True)
+        worker.start()
+
+    def is_loading(self):
+        """
+        Returns True if a file is being loaded in the background
+        """
+        return self._loading_worker is not None
+
+    def cancel_loading(self, wait=False):
+        """
+        Cancel the file being loaded in the background, if any
+        :param bool wait: if True, wait for the worker thread to stop
+        """
+        worker = self._loading_worker
+        if worker is None:
+            return
+        self._loading_worker = None
+        self.cancel_loading_button.setEnabled(False)
+        worker.cancel()
+        if wait:
+            worker.wait()
+        self.progress_bar.setValue(0)
+        self.report_message("Cancelled loading of file(s) %s" % worker.file_path)
+
+    def stop_background_loading(self):
+        """
+        Cancel the files being loaded in the background and wait for their worker threads to stop,
+        before loading files on the main thread
+        """
+        self.cancel_loading(wait=True)
+        self._prefetcher.cancel(wait=True)
+
+    def cancel_prefetch(self, wait=False):
+        """
+        Cancel the loading of the runs next to the active run, if any
+        :param bool wait: if True, wait for the worker thread to stop
+        """
+        self._prefetcher.cancel(wait=wait)
+
+    def _background_loading_progress(self, worker, value, message):
+        """
+        Report progress of the file being loaded in the background
+        """
+        if worker is not self._loading_worker:
+            return
+        self.progress_bar.setValue(value)
+        if message:
+            self.status_bar_handler.show_message(message)
+
+    def _background_file_loaded(self, worker, nexus_data, is_from_cache):
+        """
+        Apply data loaded in the background and update the UI
+        """
+        if worker is not self._loading_worker:
+            return
+        self._loading_worker = None
+        self.cancel_loading_button.setEnabled(False)
+
+        self.main_window.auto_change_active = True
+        self._data_manager.set_loaded_data(nexus_data, is_from_cache, worker.configuration)
+        self.report_message("Loaded file(s) %s" % self._data_manager.current_file_name)
+        self.file_loaded()
+        self.main_window.auto_change_active = False
+
+    def _background_loading_failed(self, worker, message, detailed_message):
+        """
+        Report an error while loading data in the background
+        """
+        if worker is not self._loading_worker:
+            return
+        self._loading_worker = None
+        self.cancel_loading_button.setEnabled(False)
+        self.report_message(
+            f"Error loading file(s) {worker.file_path} due to {message}",
+            detailed_message=detailed_message,
+            pop_up=False,
+            is_error=True,
+        )
+
     def file_loaded(self):
         """
         Update UI after a file is loaded
@@ -190,6 +312,9 @@ class MainHandler(object):
 
         self.cache_indicator.setText("Files loaded: %s" % (self._data_manager.get_cachesize()))
 
+        # Load the neighbouring runs while the user looks at this one
+        self._prefetcher.prefetch(self.get_configuration())
+
     def active_channel_changed(self):
         """
         Update UI metadata and plots after the active channel is changed
@@ -240,24 +365,17 @@ class MainHandler(object):
 
         # simple data structure to collect the log values from all files
         log_values = {name: list() for name in log_names}
+        run_index = get_run_index(Configuration())
         for file_path in file_paths:
-            for entry in ["", "-Off_Off", "-On_Off", "-Off_On", "-On_On"]:  # for new and old nexus files
-                workspace = None
-                try:
-                    workspace = LoadEventNexus(Filename=file_path, NXentryName="entry" + entry, MetaDataOnly=True)
-                    break
-                except RuntimeError:
-                    continue
-            if workspace is None:
-                return f"Could not load {file_path}"
-            metadata = workspace.getRun()
-            for log_name in log_names:
+            # Logs are read from the run index, or loaded with Mantid if the index cannot provide them
+            values = run_index.get_log_values(file_path, log_names)
+            if values is None or len(values) < len(log_names):
                 try:
-                    log_property = metadata.getProperty(log_name)
+                    values = self._load_log_values(file_path, log_names)
                 except RuntimeError as e:
-                    return e.message
-                log_values[log_name].append(log_property.getStatistics().mean)
-            DeleteWorkspace(workspace)
+                    return str(e)
+            for log_name in log_names:
+                log_values[log_name].append(values[log_name])
 
         # Find the minimum and maximum values for each log, and compare to the tolerance
         message = ""
@@ -269,6 +387,29 @@ class MainHandler(object):
 
         return message  # empty string if no failures
 
+    @staticmethod
+    def _load_log_values(file_path, log_names):
+        r"""
+        # type: str, List[str] -> dict
+        @brief Mean value of logs, loading the meta-data of a Nexus file with Mantid
+        @param file_path : Nexus file (full path)
+        @param log_names : names of the logs to read
+        """
+        workspace = None
+        for entry in ["", "-Off_Off", "-On_Off", "-Off_On", "-On_On"]:  # for new and old nexus files
+            try:
+                workspace = LoadEventNexus(Filename=file_path, NXentryName="entry" + entry, MetaDataOnly=True)
+                break
+            except RuntimeError:
+                continue
+        if workspace is None:
+            raise RuntimeError(f"Could not load {file_path}")
+        try:
+            metadata = workspace.getRun()
+            return {log_name: metadata.getProperty(log_name).getStatistics().mean for log_name in log_names}
+        finally:
+            DeleteWorkspace(workspace)
+
     def update_tables(self):
         """
         Update a data set that may be in the reduction table or the
@@ -437,6 +578,7 @@ class MainHandler(object):
         def _update_current_directory(new_dir):
             r"""Update the directory path in the main window and the path watcher"""
             self.main_window.settings.setValue("current_directory", new_dir)
+            self._prefetcher.cancel()
             self._path_watcher.removePath(self._data_manager.current_directory)
             self._data_manager.current_directory = new_dir
             self._path_watcher.addPath(self._data_manager.current_directory)
@@ -450,6 +592,7 @@ class MainHandler(object):
         # Use case 1: the contents of the current directory may have changed with the addition of new
         # event files. This could happen if the experiment is running, producing new event files.
         if file_path is None:
+            get_run_index(Configuration()).refresh(self._data_manager.current_directory)
             new_list = _updated_current_list()
         # Use case 2: a composite from using Open Sum
         elif file_path.is_composite:
@@ -494,16 +637,8 @@ class MainHandler(object):
         load files until the incident angle is no longer increasing.
         """
         self.main_window.auto_change_active = True
-        # Update the list of files
-        event_file_list = glob.glob(os.path.join(self._data_manager.current_directory, "*event.nxs"))
-        h5_file_list = glob.glob(os.path.join(self._data_manager.current_directory, "*.nxs.h5"))
-        event_file_list.extend(h5_file_list)
-        event_file_list.sort()
-        event_file_list = [os.path.basename(name) for name in event_file_list]
-
-        current_file_found = False
-        n_count = 0
-        logging.error("Current file: %s", self._data_manager.current_file_name)
+        current_file_name = self._data_manager.current_file_name
+        logging.error("Current file: %s", current_file_name)
 
         q_current = self._data_manager.extract_meta_data().mid_q
 
@@ -517,31 +652,32 @@ class MainHandler(object):
             if not self.add_reflectivity():
                 return
 
-        for f in event_file_list:
-            file_path = str(os.path.join(self._data_manager.current_directory, f))
-            if current_file_found and n_count < 10:
-                n_count += 1
-                meta_data = self._data_manager.extract_meta_data(file_path)
-
-                if q_current <= meta_data.mid_q and is_direct_beam == meta_data.is_direct_beam:
-                    q_current = meta_data.mid_q
-                    self.open_file(file_path, silent=True)
-                    d = self._data_manager.active_channel
-                    # If we find data of another type, stop here
-                    if not is_direct_beam == self._data_manager.active_channel.is_direct_beam:
-                        break
-                    self.main_window.auto_change_active = True
-                    self.populate_from_configuration(d.configuration)
-                    if self._data_manager.active_channel.is_direct_beam:
-                        self.add_direct_beam()
-                    else:
-                        self.add_reflectivity()
-
-            if f == self._data_manager.current_file_name:
-                current_file_found = True
+        # Among the next 10 runs, select those of the same type with increasing q-values
+        file_paths = []
+        if FilePath.merge_symbol not in current_file_name:
+            run_index = get_run_index(self._data_manager.active_channel.configuration)
+            file_paths = run_index.increasing_q_runs(
+                os.path.join(self._data_manager.current_directory, current_file_name),
+                q_current,
+                is_direct_beam,
+                max_runs=10,
+            )
+
+        for file_path in file_paths:
+            self.open_file(file_path, silent=True)
+            d = self._data_manager.active_channel
+            # If we find data of another type, stop here
+            if not is_direct_beam == self._data_manager.active_channel.is_direct_beam:
+                break
+            self.main_window.auto_change_active = True
+            self.populate_from_configuration(d.configuration)
+            if self._data_manager.active_channel.is_direct_beam:
+                self.add_direct_beam()
+            else:
+                self.add_reflectivity()
 
         # At the very end, update the UI and plot reflectivity
-        if n_count > 0:
+        if len(file_paths) > 0:
             self.main_window.auto_change_active = True
             self.file_loaded()
         self.main_window.auto_change_active = False
@@ -551,7 +687,7 @@ class MainHandler(object):
         Open a reduced file and all the data files needed to reproduce it.
         """
         # Open file dialog
-        filter_ = "QuickNXS files (*.dat);;All (*.*)"
+        filter_ = "QuickNXS files (*.dat *.h5);;All (*.*)"
         output_dir = self.main_window.settings.value("output_directory", os.path.expanduser("~"))
         file_path, _ = QtWidgets.QFileDialog.getOpenFileName(
             self.main_window, "Open reduced file...", directory=output_dir, filter=filter_
@@ -565,44 +701,105 @@ class MainHandler(object):
             self.clear_reflectivity()
             configuration = self.get_configuration()
             prog = self.new_progress_reporter()
+            self.stop_background_loading()
             self._data_manager.load_data_from_reduced_file(file_path, configuration=configuration, progress=prog)
 
             # Update output directory
             file_dir, _ = os.path.split(str(file_path))
             self.main_window.settings.setValue("output_directory", file_dir)
 
-            self.main_window.auto_change_active = True
+            self._show_loaded_reduction(t_0)
 
-            # Update UI direct beam table
-            self.ui.normalizeTable.setRowCount(len(self._data_manager.direct_beam_list))
-            for idx, _ in enumerate(self._data_manager.direct_beam_list):
-                self._data_manager.set_active_data_from_direct_beam_list(idx)
-                self.update_direct_beam_table(idx, self._data_manager.active_channel)
-            # Update UI data table(s) with the loaded data
-            for ipeak, peak_data in self._data_manager.peak_reduction_lists.items():
-                self._data_manager.set_active_reduction_list_index(ipeak)
-                self.main_window.add_data_tab_by_index(ipeak)
-                table_widget = self.get_reduction_table_by_index(ipeak)
-                table_widget.setRowCount(len(self._data_manager.reduction_list))
-                for idx, _ in enumerate(self._data_manager.reduction_list):
-                    self._data_manager.set_active_data_from_reduction_list(idx)
-                    self.update_reduction_table(table_widget, idx, self._data_manager.active_channel)
-
-            # Set the first reduction table and its first run as the active (plotted) data
-            self._data_manager.set_active_reduction_list_index(self._data_manager.MAIN_REDUCTION_LIST_INDEX)
-            self._data_manager.set_active_data_from_reduction_list(0)
-
-            direct_beam_ids = [str(r.number) for r in self._data_manager.direct_beam_list]
-            self.ui.normalization_list_label.setText(", ".join(direct_beam_ids))
+    def _show_loaded_reduction(self, t_0):
+        """
+        Fill the direct beam and reduction tables with the lists of the data manager, after
+        loading a reduced file or a session, and show the first run of the main reduction list
+        :param float t_0: time the loading started
+        """
+        self.main_window.auto_change_active = True
 
-            self.file_loaded()
+        # Update UI direct beam table
+        self.ui.normalizeTable.setRowCount(len(self._data_manager.direct_beam_list))
+        for idx, _ in enumerate(self._data_manager.direct_beam_list):
+            self._data_manager.set_active_data_from_direct_beam_list(idx)
+            self.update_direct_beam_table(idx, self._data_manager.active_channel)
+        # Update UI data table(s) with the loaded data
+        for ipeak, peak_data in self._data_manager.peak_reduction_lists.items():
+            self._data_manager.set_active_reduction_list_index(ipeak)
+            self.main_window.add_data_tab_by_index(ipeak)
+            table_widget = self.get_reduction_table_by_index(ipeak)
+            table_widget.setRowCount(len(self._data_manager.reduction_list))
+            for idx, _ in enumerate(self._data_manager.reduction_list):
+                self._data_manager.set_active_data_from_reduction_list(idx)
+                self.update_reduction_table(table_widget, idx, self._data_manager.active_channel)
 
-            if self._data_manager.active_channel is not None:
-                self.populate_from_configuration(self._data_manager.active_channel.configuration)
-                self.update_file_list(self._data_manager.current_file)
-            self.main_window.auto_change_active = False
+        # Set the first reduction table and its first run as the active (plotted) data
+        self._data_manager.set_active_reduction_list_index(self._data_manager.MAIN_REDUCTION_LIST_INDEX)
+        self._data_manager.set_active_data_from_reduction_list(0)
+
+        direct_beam_ids = [str(r.number) for r in self._data_manager.direct_beam_list]
+        self.ui.normalization_list_label.setText(", ".join(direct_beam_ids))
+
+        self.file_loaded()
+
+        if self._data_manager.active_channel is not None:
+            self.populate_from_configuration(self._data_manager.active_channel.configuration)
+            self.update_file_list(self._data_manager.current_file)
+        self.main_window.auto_change_active = False
 
-            logging.info("UI updated: %s", time.time() - t_0)
+        logging.info("UI updated: %s", time.time() - t_0)
+
+    def save_session_dialog(self):
+        """
+        Save the reduction lists and the data they hold to a session file
+        """
+        filter_ = "QuickNXS sessions (*.session.h5);;All (*.*)"
+        output_dir = self.main_window.settings.value("output_directory", os.path.expanduser("~"))
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self.main_window, "Save session...", directory=output_dir, filter=filter_
+        )
+        if not file_path:
+            return
+        if not file_path.endswith(".h5"):
+            file_path += ".session.h5"
+        try:
+            self._data_manager.save_session(file_path)
+            self.report_message("Session saved to %s" % file_path)
+        except (OSError, RuntimeError) as err:
+            self.report_message(
+                f"Could not save the session:\n{str(err)}",
+                detailed_message=str(traceback.format_exc()),
+                pop_up=True,
+                is_error=True,
+            )
+
+    def open_session_dialog(self):
+        """
+        Restore a session saved with save_session_dialog(), without reloading the data files
+        """
+        filter_ = "QuickNXS sessions (*.session.h5);;All (*.*)"
+        output_dir = self.main_window.settings.value("output_directory", os.path.expanduser("~"))
+        file_path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self.main_window, "Open session...", directory=output_dir, filter=filter_
+        )
+        if not file_path:
+            return
+        t_0 = time.time()
+        self.main_window.reset_data_tabs()
+        self.clear_direct_beams()
+        self.clear_reflectivity()
+        self.stop_background_loading()
+        try:
+            self._data_manager.load_session(file_path)
+        except (OSError, KeyError, RuntimeError) as err:
+            self.report_message(
+                f"Could not open the session:\n{str(err)}",
+                detailed_message=str(traceback.format_exc()),
+                pop_up=True,
+                is_error=True,
+            )
+            return
+        self._show_loaded_reduction(t_0)
 
     def initialize_additional_reduction_table(self, tab_index: int):
         """
@@ -1576,6 +1773,7 @@ class MainHandler(object):
         active_data_tab = self._data_manager.active_reduction_list_index
 
         # Reload files
+        self.stop_background_loading()
         self._data_manager.clear_cached_unused_data()
         configuration = self.get_configuration()
         prog = ProgressReporter(progress_bar=self.progress_bar, status_bar=self.status_bar_handler)
@@ -6,6 +6,9 @@ Event handlers for the main application window.
 Most of those come straight from QuickNXS.
 """
 
+import copy
+import logging
+import math
 import time
 
 from PyQt5 import QtWidgets
@@ -35,6 +38,8 @@ class PlotHandler(object):
     """
 
     _picked_line = None
+    # Mouse button held down on one of the plots used to select the region of interest
+    _drag_button = None
     control_down = False
     last_event = None
     refl = None
@@ -100,6 +105,10 @@ class PlotHandler(object):
         self.ui.xtof_overview.canvas.mpl_connect("button_press_event", self.plot_pick_xtof)
         # self.ui.xtof_overview.canvas.mpl_connect('motion_notify_event', self.plot_pick_xtof)
         self.ui.xtof_overview.canvas.mpl_connect("button_release_event", self.plot_release)
+        # Dragging the region of interest previews the reflectivity
+        for plot in [self.ui.x_project, self.ui.y_project, self.ui.xy_overview, self.ui.xtof_overview]:
+            plot.canvas.mpl_connect("button_press_event", self.start_drag)
+            plot.canvas.mpl_connect("motion_notify_event", self.plot_drag)
 
         # Status bar indicator
         self.x_position_indicator = QtWidgets.QLabel(" x=%g" % 0.0)
@@ -165,14 +174,83 @@ class PlotHandler(object):
         :param event: event object
         """
         self._picked_line = None
+        self._drag_button = None
         self.main_window.changeRegionValues()
 
+    def start_drag(self, event):
+        """
+        Remember the mouse button pressed on one of the plots used to select the region of interest
+        :param event: event object
+        """
+        self._drag_button = event.button
+
+    def plot_drag(self, event):
+        """
+        The mouse moved over one of the plots used to select the region of interest. If a button
+        is pressed, move the selected range and preview the reflectivity. The range follows every
+        motion event, while the preview is throttled by slow_down_events on all the plots. The
+        reflectivity is computed by Mantid when the button is released.
+        :param event: event object
+        """
+        if self._drag_button is None or event.inaxes is None:
+            return
+        # Motion events don't carry the button that is held down
+        event.button = self._drag_button
+        # The ranges are moved without the throttling of plot_pick_x, as for the other plots
+        pick = {
+            self.ui.x_project.canvas: self._pick_x,
+            self.ui.y_project.canvas: self.plot_pick_y,
+            self.ui.xy_overview.canvas: self.plot_pick_xy,
+            self.ui.xtof_overview.canvas: self.plot_pick_xtof,
+        }.get(event.canvas)
+        if pick is None:
+            return
+        pick(event)
+        self.preview_reflectivity()
+
+    @slow_down_events
+    def preview_reflectivity(self):
+        """
+        Plot a preview of the reflectivity of the active data for the region of interest
+        currently selected, computed from the binned data without running the reduction.
+        """
+        data = self.data_manager.active_channel
+        if data is None or data.is_direct_beam:
+            return
+        # Copy the configuration, so that the change is still detected when the mouse is released
+        configuration = copy.copy(data.configuration)
+        configuration.peak_position = self.ui.refXPos.value()
+        configuration.peak_width = self.ui.refXWidth.value()
+        configuration.low_res_position = self.ui.refYPos.value()
+        configuration.low_res_width = self.ui.refYWidth.value()
+        configuration.bck_position = self.ui.bgCenter.value()
+        configuration.bck_width = self.ui.bgWidth.value()
+        configuration.subtract_background = self.ui.bgActive.isChecked()
+        try:
+            configuration.scaling_factor = math.pow(10.0, self.ui.refScale.value())
+        except (OverflowError, ValueError):
+            configuration.scaling_factor = 1
+        try:
+            preview = self.data_manager.preview_reflectivity(configuration)
+        except Exception:
+            logging.exception("Could not compute the reflectivity preview")
+            return
+        if preview is not None:
+            self.plot_manager.plot_refl(preview=preview)
+
     @slow_down_events
     def plot_pick_x(self, event):
         """
         Plot for x-projection has been clicked.
         :param event: event object
         """
+        self._pick_x(event)
+
+    def _pick_x(self, event):
+        """
+        Move the peak or background range selected on the x-projection plot.
+        :param event: event object
+        """
         if event.button is not None and event.xdata is not None:
             self.main_window.auto_change_active = True
             if event.button == 1:
@@ -4,6 +4,12 @@ computes a meaningful progress status accordingly.
 """
 
 
+class TaskCancelledError(Exception):
+    """
+    Raised when progress is reported on a task that was cancelled
+    """
+
+
 class ProgressReporter(object):
     """
     Progress reporter class that allows for sub-tasks.
@@ -29,6 +35,8 @@ class ProgressReporter(object):
         self.sub_tasks = []
         self.status_bar = status_bar
         self.progress_bar = progress_bar
+        self.parent = None
+        self._cancelled = False
 
     def __call__(self, value, message="", out_of=None):
         """Shortcut to set_value() so that the object can be used
@@ -52,7 +60,10 @@ class ProgressReporter(object):
         """
         Set the value of a progress indicator
         :param int value: completion value, as a percentage
+        :raises TaskCancelledError: if the task was cancelled
         """
+        if self.is_cancelled():
+            raise TaskCancelledError("Task cancelled")
         if out_of is not None:
             value = int(value / out_of * self.max_value)
         value = min(value, self.max_value)
@@ -66,10 +77,7 @@ class ProgressReporter(object):
 
         :param str message: message to be displayed
         """
-        _value = self.value
-        for item in self.sub_tasks:
-            _value += min(item.value, item.max_value)
-        _value = min(_value, self.max_value)
+        _value = self.get_value()
 
         if self.call_back is not None:
             self.call_back(message)
@@ -80,6 +88,29 @@ class ProgressReporter(object):
         if message and self.status_bar:
             self.status_bar.show_message(message)
 
+    def get_value(self):
+        """
+        Returns the progress value, including sub-tasks
+        """
+        _value = self.value
+        for item in self.sub_tasks:
+            _value += min(item.value, item.max_value)
+        return min(_value, self.max_value)
+
+    def cancel(self):
+        """
+        Cancel the task. The worker is interrupted the next time it reports progress.
+        """
+        self._cancelled = True
+
+    def is_cancelled(self):
+        """
+        Returns True if this task, or the task it is part of, was cancelled
+        """
+        if self._cancelled:
+            return True
+        return self.parent is not None and self.parent.is_cancelled()
+
     def create_sub_task(self, max_value):
         """
         Create a sub-task, with max_value being its portion
@@ -89,5 +120,6 @@ class ProgressReporter(object):
         :param int max_value: portion of the task
         """
         sub_task_progress = ProgressReporter(max_value, self.update)
+        sub_task_progress.parent = self
         self.sub_tasks.append(sub_task_progress)
         return sub_task_progress
@@ -0,0 +1,121 @@
+"""
+Load the runs next to the active run ahead of time, so that stepping
+through a run series is served from the data cache.
+"""
+
+import logging
+import os
+from functools import partial
+
+from PyQt5 import QtCore
+
+from quicknxs.interfaces.event_handlers.file_loading_worker import FileLoadingWorker
+
+
+class RunPrefetcher(object):
+    """
+    Load the event files before and after the active file of the current directory into the
+    data cache, one at a time, in a low-priority worker thread.
+    """
+
+    def __init__(self, data_manager, parent=None):
+        """
+        :param DataManager data_manager: data manager holding the cache
+        :param QObject parent: parent of the worker threads
+        """
+        self.data_manager = data_manager
+        self.parent = parent
+        self.configuration = None
+        self._directory = None
+        self._queue = []
+        self._worker = None
+
+    def is_prefetching(self):
+        """
+        Returns True if runs are being loaded or waiting to be loaded
+        """
+        return self._worker is not None or len(self._queue) > 0
+
+    def neighbour_files(self, n_runs):
+        """
+        Returns the paths of the n_runs event files after and before the active file in the
+        current directory, nearest first, alternating between the next and the previous runs.
+        :param int n_runs: number of runs on each side of the active file
+        """
+        file_names = self.data_manager.current_event_files
+        if self.data_manager.current_file_name not in file_names:
+            return []
+        index = file_names.index(self.data_manager.current_file_name)
+        neighbours = []
+        for offset in range(1, n_runs + 1):
+            for i in [index + offset, index - offset]:
+                if 0 <= i < len(file_names):
+                    neighbours.append(os.path.join(self.data_manager.current_directory, file_names[i]))
+        return neighbours
+
+    def prefetch(self, configuration):
+        """
+        Cancel any pending prefetch and start loading the neighbours of the active file.
+        The number of runs on each side is given by ``configuration.prefetch_runs``.
+        :param Configuration configuration: configuration to use to load the data
+        """
+        self.cancel()
+        if configuration.prefetch_runs <= 0:
+            return
+        self.configuration = configuration
+        self._directory = self.data_manager.current_directory
+        self._queue = self.neighbour_files(configuration.prefetch_runs)
+        self._start_next()
+
+    def cancel(self, wait=False):
+        """
+        Cancel the pending prefetch
+        :param bool wait: if True, wait for the worker thread to stop
+        """
+        self._queue = []
+        worker = self._worker
+        if worker is not None:
+            self._worker = None
+            worker.cancel()
+            if wait:
+                worker.wait()
+
+    def _start_next(self):
+        """
+        Start loading the next file in the queue that is not already in the cache
+        """
+        while self._queue:
+            # Prefetched files are stale once the user moves to another directory
+            if self.data_manager.current_directory != self._directory:
+                self.cancel()
+                return
+            # Never grow the cache beyond its memory budget
+            if self.data_manager.get_cache_memory_size() >= self.configuration.cache_memory_budget * 1024**3:
+                self.cancel()
+                return
+            file_path = self._queue.pop(0)
+            if self.data_manager.is_in_cache(file_path):
+                continue
+            worker = FileLoadingWorker(self.data_manager, file_path, self.configuration, parent=self.parent)
+            worker.loaded.connect(partial(self._file_loaded, worker))
+            worker.failed.connect(partial(self._loading_failed, worker))
+            worker.finished.connect(worker.deleteLater)
+            self._worker = worker
+            worker.start(QtCore.QThread.IdlePriority)
+            return
+
+    def _file_loaded(self, worker, nexus_data, is_from_cache):
+        if worker is not self._worker:
+            return
+        self._worker = None
+        if not is_from_cache:
+            self.data_manager.add_prefetched_data(nexus_data, self.configuration)
+        self._start_next()
+
+    def _loading_failed(self, worker, message, detailed_message):
+        if worker is not self._worker:
+            return
+        self._worker = None
+        logging.warning("Could not prefetch %s: %s", worker.file_path, message)
+        logging.debug(detailed_message)
+        self._start_next()
@@ -17,6 +17,7 @@ from PyQt5 import QtCore, QtWidgets
 import quicknxs
 from quicknxs.interfaces import load_ui
 from quicknxs.interfaces.data_handling.filepath import FilePath
+from quicknxs.interfaces.data_handling.worker_pool import shutdown_worker_pool
 from quicknxs.interfaces.event_handlers.configuration_handler import ConfigurationHandler
 from quicknxs.interfaces.event_handlers.main_handler import MainHandler
 from quicknxs.interfaces.event_handlers.plot_handler import PlotHandler
@@ -105,7 +106,10 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def closeEvent(self, event):
         """Close UI event"""
+        self.file_handler.cancel_loading(wait=True)
+        self.file_handler.cancel_prefetch(wait=True)
         self.file_handler.get_configuration()
+        shutdown_worker_pool()
         event.accept()
 
     def keyPressEvent(self, event):
@@ -564,6 +568,12 @@ class MainWindow(QtWidgets.QMainWindow):
     def loadExtraction(self):
         self.file_handler.open_reduced_file_dialog()
 
+    def openSession(self):
+        self.file_handler.open_session_dialog()
+
+    def saveSession(self):
+        self.file_handler.save_session_dialog()
+
     def refresh_file_list(self):
         self.file_handler.update_file_list()
 
@@ -570,11 +570,12 @@ class PlotManager(object):
             plot.draw()
         progress(100, message=final_msg, out_of=100)
 
-    def plot_refl(self, preserve_lim=False):
+    def plot_refl(self, preserve_lim=False, preview=None):
         """
         Calculate and display the reflectivity from the current dataset
         and any dataset stored. Intensities from direct beam
         measurements can be used for normalization.
+        :param tuple preview: q, r and dr arrays to display for the current dataset instead of its reflectivity
         """
 
         def _plot_message(message):
@@ -591,11 +592,18 @@ class PlotManager(object):
 
         self.main_window.ui.refl.clear()
 
+        if preview is not None:
+            active_q, active_r, active_dr = preview
+        elif self.main_window.data_manager.active_channel is not None:
+            active_q = self.main_window.data_manager.active_channel.q
+            active_r = self.main_window.data_manager.active_channel.r
+            active_dr = self.main_window.data_manager.active_channel.dr
+
         if (
             self.main_window.data_manager.active_channel is None
-            or self.main_window.data_manager.active_channel.r is None
-            or self.main_window.data_manager.active_channel.q is None
-            or self.main_window.data_manager.active_channel.dr is None
+            or active_r is None
+            or active_q is None
+            or active_dr is None
         ):
             _plot_message("No data")
             return False
@@ -622,8 +630,8 @@ class PlotManager(object):
         ymin = 1.5
         ymax = 1e-7
         P0 = self.main_window.ui.rangeStart.value()
-        PN = len(self.main_window.data_manager.active_channel.q) - self.main_window.ui.rangeEnd.value()
-        ynormed = self.main_window.data_manager.active_channel.r[P0:PN]
+        PN = len(active_q) - self.main_window.ui.rangeEnd.value()
+        ynormed = active_r[P0:PN]
         if len(ynormed[ynormed > 0]) < 2:
             _plot_message("No points to show\nin active dataset!")
             return False
@@ -632,10 +640,10 @@ class PlotManager(object):
             ymin = min(ymin, ynormed[ynormed > 0].min())
             ymax = _set_ymax(ymax, ynormed)
             self.main_window.ui.refl.errorbar(
-                self.main_window.data_manager.active_channel.q[P0:PN],
+                active_q[P0:PN],
                 ynormed,
-                yerr=self.main_window.data_manager.active_channel.dr[P0:PN],
-                label="Active",
+                yerr=active_dr[P0:PN],
+                label="Active (preview)" if preview is not None else "Active",
                 lw=2,
                 capsize=1,
                 color="black",
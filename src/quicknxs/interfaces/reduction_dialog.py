@@ -40,6 +40,7 @@ class ReductionDialog(QtWidgets.QDialog):
         self.ui.numpy.setChecked(self._verify_true("format_numpy", False))
         self.ui.mantid_script_checkbox.setChecked(self._verify_true("format_mantid", False))
         self.ui.five_cols_checkbox.setChecked(self._verify_true("format_5cols", True))
+        self.ui.hdf5.setChecked(self._verify_true("format_hdf5", False))
 
         # Emails
         self.ui.emailSend.setChecked(self._verify_true("email_send", False))
@@ -79,6 +80,7 @@ class ReductionDialog(QtWidgets.QDialog):
             format_mantid=self.ui.mantid_script_checkbox.isChecked(),
             format_numpy=self.ui.numpy.isChecked(),
             format_5cols=self.ui.five_cols_checkbox.isChecked(),
+            format_hdf5=self.ui.hdf5.isChecked(),
             output_directory=self.ui.directoryEntry.text(),
             output_file_template=self.ui.fileNameEntry.text(),
             email_send=self.ui.emailSend.isChecked(),
@@ -117,6 +119,7 @@ class ReductionDialog(QtWidgets.QDialog):
         self.settings.setValue("format_numpy", self.ui.numpy.isChecked())
         self.settings.setValue("format_mantid", self.ui.mantid_script_checkbox.isChecked())
         self.settings.setValue("format_5cols", self.ui.five_cols_checkbox.isChecked())
+        self.settings.setValue("format_hdf5", self.ui.hdf5.isChecked())
 
         self.settings.setValue("email_send", self.ui.emailSend.isChecked())
         self.settings.setValue("email_zip_data", self.ui.emailZIPData.isChecked())
@@ -8,6 +8,7 @@ import logging
 import os
 import sys
 
+import h5py
 import matplotlib.pyplot as plt
 import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
@@ -15,6 +16,23 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 from quicknxs.interfaces import load_ui
 
 from ..interfaces.data_handling.processing_workflow import ProcessingWorkflow
+from ..interfaces.data_handling.quicknxs_io import ReducedHDF5File
+
+
+def read_reflectivity(file_path, pol_state=None):
+    """
+    Read the data of a specular reflectivity file, as [column][point]
+    :param str file_path: reduced file
+    :param str pol_state: cross-section to read, for HDF5 files
+    """
+    if pol_state is None:
+        return np.loadtxt(file_path, comments="#").transpose()
+    with ReducedHDF5File(file_path) as reduced_file:
+        dataset = reduced_file.get_datasets(pol_state)
+        if dataset.shape[0] == 0:
+            return np.array([])
+        # Only Q, R and dR are plotted
+        return dataset[:, :3].transpose()
 
 
 class CompareWidget(QtWidgets.QWidget):
@@ -27,6 +45,8 @@ class CompareWidget(QtWidgets.QWidget):
         self.ui = load_ui("ui_compare_widget.ui", self)
         self.ui.compareList.verticalHeader().sectionMoved.connect(self.draw)
         self.file_paths = {}
+        # Cross-section plotted for each HDF5 file item
+        self.file_states = {}
         self.settings = QtCore.QSettings(".refredm")
         current_dir = self.settings.value("current_directory", os.path.expanduser("~"))
         self.active_folder = self.settings.value("compare_directory", current_dir)
@@ -56,7 +76,7 @@ class CompareWidget(QtWidgets.QWidget):
         """
         Show Open-File dialog
         """
-        filter_ = "Reflectivity (*.dat *.txt);;All (*.*)"
+        filter_ = "Reflectivity (*.dat *.txt *.h5);;All (*.*)"
         names, _ = QtWidgets.QFileDialog.getOpenFileNames(
             self, "Open reflectivity file...", directory=self.active_folder, filter=filter_
         )
@@ -74,10 +94,32 @@ class CompareWidget(QtWidgets.QWidget):
 
     def read_file(self, file_path):
         """
-        Read data file
+        Read data file. HDF5 files are added once for each specular cross-section they hold.
+        :param str file_path: file to load
+        """
+        if not h5py.is_hdf5(file_path):
+            self._add_file(file_path)
+            return
+        with ReducedHDF5File(file_path) as reduced_file:
+            pol_states = [
+                pol_state
+                for pol_state in reduced_file.cross_sections
+                if not isinstance(reduced_file.get_datasets(pol_state), list)
+            ]
+        if not pol_states:
+            logging.error("No specular data in %s", file_path)
+        for pol_state in pol_states:
+            self._add_file(file_path, pol_state)
+
+    def _add_file(self, file_path, pol_state=None):
+        """
+        Add a data file to the list of plotted files
         :param str file_path: file to load
+        :param str pol_state: cross-section to plot, for HDF5 files
         """
         label = os.path.basename(file_path)
+        if pol_state is not None:
+            label = "%s [%s]" % (label, pol_state)
         idx = self.ui.compareList.rowCount()
 
         # Find a color
@@ -92,9 +134,11 @@ class CompareWidget(QtWidgets.QWidget):
         item.setFlags(QtCore.Qt.ItemIsEnabled)
 
         # Check that we can read the file
-        data = np.loadtxt(file_path, comments="#").transpose()
+        data = read_reflectivity(file_path, pol_state)
         if len(data) == 0:
             plotlabel = "Empty file"
+        elif pol_state is not None:
+            plotlabel = "%s  %s" % (os.path.basename(file_path).split("REF_M_", 1)[-1].split("_Specular")[0], pol_state)
         else:
             try:
                 plotlabel = label.split("REF_M_", 1)[1]
@@ -109,6 +153,7 @@ class CompareWidget(QtWidgets.QWidget):
         self.ui.compareList.setItem(idx, 1, item)
         self.ui.compareList.setItem(idx, 2, QtWidgets.QTableWidgetItem(plotlabel))
         self.file_paths[label] = os.path.abspath(file_path)
+        self.file_states[label] = pol_state
         self.changing_table = False
 
     def clear_plot(self):
@@ -145,10 +190,11 @@ class CompareWidget(QtWidgets.QWidget):
             header = self.ui.compareList.verticalHeader()
             for i in range(self.ui.compareList.rowCount()):
                 idx = header.logicalIndex(i)
-                name = self.file_paths[self.ui.compareList.item(idx, 0).text()]
+                file_label = self.ui.compareList.item(idx, 0).text()
+                name = self.file_paths[file_label]
                 label = self.ui.compareList.item(idx, 2).text()
                 color = self.ui.compareList.item(idx, 1).text()
-                data = np.loadtxt(name, comments="#").transpose()
+                data = read_reflectivity(name, self.file_states.get(file_label))
                 if len(data) == 0:
                     logging.error("No data for %s", name)
                     continue
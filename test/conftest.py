@@ -8,12 +8,16 @@ import glob
 import os
 import sys
 from pathlib import Path
+from types import SimpleNamespace
 
+import numpy as np
 import pytest
 from PyQt5.QtCore import QSettings
 
+from quicknxs.interfaces.data_handling import gisans
 from quicknxs.interfaces.data_handling.filepath import RunNumbers
 from quicknxs.interfaces.data_handling.instrument import Instrument
+from quicknxs.interfaces.event_handlers.main_handler import MainHandler
 
 pytest_plugins = ["mantid.fixtures"]
 
@@ -38,6 +42,17 @@ def qsettings_tmp_path(tmp_path):
     QSettings.setPath(QSettings.NativeFormat, QSettings.UserScope, str(tmp_path))
 
 
+@pytest.fixture(autouse=True)
+def synchronous_file_loading():
+    """
+    Load files on the main thread, so that UI tests can act on the loaded data right after opening a file.
+    Tests of background loading should set ``MainHandler.BACKGROUND_LOADING = True``.
+    """
+    MainHandler.BACKGROUND_LOADING = False
+    yield
+    MainHandler.BACKGROUND_LOADING = True
+
+
 ##################################
 # FIXTURES THAT CAN BE REQUESTED #
 ##################################
@@ -48,6 +63,45 @@ def DATA_DIR():
     return Path(__file__).parent / "data"
 
 
+@pytest.fixture
+def gisans_reduction_list():
+    r"""Factory of reduction lists of two runs with random GISANS data, on a small detector"""
+
+    def _reduction_list(pol_state="Off_Off"):
+        rng = np.random.default_rng(42)
+        reduction_list = []
+        for tof_min, n_tof in [(10000.0, 8), (15000.0, 10)]:
+            configuration = SimpleNamespace(
+                peak_position=2.5,
+                low_res_position=2.0,
+                scaling_factor=1.5,
+                cut_first_n_points=1,
+                cut_last_n_points=2,
+            )
+            data_set = SimpleNamespace(
+                configuration=configuration,
+                proton_charge=2.0,
+                det_size_x=0.2,
+                dist_sam_det=2.5,
+                xydata=np.zeros((5, 6)),
+                direct_pixel=4.0,
+                data=rng.poisson(5.0, (6, 5, n_tof)).astype(float),
+                dangle=1.2,
+                angle_offset=0.1,
+                tof_edges=np.linspace(tof_min, tof_min + 15000.0, n_tof + 1),
+                dist_mod_det=15.0,
+                tof=np.zeros(n_tof),
+            )
+            gisans_data = gisans.GISANS(data_set)
+            gisans_data()
+            reduction_list.append(
+                SimpleNamespace(cross_sections={pol_state: SimpleNamespace(gisans_data=gisans_data)})
+            )
+        return reduction_list
+
+    return _reduction_list
+
+
 Instrument.file_search_template = str(Path(__file__).parent / "data" / "quicknxs-data" / "REF_M_%s")
 
 
@@ -0,0 +1,105 @@
+# standard imports
+import os
+import time
+
+# third party imports
+import numpy as np
+import pytest
+
+# quicknxs imports
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.cube_cache import (
+    CubeCache,
+    cube_key,
+    data_info_key,
+    get_cube_cache,
+    meta_data_key,
+)
+
+
+@pytest.fixture
+def event_file(tmp_path):
+    file_path = tmp_path / "REF_M_1234.nxs.h5"
+    file_path.write_bytes(b"events")
+    return str(file_path)
+
+
+class TestCubeCache(object):
+    def test_meta_round_trip(self, tmp_path):
+        cache = CubeCache(str(tmp_path / "cache"), 1e9)
+        assert cache.get_meta("abc") is None
+        cache.put_meta("abc", dict(logs={"S1Width": np.float64(1.5)}, peak_range=[np.int64(120), np.int64(140)]))
+        assert cache.get_meta("abc") == dict(logs={"S1Width": 1.5}, peak_range=[120, 140])
+
+    def test_arrays_are_memory_mapped(self, tmp_path):
+        cache = CubeCache(str(tmp_path / "cache"), 1e9)
+        data = np.arange(24, dtype=float).reshape((2, 3, 4))
+        cache.put_arrays("abc", data=data, raw_error=np.sqrt(data), xydata=data.sum(axis=2), xtofdata=data.sum(axis=1))
+        arrays = cache.get_arrays("abc")
+        assert isinstance(arrays["data"], np.memmap)
+        np.testing.assert_array_equal(arrays["data"], data)
+        np.testing.assert_array_equal(arrays["xtofdata"], data.sum(axis=1))
+        assert cache.get_arrays("other") is None
+
+    def test_optional_arrays(self, tmp_path):
+        cache = CubeCache(str(tmp_path / "cache"), 1e9)
+        data = np.arange(24, dtype=np.uint32).reshape((2, 3, 4))
+        cache.put_arrays("abc", data=data, xydata=data.sum(axis=2), xtofdata=data.sum(axis=1))
+        arrays = cache.get_arrays("abc")
+        assert "raw_error" not in arrays
+        assert arrays["data"].dtype == np.uint32
+        cache.put_arrays("other", data=data, raw_error=data)
+        assert cache.get_arrays("other") is None
+
+    def test_eviction(self, tmp_path):
+        data = np.zeros(1000)
+        cache = CubeCache(str(tmp_path / "cache"), 2.5 * data.nbytes * 4)
+        cache.put_arrays("first", data=data, raw_error=data, xydata=data, xtofdata=data)
+        cache.put_arrays("second", data=data, raw_error=data, xydata=data, xtofdata=data)
+        # Make "first" the most recently used entry
+        os.utime(os.path.join(cache.directory, "second"), (time.time() - 100, time.time() - 100))
+        assert cache.get_arrays("first") is not None
+        cache.put_arrays("third", data=data, raw_error=data, xydata=data, xtofdata=data)
+        assert cache.get_arrays("second") is None
+        assert cache.get_arrays("first") is not None
+        assert cache.get_arrays("third") is not None
+        assert cache.size() <= cache.max_size
+
+
+class TestCacheKeys(object):
+    def test_meta_data_key(self, event_file):
+        configuration = Configuration()
+        key = meta_data_key(event_file, "Off_Off", configuration)
+        assert meta_data_key(event_file, "Off_Off", configuration) == key
+        assert meta_data_key(event_file, "On_Off", configuration) != key
+        configuration.deadtime_value = 5.0
+        assert meta_data_key(event_file, "Off_Off", configuration) != key
+        # Modified file
+        with open(event_file, "ab") as fd:
+            fd.write(b"more events")
+        configuration.deadtime_value = Configuration.deadtime_value
+        assert meta_data_key(event_file, "Off_Off", configuration) != key
+
+    def test_cube_key(self):
+        assert cube_key("abc", np.arange(10.0)) == cube_key("abc", np.arange(10))
+        assert cube_key("abc", np.arange(10.0)) != cube_key("abc", np.arange(11.0))
+
+    def test_data_info_key(self):
+        configuration = Configuration()
+        key = data_info_key("abc", configuration)
+        configuration.use_roi = not configuration.use_roi
+        assert data_info_key("abc", configuration) != key
+
+
+def test_get_cube_cache(tmp_path):
+    configuration = Configuration()
+    assert get_cube_cache(configuration) is None
+    configuration.cube_cache_directory = str(tmp_path / "cache")
+    configuration.cube_cache_max_size = 1.0
+    cache = get_cube_cache(configuration)
+    assert cache.max_size == 1024**3
+    assert get_cube_cache(configuration) is cache
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,166 @@
+import numpy as np
+import pytest
+
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.cube_storage import (
+    CompactCube,
+    SparseCube,
+    SqrtCountsCube,
+    compact_cube,
+    from_stored_arrays,
+    is_raw_counts,
+    sparse_cube,
+    store_cube,
+    to_stored_arrays,
+)
+from quicknxs.interfaces.data_handling.data_set import CrossSectionData
+from quicknxs.interfaces.data_handling.reflectivity_preview import roi_signal
+
+
+def _raw_counts(shape=(40, 6, 5), seed=4):
+    counts = np.random.default_rng(seed).poisson(4.0, shape).astype(float)
+    return counts, np.sqrt(counts)
+
+
+def test_raw_counts():
+    counts, errors = _raw_counts()
+    data, raw_error = compact_cube(counts, errors)
+    assert isinstance(data, CompactCube) and data.values.dtype == np.uint32
+    assert isinstance(raw_error, SqrtCountsCube) and raw_error.counts is data
+    assert data.values.nbytes * 4 == counts.nbytes + errors.nbytes
+    assert data.shape == raw_error.shape == counts.shape
+    # Reading the cube gives the float64 values
+    assert data[3:5, 1:4, :].dtype == np.float64
+    np.testing.assert_array_equal(data[3:5, 1:4, :], counts[3:5, 1:4, :])
+    np.testing.assert_array_equal(raw_error[3:5, 1:4, :], errors[3:5, 1:4, :])
+    np.testing.assert_array_equal(np.asarray(data), counts)
+    np.testing.assert_array_equal(np.asarray(raw_error), errors)
+
+
+def test_weighted_counts():
+    counts, errors = _raw_counts()
+    assert not is_raw_counts(counts * 1.1, errors)
+    assert not is_raw_counts(counts, 2 * errors)
+    assert not is_raw_counts(-counts, errors)
+    data, raw_error = compact_cube(counts * 1.1, errors)
+    assert data.values.dtype == raw_error.values.dtype == np.float32
+    np.testing.assert_allclose(data[2:7], counts[2:7] * 1.1, rtol=1e-7)
+    np.testing.assert_allclose(np.asarray(raw_error), errors, rtol=1e-7)
+
+
+def test_stored_arrays():
+    counts, errors = _raw_counts()
+    assert to_stored_arrays(counts, errors) == (counts, errors)
+    data, raw_error = from_stored_arrays(counts, errors)
+    assert data is counts and raw_error is errors
+
+    stored_data, stored_error = to_stored_arrays(*compact_cube(counts, errors))
+    assert stored_data.dtype == np.uint32 and stored_error is None
+    data, raw_error = from_stored_arrays(stored_data, stored_error)
+    np.testing.assert_array_equal(raw_error[:], errors)
+
+    stored_data, stored_error = to_stored_arrays(*compact_cube(counts * 1.1, errors))
+    assert stored_error.dtype == np.float32
+    data, raw_error = from_stored_arrays(stored_data, stored_error)
+    assert isinstance(raw_error, CompactCube)
+
+
+def test_sparse_cube():
+    counts = np.random.default_rng(5).poisson(0.05, (30, 20, 12)).astype(float)
+    mask = np.zeros(30, dtype=bool)
+    mask[[2, 5, 6, 20]] = True
+    keys = [
+        (slice(3, 9), slice(2, 15), slice(None)),
+        (slice(None), slice(0, 5), slice(2, 10)),
+        (mask, slice(1, 19), slice(None)),
+        (np.array([1, -1, 4]),),
+        (slice(None), slice(None), slice(4, 3)),
+    ]
+    for compact in (False, True):
+        for scale in (1.0, 1.3):
+            data, raw_error = sparse_cube(counts * scale, np.sqrt(counts), compact=compact)
+            assert isinstance(data, SparseCube) and data.fill_factor < 0.1
+            assert isinstance(raw_error, SqrtCountsCube if scale == 1.0 else SparseCube)
+            expected = np.asarray(data)
+            np.testing.assert_allclose(expected, counts * scale, rtol=1e-7)
+            np.testing.assert_allclose(np.asarray(raw_error), np.sqrt(counts), rtol=1e-7)
+            for key in keys:
+                sliced = data[key]
+                assert isinstance(sliced, SparseCube)
+                np.testing.assert_array_equal(np.asarray(sliced), expected[key])
+                np.testing.assert_array_equal(raw_error[key], np.asarray(raw_error)[key])
+                for axis in (None, 0, 1, 2, (0, 1), (1, 2), (0, 2), -1):
+                    np.testing.assert_allclose(sliced.sum(axis=axis), expected[key].sum(axis=axis), rtol=1e-12)
+            # Integer indices return arrays
+            for key in [3, -1, np.int64(4), (3, 5), (slice(2, 6), 7), (slice(None), slice(1, 4), 5), (2, 3, 4)]:
+                np.testing.assert_array_equal(data[key], expected[key])
+                np.testing.assert_array_equal(raw_error[key], np.asarray(raw_error)[key])
+            with pytest.raises(IndexError):
+                data[30]
+            # Other keys are applied to the dense array
+            np.testing.assert_array_equal(data[:, :, ::2], expected[:, :, ::2])
+
+
+def test_sparse_cube_integer_index(monkeypatch):
+    """Only the selected plane of a sparse cube is converted to an array"""
+    counts = np.random.default_rng(5).poisson(0.05, (30, 20, 12)).astype(float)
+    data, _ = sparse_cube(counts, np.sqrt(counts))
+    converted_shapes = []
+    to_array = SparseCube.__array__
+
+    def _array(cube, dtype=None, copy=None):
+        converted_shapes.append(cube.shape)
+        return to_array(cube, dtype)
+
+    monkeypatch.setattr(SparseCube, "__array__", _array)
+    np.testing.assert_array_equal(data[7], counts[7])
+    assert converted_shapes == [(1, 20, 12)]
+
+
+def test_store_cube():
+    counts = np.random.default_rng(6).poisson(0.05, (30, 20, 12)).astype(float)
+    assert isinstance(store_cube(counts, np.sqrt(counts), sparse_fill_factor=0.1)[0], SparseCube)
+    data, raw_error = store_cube(counts + 1, np.sqrt(counts + 1), sparse_fill_factor=0.1)
+    assert isinstance(data, np.ndarray) and isinstance(raw_error, np.ndarray)
+    data, _ = store_cube(counts + 1, np.sqrt(counts + 1), compact=True, sparse_fill_factor=0.1)
+    assert isinstance(data, CompactCube)
+    assert isinstance(store_cube(counts, np.sqrt(counts))[0], np.ndarray)
+
+    stored_data, stored_error = to_stored_arrays(*sparse_cube(counts, np.sqrt(counts), compact=True))
+    assert stored_data.dtype == np.uint32 and stored_error is None
+    np.testing.assert_array_equal(stored_data, counts)
+
+
+@pytest.mark.parametrize("store", [compact_cube, sparse_cube])
+def test_stored_cross_section(store):
+    """The values computed from a cross-section do not depend on how its cube is stored"""
+    config = Configuration()
+    config.peak_position = 20
+    config.peak_width = 6
+    config.low_res_position = 3
+    config.low_res_width = 4
+    config.bck_position = 20
+    config.bck_width = 30
+    xs = CrossSectionData("Off_Off", config)
+    xs.data, xs.raw_error = _raw_counts()
+    xs.data[17:23] += 20.0
+    xs.raw_error = np.sqrt(xs.data)
+    xs.xtofdata = xs.data.sum(axis=1)
+    xs.tof_edges = np.linspace(10000.0, 30000.0, 6)
+    xs.proton_charge = 2.0
+    xs.dist_mod_det = 18.0
+
+    def _results():
+        table, _ = xs.get_tof_counts_table()
+        signal, error = roi_signal(xs, config.peak_roi, config.low_res_roi, config.bck_roi)
+        return [table, xs.get_counts_vs_TOF(), xs.get_background_vs_TOF(), signal, error]
+
+    expected = _results()
+    xs.data, xs.raw_error = store(xs.data, xs.raw_error)
+    assert isinstance(xs.raw_error, SqrtCountsCube)
+    for values, expected_values in zip(_results(), expected):
+        np.testing.assert_array_equal(values, expected_values)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
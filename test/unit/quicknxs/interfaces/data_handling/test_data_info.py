@@ -0,0 +1,115 @@
+import mantid.simpleapi as api
+import numpy as np
+import pytest
+
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.data_info import Fitter2, scan_x_profiles
+from quicknxs.interfaces.data_handling.data_set import NexusData
+
+
+class _FakeInstrument(object):
+    def __init__(self, n_x, n_y):
+        self._parameters = {"number-of-x-pixels": [n_x], "number-of-y-pixels": [n_y]}
+
+    def getNumberParameter(self, name):
+        return self._parameters[name]
+
+
+class _FakeWorkspace(object):
+    """Workspace stand-in providing only the detector size"""
+
+    def __init__(self, n_x, n_y):
+        self._instrument = _FakeInstrument(n_x, n_y)
+
+    def getInstrument(self):
+        return self._instrument
+
+
+def test_fitter_detector_image():
+    """The peaks are found in a detector image provided by the caller, without integrating events"""
+    x = np.arange(304)
+    y = np.arange(256)
+    x_profile = 1000.0 * np.exp(-((x - 150.0) ** 2) / (2.0 * 3.0**2)) + 1.0
+    y_profile = 1.0 / (1.0 + np.exp(-(y - 110.0) / 2.0)) / (1.0 + np.exp((y - 180.0) / 2.0))
+    image = np.round(np.outer(x_profile, y_profile))
+
+    fitter = Fitter2(_FakeWorkspace(304, 256), detector_image=image)
+    peak, low_res = fitter.fit_2d_peak()
+    assert peak == [144, 156]
+    assert low_res[0] == pytest.approx(110, abs=10)
+    assert low_res[1] == pytest.approx(180, abs=10)
+
+
+def test_scan_x_profiles():
+    """Scanning many projections at once gives the same peaks as scanning them one at a time"""
+    rng = np.random.default_rng(3)
+    x = np.arange(304)
+    centers = rng.uniform(100, 200, 12)
+    profiles = np.array([rng.poisson(500 * np.exp(-((x - c) ** 2) / 30.0) + 10) for c in centers]).astype(float)
+
+    results = scan_x_profiles(profiles)
+    assert len(results) == len(profiles)
+    for center, profile, (found_peaks, best_peak) in zip(centers, profiles, results):
+        assert scan_x_profiles(profile) == [(found_peaks, best_peak)]
+        assert best_peak[0] == pytest.approx(center, abs=2)
+
+        fitter = Fitter2(_FakeWorkspace(304, 256), detector_image=np.outer(profile, np.ones(256)))
+        assert fitter._scan_peaks() == found_peaks
+        assert fitter.guess_x == best_peak[0]
+
+    found_peaks, best_peak = scan_x_profiles(np.zeros(304))[0]
+    assert found_peaks == [] and best_peak is None
+
+
+def test_fitter_other_cross_sections():
+    """The x-projections of the other cross-sections are scanned with that of the main one"""
+    x = np.arange(304)
+    peak = 500.0 * np.exp(-((x - 160.0) ** 2) / 30.0) + 10.0
+    other_peak = 500.0 * np.exp(-((x - 120.0) ** 2) / 30.0) + 10.0
+    flat = np.full(304, 10.0)
+
+    # The peak of the main cross-section is used if there is one
+    fitter = Fitter2(
+        _FakeWorkspace(304, 256), detector_image=np.outer(peak, np.ones(256)), other_x_profiles=[flat, other_peak]
+    )
+    assert fitter._scan_peaks() == scan_x_profiles(peak)[0][0]
+    assert fitter.guess_x == pytest.approx(160, abs=2)
+    assert fitter.other_peaks == [[], scan_x_profiles(other_peak)[0][0]]
+
+    # Otherwise, the maximum of its own x-projection, not the peak of another cross-section
+    ramp = np.linspace(10.0, 20.0, 304)
+    fitter = Fitter2(
+        _FakeWorkspace(304, 256), detector_image=np.outer(ramp, np.ones(256)), other_x_profiles=[other_peak, peak]
+    )
+    assert fitter._scan_peaks() == []
+    assert fitter.guess_x == 303
+
+
+@pytest.mark.datarepo
+def test_fitter_shared_detector_image(data_server):
+    """The detector image summed from the cube gives the same peaks as integrating the events"""
+    nexus_data = NexusData(data_server.path_to("REF_M_42112"), Configuration())
+    nexus_data.load()
+    cross_section = nexus_data.cross_sections[nexus_data.main_cross_section]
+    workspace = cross_section.event_workspace
+
+    integrated = api.Integration(InputWorkspace=workspace).extractY()
+    np.testing.assert_allclose(cross_section.detector_image.ravel(), integrated.ravel())
+
+    integrated_fitter = Fitter2(workspace)
+    shared_fitter = Fitter2(workspace, detector_image=cross_section.detector_image)
+    assert shared_fitter.fit_2d_peak() == integrated_fitter.fit_2d_peak()
+
+
+@pytest.mark.datarepo
+def test_load_does_not_bin_other_cross_sections(data_server):
+    """Only the main cross-section is binned to find the peaks when there is no cube cache"""
+    nexus_data = NexusData(data_server.path_to("REF_M_42112"), Configuration())
+    nexus_data.load()
+    assert len(nexus_data.cross_sections) > 1
+    for name, cross_section in nexus_data.cross_sections.items():
+        assert (cross_section.xtofdata is not None) == (name == nexus_data.main_cross_section)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
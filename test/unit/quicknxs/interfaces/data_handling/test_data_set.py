@@ -1,8 +1,11 @@
+import json
+
+import mantid.simpleapi as api
 import numpy as np
 import pytest
 
 from quicknxs.interfaces.configuration import Configuration
-from quicknxs.interfaces.data_handling.data_set import CrossSectionData
+from quicknxs.interfaces.data_handling.data_set import CrossSectionData, DASLogs, getIxyt
 
 
 def _get_cross_section_data():
@@ -23,6 +26,150 @@ def _get_cross_section_data():
     return xs
 
 
+class _FakeInstrument(object):
+    def __init__(self, n_x, n_y):
+        self._parameters = {"number-of-x-pixels": [n_x], "number-of-y-pixels": [n_y]}
+
+    def getNumberParameter(self, name):
+        return self._parameters[name]
+
+
+class _FakeWorkspace(object):
+    """Minimal stand-in for a rebinned Workspace2D with one spectrum per pixel"""
+
+    def __init__(self, n_x, n_y, n_tof):
+        self._instrument = _FakeInstrument(n_x, n_y)
+        self._y = np.arange(n_x * n_y * n_tof, dtype=float).reshape((n_x * n_y, n_tof))
+        self._e = np.sqrt(self._y)
+
+    def getInstrument(self):
+        return self._instrument
+
+    def getNumberHistograms(self):
+        return self._y.shape[0]
+
+    def blocksize(self):
+        return self._y.shape[1]
+
+    def readY(self, index):
+        return self._y[index]
+
+    def readE(self, index):
+        return self._e[index]
+
+    def extractY(self):
+        return self._y.copy()
+
+    def extractE(self):
+        return self._e.copy()
+
+
+def _getIxyt_per_pixel(nxs_data):
+    """Reference implementation reading one spectrum at a time"""
+    n_y = int(nxs_data.getInstrument().getNumberParameter("number-of-y-pixels")[0])
+    n_x = int(nxs_data.getInstrument().getNumberParameter("number-of-x-pixels")[0])
+    n_tof = nxs_data.blocksize()
+    _y = np.zeros((n_x, n_y, n_tof))
+    _e = np.zeros((n_x, n_y, n_tof))
+    for x in range(n_x):
+        for y in range(n_y):
+            _y[x, y, :] = nxs_data.readY(n_y * x + y)[:]
+            _e[x, y, :] = nxs_data.readE(n_y * x + y)[:]
+    return _y, _e
+
+
+def test_getIxyt_pixel_mapping():
+    """The bulk extraction matches reading the spectra one pixel at a time"""
+    ws = _FakeWorkspace(n_x=7, n_y=5, n_tof=3)
+    counts, errors = getIxyt(ws)
+    ref_counts, ref_errors = _getIxyt_per_pixel(ws)
+    assert counts.shape == (7, 5, 3)
+    np.testing.assert_array_equal(counts, ref_counts)
+    np.testing.assert_array_equal(errors, ref_errors)
+
+
+def test_getIxyt_pixel_count_mismatch():
+    ws = _FakeWorkspace(n_x=7, n_y=5, n_tof=3)
+    ws._instrument = _FakeInstrument(8, 5)
+    with pytest.raises(RuntimeError, match="instrument defines 8 x 5 pixels"):
+        getIxyt(ws)
+
+
+@pytest.mark.datarepo
+def test_getIxyt_cross_sections(data_server):
+    """The bulk cube builder matches the per-pixel loop for the cross-sections of a run"""
+    conf = Configuration()
+    ws_list = conf.instrument.load_data(data_server.path_to("REF_M_42112"), conf)
+    assert len(ws_list) == 4
+    tof_edges = np.arange(ws_list[0].getTofMin(), ws_list[0].getTofMax(), conf.tof_bins)
+    binning_ws = api.CreateWorkspace(DataX=tof_edges, DataY=np.zeros(len(tof_edges) - 1))
+    for ws in ws_list:
+        rebinned = api.RebinToWorkspace(WorkspaceToRebin=ws, WorkspaceToMatch=binning_ws)
+        counts, errors = getIxyt(rebinned)
+        ref_counts, ref_errors = _getIxyt_per_pixel(rebinned)
+        np.testing.assert_array_equal(counts, ref_counts)
+        np.testing.assert_array_equal(errors, ref_errors)
+
+
+def test_das_logs():
+    """Log statistics are only computed when read, and only once"""
+    ws = api.CreateWorkspace(DataX=[0.0, 1.0], DataY=[1.0], OutputWorkspace="test_das_logs")
+    api.AddSampleLog(ws, LogName="SampleDetDis", LogText="2.5", LogType="Number", LogUnit="m")
+    api.AddSampleLog(ws, LogName="comment", LogText="text", LogType="String")
+    for i, value in enumerate([1.0, 3.0, 2.0]):
+        api.AddTimeSeriesLog(ws, Name="temperature", Time="2020-01-01T00:00:0%s" % i, Value=value)
+
+    logs = DASLogs(ws)
+    assert logs.units["SampleDetDis"] == "m"
+    assert "comment" in logs.units
+    assert "comment" not in logs.mean
+    assert {"SampleDetDis", "temperature"} <= set(logs.mean)
+    assert "temperature" in logs.minmax and "comment" not in logs.minmax
+    assert logs._statistics == {}
+
+    assert logs.minmax["temperature"] == (1.0, 3.0)
+    assert list(logs._statistics) == ["temperature"]
+    assert logs.mean["SampleDetDis"] == 2.5
+    assert logs.minmax["SampleDetDis"] == (2.5, 2.5)
+    with pytest.raises(KeyError):
+        logs.mean["comment"]
+
+    # Logs that are not read before the workspace is deleted have no statistics, and are not read again
+    read_logs = DASLogs(ws)
+    read_logs.read_all()
+    unread_logs = DASLogs(ws)
+    api.DeleteWorkspace(ws)
+    assert read_logs.minmax["temperature"] == (1.0, 3.0)
+    assert np.isnan(unread_logs.mean["temperature"])
+    assert list(unread_logs._statistics) == ["temperature"]
+    assert np.isnan(unread_logs.minmax["temperature"]).all()
+
+
+def test_das_logs_meta():
+    """The names, units and statistics already read are passed on, and the other statistics are read when used"""
+    ws = api.CreateWorkspace(DataX=[0.0, 1.0], DataY=[1.0], OutputWorkspace="test_das_logs_meta")
+    api.AddSampleLog(ws, LogName="SampleDetDis", LogText="2.5", LogType="Number", LogUnit="m")
+    for i, value in enumerate([1.0, 3.0, 2.0]):
+        api.AddTimeSeriesLog(ws, Name="temperature", Time="2020-01-01T00:00:0%s" % i, Value=value)
+
+    logs = DASLogs(ws)
+    assert logs.mean["SampleDetDis"] == 2.5
+    meta = json.loads(json.dumps(logs.to_meta()))
+    assert meta["statistics"] == {"SampleDetDis": [2.5, 2.5, 2.5]}
+
+    cached_logs = DASLogs(ws, meta=meta)
+    assert cached_logs.units == logs.units
+    assert list(cached_logs.mean) == list(logs.mean)
+    assert list(cached_logs._statistics) == ["SampleDetDis"]
+    assert cached_logs.minmax["temperature"] == (1.0, 3.0)
+
+    # Statistics that could not be read are not passed on
+    unread_logs = DASLogs(ws, meta=meta)
+    api.DeleteWorkspace(ws)
+    assert np.isnan(unread_logs.mean["temperature"])
+    assert unread_logs.to_meta() == meta
+
+
 class TestCrossSectionData(object):
     def test_r_scaling_factor(self):
         config = Configuration()
@@ -0,0 +1,91 @@
+# standard imports
+from types import SimpleNamespace
+
+# third-party imports
+import numpy as np
+import pytest
+
+# quicknxs imports
+from quicknxs.interfaces.data_handling.geometry import H_OVER_M_NEUTRON, GeometryCache, RunGeometry
+from quicknxs.interfaces.data_handling.gisans import GISANS
+
+
+def _cross_section(direct_pixel=4.0, tof_min=10000.0, seed=42):
+    """Cross-section with random data, on a small detector"""
+    rng = np.random.default_rng(seed)
+    return SimpleNamespace(
+        configuration=SimpleNamespace(
+            peak_position=2.5, low_res_position=2.0, scaling_factor=1.0, cut_first_n_points=1, cut_last_n_points=2
+        ),
+        proton_charge=2.0,
+        det_size_x=0.2,
+        dist_sam_det=2.5,
+        dist_mod_det=15.0,
+        xydata=np.zeros((5, 6)),
+        data=rng.poisson(5.0, (6, 5, 8)).astype(float),
+        direct_pixel=direct_pixel,
+        dangle=1.2,
+        angle_offset=0.1,
+        active_area_x=(1, 5),
+        tof_edges=np.linspace(tof_min, tof_min + 15000.0, 9),
+        tof=np.zeros(8),
+    )
+
+
+def test_offspec_coordinates():
+    """Coordinates match the calculation for each cross-section"""
+    cross_section = _cross_section()
+    geometry = RunGeometry(cross_section)
+    qx, qz, ki_z, kf_z = geometry.offspec_coordinates(*cross_section.active_area_x)
+
+    rad_per_pixel = 0.2 / 2.5 / 6
+    xtth = 4.0 - np.arange(6)[1:5]
+    tth_spec = (1.2 - 0.1) * np.pi / 180.0 + (4.0 - 2.5) * rad_per_pixel
+    af = (1.2 - 0.1) * np.pi / 180.0 + xtth * rad_per_pixel - tth_spec / 2.0
+    ai = np.ones_like(af) * tth_spec / 2.0
+    lambda_edges = H_OVER_M_NEUTRON / (15.0 / cross_section.tof_edges * 1e6) * 1e10
+    k = 2.0 * np.pi / ((lambda_edges[:-1] + lambda_edges[1:]) / 2.0)
+    np.testing.assert_array_equal(qz, k[np.newaxis, :] * (np.sin(af) + np.sin(ai))[:, np.newaxis])
+    np.testing.assert_array_equal(qx, k[np.newaxis, :] * (np.cos(af) - np.cos(ai))[:, np.newaxis])
+    np.testing.assert_array_equal(ki_z, k[np.newaxis, :] * np.sin(ai)[:, np.newaxis])
+    np.testing.assert_array_equal(kf_z, k[np.newaxis, :] * np.sin(af)[:, np.newaxis])
+    np.testing.assert_array_equal(geometry.d_wavelength, np.abs(np.diff(lambda_edges)) / np.sqrt(12))
+
+    # The arrays are computed once, and shared
+    assert geometry.offspec_coordinates(1, 5)[0] is qx
+    with pytest.raises(ValueError):
+        qx[0, 0] = 0
+
+
+def test_geometry_cache():
+    """Cross-sections with the same parameters share their geometry"""
+    geometries = GeometryCache(max_size=2)
+    off_off, on_on = _cross_section(seed=1), _cross_section(seed=2)
+    geometry = geometries.get(off_off)
+    assert geometries.get(on_on) is geometry
+    assert len(geometries) == 1
+
+    gisans_off_off, gisans_on_on = GISANS(off_off, geometry), GISANS(on_on, geometries.get(on_on))
+    gisans_off_off()
+    gisans_on_on()
+    assert gisans_on_on.qy_factor is gisans_off_off.qy_factor
+    assert not np.array_equal(gisans_on_on.S, gisans_off_off.S)
+    # Same results as a geometry computed for the cross-section alone
+    gisans_alone = GISANS(on_on)
+    gisans_alone()
+    np.testing.assert_array_equal(gisans_alone.Qz, gisans_on_on.Qz)
+    np.testing.assert_array_equal(gisans_alone.SGrid, gisans_on_on.SGrid)
+
+    # A change of the angle or TOF parameters gives a new geometry
+    on_on.direct_pixel = 3.0
+    assert geometries.get(on_on) is not geometry
+    on_on.tof_edges = on_on.tof_edges + 100.0
+    assert geometries.get(on_on) is not geometry
+    assert len(geometries) == 2
+    assert geometries.get_memory_size() > 0
+    geometries.clear()
+    assert len(geometries) == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,8 +1,10 @@
 # local imports
 # third-party imports
+import numpy as np
 import pytest
 
 from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling import gisans
 from quicknxs.interfaces.data_manager import DataManager
 
 
@@ -26,3 +28,69 @@ def test_gisans(data_server):
     assert xs.QzGrid.max() == pytest.approx(0.16181, rel=rel_tol)
     assert xs.gisans_data.p_f.min() == pytest.approx(-0.10071, rel=rel_tol)
     assert xs.gisans_data.p_f.max() == pytest.approx(0.15554, rel=rel_tol)
+
+
+def test_q_coordinates(gisans_reduction_list):
+    """The Q coordinates are outer products of k with functions of the pixel position"""
+    data = gisans_reduction_list()[0].cross_sections["Off_Off"].gisans_data
+    k = data.k[np.newaxis, np.newaxis, :]
+    p_i = k * data.sin_ai[:, np.newaxis, np.newaxis]
+    p_f = k * data.sin_af[:, np.newaxis, np.newaxis]
+    assert data.Qy.shape == data.S.shape == (6, 5, 5)
+    np.testing.assert_array_equal(data.Qy, k * data.qy_factor[:, :, np.newaxis])
+    np.testing.assert_array_equal(data.Qz, np.broadcast_to(p_i + p_f, data.S.shape))
+    np.testing.assert_array_equal(data.p_f, np.broadcast_to(p_f, data.S.shape))
+    qy_rows, qz_rows, _ = data.q_coordinates(rows=slice(2, 4), selected=[0, 3])
+    np.testing.assert_array_equal(qy_rows, data.Qy[2:4][:, :, [0, 3]])
+    np.testing.assert_array_equal(qz_rows, data.Qz[2:4][:, :, [0, 3]])
+
+    # Preview grid
+    qy, qz = data.Qy.flatten(), data.Qz.flatten()
+    sgrid, qy_edges, qz_edges = np.histogram2d(qy, qz, bins=(50, 50), weights=data.S.flatten())
+    npoints, _, _ = np.histogram2d(qy, qz, bins=(50, 50))
+    sgrid[npoints > 0] /= npoints[npoints > 0]
+    np.testing.assert_array_equal(data.SGrid, sgrid.T)
+    np.testing.assert_array_equal(data.QyGrid[0], (qy_edges[:-1] + qy_edges[1:]) / 2.0)
+
+
+def test_merge(gisans_reduction_list):
+    reduction_list = gisans_reduction_list()
+    merged = gisans.merge(reduction_list, "Off_Off", wl_min=3.0, wl_max=6.0)
+    expected = [[] for _ in range(6)]
+    for item in reduction_list:
+        data = item.cross_sections["Off_Off"].gisans_data
+        selected = (data.wavelengths >= 3.0) & (data.wavelengths <= 6.0)
+        for i, array in enumerate([data.Qy, data.Qz, data.p_f, data.S, data.dS]):
+            expected[i].append(array[:, :, selected].flatten())
+        expected[5].append(np.broadcast_to(data.wavelengths[selected], data.Qy[:, :, selected].shape).flatten())
+    assert len(expected[0][0]) > 0 and len(expected[0][1]) > 0
+    for values, expected_values in zip(merged, expected):
+        np.testing.assert_array_equal(values, np.concatenate(expected_values))
+
+    merged = gisans.merge(reduction_list, "Off_Off", wl_min=3.0, wl_max=6.0, dtype=np.float32)
+    assert all(values.dtype == np.float32 for values in merged)
+
+
+@pytest.mark.parametrize("use_pf", [False, True])
+def test_rebin_extract(use_pf, monkeypatch, gisans_reduction_list):
+    """Rebinning chunk by chunk gives the same result as np.histogram2d over the merged data"""
+    # Compute the Q coordinates two detector rows at a time
+    monkeypatch.setattr(gisans, "CHUNK_POINTS", 20)
+    reduction_list = gisans_reduction_list()
+    qy, qz, pf, intensity, d_intensity, _ = gisans.merge(reduction_list, "Off_Off", wl_min=3.0, wl_max=6.0)
+    _z_axis = pf if use_pf else qz
+    n_points, qy_edges, qz_edges = np.histogram2d(qy, _z_axis, bins=(6, 5))
+    summed, _, _ = np.histogram2d(qy, _z_axis, bins=(qy_edges, qz_edges), weights=intensity)
+    err, _, _ = np.histogram2d(qy, _z_axis, bins=(qy_edges, qz_edges), weights=d_intensity**2)
+    summed[n_points > 0] /= n_points[n_points > 0]
+    err = np.sqrt(err)
+    err[n_points > 0] /= n_points[n_points > 0]
+    expected = [summed, (qy_edges[:-1] + qy_edges[1:]) / 2.0, (qz_edges[:-1] + qz_edges[1:]) / 2.0, err]
+
+    options = dict(wl_min=3.0, wl_max=6.0, qy_npts=5, qz_npts=4, use_pf=use_pf)
+    result = gisans.rebin_extract(reduction_list, "Off_Off", **options)
+    for values, expected_values in zip(result, expected):
+        np.testing.assert_array_equal(values, expected_values)
+    single_precision = gisans.rebin_extract(reduction_list, "Off_Off", dtype=np.float32, **options)
+    for values, expected_values in zip(single_precision, expected):
+        np.testing.assert_allclose(values, expected_values, rtol=1e-5)
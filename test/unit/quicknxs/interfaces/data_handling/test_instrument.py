@@ -2,12 +2,12 @@
 import pytest
 
 # 3rd party imports
-from mantid.api import MatrixWorkspaceProperty, PythonAlgorithm
+from mantid.api import MatrixWorkspaceProperty, PythonAlgorithm, mtd
 from mantid.kernel import Direction
-from mantid.simpleapi import CreateSingleValuedWorkspace
+from mantid.simpleapi import CloneWorkspace, CompareWorkspaces, CreateSingleValuedWorkspace, Plus
 
 from quicknxs.interfaces.configuration import Configuration
-from quicknxs.interfaces.data_handling.instrument import mantid_algorithm_exec
+from quicknxs.interfaces.data_handling.instrument import Instrument, mantid_algorithm_exec
 
 
 @pytest.mark.datarepo
@@ -34,6 +34,19 @@ def test_load_data_deadtime(data_server):
         assert ws.extractY().sum() == ws.getNumberEvents()
 
 
+@pytest.mark.datarepo
+def test_load_data_deadtime_workspaces(data_server):
+    """Test that the temporary workspaces of the dead-time correction are removed after loading"""
+    conf = Configuration()
+    conf.apply_deadtime = True
+    names_before = set(mtd.getObjectNames())
+    file_path = "+".join(data_server.path_to(run) for run in ["REF_M_42112", "REF_M_42113"])
+    for _ in range(2):  # repeated loads must not accumulate workspaces
+        conf.instrument.load_data(file_path, conf)
+    new_names = set(mtd.getObjectNames()) - names_before
+    assert not [name for name in new_names if "_err" in name or name.endswith(("_corr", "_sc", "_errors"))]
+
+
 def test_mantid_algorithm_exec():
     """Test helper function mantid_algorithm_exec"""
 
@@ -84,3 +97,30 @@ def test_load_data_nbr_events_min(data_server):
     conf.apply_deadtime = True
     ws_list = conf.instrument.load_data(file_path, conf)
     assert len(ws_list) == 2
+
+
+@pytest.mark.datarepo
+def test_load_data_composite(data_server):
+    """Test that adding runs together gives the same cross-sections as summing the runs one after the other"""
+    conf = Configuration()
+    runs = ["REF_M_42100", "REF_M_42112", "REF_M_42113", "REF_M_42116"]
+
+    # Sum the runs one after the other
+    expected = {}
+    for run in runs:
+        for ws in conf.instrument.load_data(data_server.path_to(run), conf):
+            xs_name = ws.getRun()["cross_section_id"].value
+            if xs_name in expected:
+                Plus(LHSWorkspace=expected[xs_name], RHSWorkspace=ws, OutputWorkspace=expected[xs_name])
+            else:
+                expected[xs_name] = str(CloneWorkspace(ws, OutputWorkspace="expected_%s" % xs_name))
+
+    file_path = "+".join(data_server.path_to(run) for run in runs)
+    for max_load_workers in [1, Instrument.MAX_LOAD_WORKERS]:
+        conf.instrument.MAX_LOAD_WORKERS = max_load_workers
+        ws_list = conf.instrument.load_data(file_path, conf)
+        assert len(ws_list) == len(expected)
+        for ws in ws_list:
+            assert ws.getRun()["run_numbers"].value == "42100+42112:42113+42116"
+            result, _ = CompareWorkspaces(ws, expected[ws.getRun()["cross_section_id"].value], CheckSample=False)
+            assert result
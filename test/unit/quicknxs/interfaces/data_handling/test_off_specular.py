@@ -1,8 +1,14 @@
 # local imports
+# standard imports
+from types import SimpleNamespace
+
 # third-party imports
+import numpy as np
 import pytest
+import scipy.stats
 
 from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling import off_specular
 from quicknxs.interfaces.data_manager import DataManager
 
 
@@ -28,3 +34,118 @@ def test_off_specular(data_server):
     assert xs.off_spec.kf_z.max() == pytest.approx(0.15391, rel=rel_tol)
     assert xs.off_spec.ki_z.min() == pytest.approx(0.0023673, rel=rel_tol)
     assert xs.off_spec.ki_z.max() == pytest.approx(0.0091347, rel=rel_tol)
+
+
+@pytest.mark.parametrize("axis_sigma_scaling", [None, 1, 2, 3])
+def test_smooth_data_kdtree(axis_sigma_scaling):
+    """The KD-tree smoothing gives the same result as the brute-force grid scan"""
+    rng = np.random.default_rng(42)
+    x = rng.uniform(-0.03, 0.03, 5000)
+    y = rng.uniform(0.0, 0.1, 5000)
+    intensity = rng.exponential(1.0, 5000)
+    x[10] = np.nan
+    options = dict(gridx=40, gridy=20, sigmax=0.001, sigmay=0.002, axis_sigma_scaling=axis_sigma_scaling, xysigma0=0.05)
+    with np.errstate(over="ignore", invalid="ignore"):
+        x_ref, y_ref, reference = off_specular._smooth_data(x, y, intensity, indices=[0, 40], **options)
+        x_out, y_out, smoothed = off_specular.smooth_data_kdtree(x, y, intensity, **options)
+    np.testing.assert_array_equal(x_out, x_ref)
+    np.testing.assert_array_equal(y_out, y_ref)
+    np.testing.assert_allclose(smoothed, reference, rtol=1e-12, atol=0)
+
+
+def _offspec_reduction_list(rng, pol_states):
+    """Reduction list with random off-specular data, sharing the geometry across cross-sections"""
+    shape = (30, 40)
+    qx = rng.uniform(-0.02, 0.02, shape)
+    qz = rng.uniform(0.0, 0.12, shape)
+    # Points on the upper edges of the binning range
+    qx[0, :3] = 0.015
+    qz[1, :3] = 0.1
+    geometry = SimpleNamespace(key=(qx[0, 5], qz[0, 5]), binned_grids={})
+    cross_sections = {}
+    for pol_state in pol_states:
+        off_spec = SimpleNamespace(
+            Qx=qx,
+            Qz=qz,
+            ki_z=rng.uniform(0, 0.01, shape),
+            kf_z=rng.uniform(-0.1, 0.1, shape),
+            S=rng.exponential(1.0, shape),
+            dS=rng.uniform(0.05, 0.2, shape),
+            geometry=geometry,
+            area_x=(0, shape[0]),
+        )
+        configuration = SimpleNamespace(cut_first_n_points=2, cut_last_n_points=3)
+        cross_sections[pol_state] = SimpleNamespace(off_spec=off_spec, configuration=configuration)
+    return [SimpleNamespace(cross_sections=cross_sections)]
+
+
+@pytest.mark.parametrize("use_weights", [True, False])
+def test_rebin_extract(use_weights):
+    """The single-pass rebinning gives the same result as scipy.stats.binned_statistic_2d"""
+    reduction_list = _offspec_reduction_list(np.random.default_rng(42), ["Off_Off", "On_Off"])
+    options = dict(axes=Configuration.QX_VS_QZ, n_bins_x=35, n_bins_y=25, x_min=-0.015, x_max=0.015, y_min=0, y_max=0.1)
+    geometry = reduction_list[0].cross_sections["Off_Off"].off_spec.geometry
+    grids = []
+    for pol_state in ["Off_Off", "On_Off"]:
+        result, error, x, y, labels = off_specular.rebin_extract(
+            reduction_list, pol_state, use_weights=use_weights, **options
+        )
+        grids.append(list(geometry.binned_grids.values())[-1])
+
+        qx, qz, _, _, _, S, dS = off_specular.merge(reduction_list, pol_state)
+        binning = dict(range=[[-0.015, 0.015], [0, 0.1]], bins=[35, 25])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if use_weights:
+                statistic, x_edge, y_edge, _ = scipy.stats.binned_statistic_2d(qx, qz, S / dS**2, "sum", **binning)
+                weights, _, _, _ = scipy.stats.binned_statistic_2d(qx, qz, 1 / dS**2, "sum", **binning)
+                expected = (statistic / weights).T
+                expected_error = np.sqrt(1.0 / weights).T
+            else:
+                statistic, x_edge, y_edge, _ = scipy.stats.binned_statistic_2d(qx, qz, S, "mean", **binning)
+                weights, _, _, _ = scipy.stats.binned_statistic_2d(qx, qz, dS**2, "sum", **binning)
+                counts, _, _, _ = scipy.stats.binned_statistic_2d(qx, qz, np.ones(len(qx)), "sum", **binning)
+                expected = statistic.T
+                expected_error = (np.sqrt(weights) / counts).T
+        assert labels == ["Qx", "Qz"]
+        np.testing.assert_array_equal(result, np.nan_to_num(expected))
+        np.testing.assert_array_equal(error, np.nan_to_num(expected_error))
+        np.testing.assert_array_equal(x, x_edge[:-1] + (x_edge[1] - x_edge[0]) / 2.0)
+        np.testing.assert_array_equal(y, y_edge[:-1] + (y_edge[1] - y_edge[0]) / 2.0)
+    # The bin assignment is computed once for both cross-sections, and kept by their geometry
+    assert grids[0] is grids[1]
+    assert len(geometry.binned_grids) == 1
+    off_specular.rebin_extract(reduction_list, "Off_Off", **dict(options, n_bins_x=20))
+    assert len(geometry.binned_grids) == 2
+
+
+def test_merge():
+    reduction_list = _offspec_reduction_list(np.random.default_rng(42), ["Off_Off"])
+    reduction_list += _offspec_reduction_list(np.random.default_rng(43), ["Off_Off"])
+    merged = off_specular.merge(reduction_list, "Off_Off")
+    expected = [[] for _ in range(6)]
+    for item in reduction_list:
+        off_spec = item.cross_sections["Off_Off"].off_spec
+        for i, array in enumerate([off_spec.Qx, off_spec.Qz, off_spec.ki_z, off_spec.kf_z, off_spec.S, off_spec.dS]):
+            expected[i].append(np.ravel(array[:, 2:-3]))
+    qx, qz, ki_z, kf_z, s, ds = [np.concatenate(values) for values in expected]
+    for values, expected_values in zip(merged, [qx, qz, ki_z, kf_z, ki_z - kf_z, s, ds]):
+        np.testing.assert_array_equal(values, expected_values)
+    # Each run, as one chunk
+    chunks = list(off_specular.iter_merge(reduction_list, "Off_Off", dtype=np.float32))
+    assert len(chunks) == 2
+    assert all(values.dtype == np.float32 for values in chunks[0])
+    np.testing.assert_array_equal(np.concatenate([chunk[0] for chunk in chunks]), qx.astype(np.float32))
+
+
+@pytest.mark.parametrize("use_weights", [True, False])
+def test_rebin_extract_chunked(use_weights):
+    reduction_list = _offspec_reduction_list(np.random.default_rng(42), ["Off_Off"])
+    reduction_list += _offspec_reduction_list(np.random.default_rng(43), ["Off_Off"])
+    options = dict(axes=Configuration.KZI_VS_KZF, use_weights=use_weights, n_bins_x=20, n_bins_y=30, y_min=-0.1)
+    expected = off_specular.rebin_extract(reduction_list, "Off_Off", **options)
+    chunked = off_specular.rebin_extract(reduction_list, "Off_Off", chunked=True, **options)
+    # The merged grid is kept by the geometry of the first run, the grid of each run by its own geometry
+    assert [len(item.cross_sections["Off_Off"].off_spec.geometry.binned_grids) for item in reduction_list] == [2, 1]
+    for values, expected_values in zip(chunked[:4], expected[:4]):
+        np.testing.assert_allclose(values, expected_values, rtol=1e-12)
+    assert chunked[4] == expected[4] == ["ki_z", "kf_z"]
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import scipy.signal
+
+from quicknxs.interfaces.data_handling import peak_finding
+
+
+def _signals(n_signals=20, size=304, seed=7):
+    """Noisy integer-valued signals, with flat maxima"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 6, (n_signals, size)).astype(float)
+
+
+def test_argmaxima1d():
+    x = np.array([0.0, 1.0, 1.0, 0.0, 2.0, 2.0, 2.0, 3.0, 1.0, 4.0, 4.0])
+    np.testing.assert_array_equal(peak_finding._argmaxima1d(x), [1, 7])
+    assert peak_finding._argmaxima1d(np.ones(2)).size == 0
+    for signal in _signals():
+        np.testing.assert_array_equal(peak_finding._argmaxima1d(signal), scipy.signal.find_peaks(signal)[0])
+
+
+def test_backport_matches_scipy():
+    for signal in _signals():
+        peaks, _ = peak_finding._backport_find_peaks(signal)
+        np.testing.assert_array_equal(peaks, scipy.signal.find_peaks(signal)[0])
+        for backport, reference in zip(
+            peak_finding._backport_peak_prominences(signal, peaks), scipy.signal.peak_prominences(signal, peaks)
+        ):
+            np.testing.assert_array_equal(backport, reference)
+        for backport, reference in zip(
+            peak_finding._backport_peak_widths(signal, peaks), scipy.signal.peak_widths(signal, peaks)
+        ):
+            np.testing.assert_allclose(backport, reference)
+
+
+def test_find_peaks_by_row():
+    signals = _signals()
+    results = peak_finding.find_peaks_by_row(signals)
+    assert len(results) == len(signals)
+    for signal, (peaks, prominences, widths) in zip(signals, results):
+        np.testing.assert_array_equal(peaks, peak_finding.find_peaks(signal)[0])
+        np.testing.assert_array_equal(prominences, peak_finding.peak_prominences(signal, peaks)[0])
+        np.testing.assert_array_equal(widths, peak_finding.peak_widths(signal, peaks)[0])
+
+    # A single signal is a batch of one
+    peaks, _, _ = peak_finding.find_peaks_by_row(signals[0])[0]
+    np.testing.assert_array_equal(peaks, results[0][0])
+    with pytest.raises(ValueError, match="two dimensions"):
+        peak_finding.find_peaks_by_row(np.zeros((2, 3, 4)))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
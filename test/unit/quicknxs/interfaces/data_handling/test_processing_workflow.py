@@ -0,0 +1,100 @@
+# standard imports
+import threading
+from types import SimpleNamespace
+
+# third party imports
+import numpy as np
+import pytest
+
+# quicknxs imports
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling import quicknxs_io
+from quicknxs.interfaces.data_handling.processing_workflow import DEFAULT_OPTIONS, ProcessingWorkflow
+from quicknxs.interfaces.data_handling.worker_pool import get_worker_pool, shutdown_worker_pool
+
+
+def _write_files(workflow, output_directory):
+    """Write a specular and an off-specular file through the workflow"""
+    rng = np.random.default_rng(42)
+    specular = rng.random((50, 5))
+    offspec = [rng.random((4, 3, 4)), rng.random((2, 3, 4))]
+    col_names = ["Qz [1/A]", "R [a.u.]", "dR [a.u.]", "dQz [1/A]", "theta [rad]"]
+    workflow._write_file(str(output_directory / "specular.dat"), "# header\n", specular, col_names, False)
+    workflow._write_file(str(output_directory / "offspec.dat"), None, offspec, col_names[:4], False)
+
+
+@pytest.fixture
+def two_workers(monkeypatch):
+    monkeypatch.setattr(Configuration, "worker_processes", 2)
+    monkeypatch.setattr(Configuration, "export_processes", 2)
+    yield
+    shutdown_worker_pool()
+
+
+def test_parallel_output_is_identical(two_workers, tmp_path):
+    serial_directory = tmp_path / "serial"
+    parallel_directory = tmp_path / "parallel"
+    serial_directory.mkdir()
+    parallel_directory.mkdir()
+
+    serial = ProcessingWorkflow(None)
+    _write_files(serial, serial_directory)
+    assert [description for description, _ in serial.timings] == serial.exported_data_files
+
+    parallel = ProcessingWorkflow(None)
+    parallel._pool = get_worker_pool()
+    _write_files(parallel, parallel_directory)
+    assert len(parallel._pending_files) == 2
+    parallel.wait_for_pending_files()
+    assert len(parallel.timings) == 3
+
+    for name in ["specular.dat", "offspec.dat"]:
+        assert (serial_directory / name).read_bytes() == (parallel_directory / name).read_bytes()
+    assert [str(parallel_directory / name) for name in ["specular.dat", "offspec.dat"]] == (
+        parallel.exported_data_files
+    )
+
+
+def test_map_cross_sections(monkeypatch):
+    monkeypatch.setattr(Configuration, "export_processes", 2)
+    # Both cross-sections have to be computed at the same time to get past the barrier
+    barrier = threading.Barrier(2, timeout=10)
+
+    def _compute(pol_state):
+        barrier.wait()
+        return pol_state.lower()
+
+    assert ProcessingWorkflow._map_cross_sections(_compute, ["Off_Off", "On_On"]) == ["off_off", "on_on"]
+    monkeypatch.setattr(Configuration, "export_processes", 0)
+    assert ProcessingWorkflow._map_cross_sections(str.lower, ["Off_Off", "On_On"]) == ["off_off", "on_on"]
+
+
+@pytest.mark.parametrize("format_hdf5", [False, True])
+def test_hdf5_replaces_ascii_output(format_hdf5, tmp_path, monkeypatch):
+    """With the HDF5 format, only the specular ASCII files are written with the HDF5 files"""
+    monkeypatch.setattr(quicknxs_io, "get_reflectivity_header", lambda *args: "# header\n")
+    cross_sections = {"Off_Off": SimpleNamespace(cross_section_label="Off_Off")}
+    data_manager = SimpleNamespace(
+        reduction_states=["Off_Off"],
+        reduction_list=[SimpleNamespace(cross_sections=cross_sections)],
+        peak_reduction_lists={},
+        active_reduction_list_index=0,
+        direct_beam_list=[],
+    )
+    workflow = ProcessingWorkflow(data_manager, dict(DEFAULT_OPTIONS, format_hdf5=format_hdf5))
+    rng = np.random.default_rng(42)
+    specular = dict(units=["1/A", "a.u.", "a.u.", "1/A"], columns=["Qz", "R", "dR", "dQz"], Off_Off=rng.random((5, 4)))
+    offspec = dict(specular, Off_Off=[rng.random((3, 2, 4))])
+    workflow.write_quicknxs(specular, str(tmp_path / "Specular_{state}.dat"), keep_ascii=True)
+    workflow.write_quicknxs(offspec, str(tmp_path / "OffSpec_{state}.dat"))
+
+    written = sorted(path.name for path in tmp_path.iterdir())
+    if format_hdf5:
+        assert written == ["OffSpec_all.h5", "Specular_Off_Off.dat", "Specular_all.h5"]
+    else:
+        assert written == ["OffSpec_Off_Off.dat", "Specular_Off_Off.dat"]
+    assert sorted(workflow.exported_data_files) == sorted(str(tmp_path / name) for name in written)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -10,8 +10,11 @@ import pytest
 from quicknxs.interfaces.configuration import Configuration
 from quicknxs.interfaces.data_handling.data_set import CrossSectionData, NexusData
 from quicknxs.interfaces.data_handling.quicknxs_io import (
+    ReducedHDF5File,
+    get_reflectivity_header,
     read_reduced_file,
     write_reflectivity_data,
+    write_reflectivity_hdf5,
     write_reflectivity_header,
 )
 
@@ -148,6 +151,73 @@ class TestDataWriter(object):
         assert len(data_list) == 2
         assert len(additional_peaks_list) == 2
 
+    def test_write_offspec_data(self, tmp_path):
+        """The 3D data is written as the original per-pixel np.savetxt loop wrote it"""
+        rng = np.random.default_rng(42)
+        values = np.concatenate(
+            [
+                rng.normal(size=700) * 10.0 ** rng.integers(-320, 309, 700),
+                10.0 ** np.arange(-300, 300, 7.0),
+                -np.nextafter(10.0 ** np.arange(-300, 300, 7.0), 0),
+                [9.9999995, 9.99999949999, 1.0000005, 1.5e-7, 2.5e-7, 123456.5, 1e100, -1e-100],
+                [0.0, -0.0, np.nan, np.inf, -np.inf, 5e-324, 1.7976931348623157e308],
+            ]
+        )
+        values = np.resize(values, 3 * 20 * 7)
+        data = [values.reshape((3, 20, 7)), rng.random((2, 5, 7)).astype(np.float32)]
+        col_names = ["Qx", "Qz", "ki_z", "kf_z", "ki_z-kf_z", "I", "dI"]
+        write_reflectivity_data(str(tmp_path / "offspec.dat"), data, col_names)
+
+        with open(tmp_path / "expected.dat", "w") as fd:
+            fd.write("# [Data]\n")
+            fd.write("# %s\n" % "\t".join(["%12s" % item for item in col_names[:4]]))
+            for run_item in data:
+                for pixel_item in run_item:
+                    np.savetxt(fd, pixel_item, delimiter="\t", fmt="%-18e")
+                    fd.write("\n")
+        assert (tmp_path / "offspec.dat").read_bytes() == (tmp_path / "expected.dat").read_bytes()
+
+    def test_write_hdf5(self, tmp_path, mock_nexus_data):
+        """The HDF5 file holds the data of each cross-section and the header needed to reload the session"""
+        col_names = ["Qz [1/A]", "R [a.u.]", "dR [a.u.]", "dQz [1/A]", "theta [rad]"]
+        rng = np.random.default_rng(42)
+        direct_beam_list = [mock_nexus_data(30001)]
+        peak_reduction_lists = {1: [mock_nexus_data(30002), mock_nexus_data(30003)]}
+        output_items = []
+        for pol_state in ["Off_Off", "On_Off"]:
+            header = get_reflectivity_header(peak_reduction_lists, 1, direct_beam_list, pol_state)
+            output_items.append((pol_state, header, rng.random((40, 5))))
+        offspec_data = [rng.random((3, 20, 7)), rng.random((2, 5, 7)).astype(np.float32)]
+        output_items.append(("Off_Off_offspec", None, offspec_data))
+        output_path = str(tmp_path / "REF_M_30002_all.h5")
+        write_reflectivity_hdf5(output_path, output_items, col_names)
+
+        with ReducedHDF5File(output_path) as reduced_file:
+            assert reduced_file.cross_sections == ["Off_Off", "On_Off", "Off_Off_offspec"]
+            assert reduced_file.columns == col_names
+            assert reduced_file.header() == output_items[0][1]
+            assert reduced_file.header("On_Off") == output_items[1][1]
+            # The datasets are read on access
+            dataset = reduced_file.get_datasets("On_Off")
+            np.testing.assert_array_equal(dataset[:, :3], output_items[1][2][:, :3])
+            offspec = reduced_file.load("Off_Off_offspec")
+            assert [item.dtype for item in offspec] == [np.float64, np.float32]
+            for item, expected in zip(offspec, offspec_data):
+                np.testing.assert_array_equal(item, expected)
+
+        # The session is restored as from the ASCII file
+        ascii_path = str(tmp_path / "REF_M_30002_Off_Off.dat")
+        with open(ascii_path, "w") as fd:
+            fd.write(output_items[0][1])
+        write_reflectivity_data(ascii_path, output_items[0][2], col_names)
+        db_list, data_list, _ = read_reduced_file(output_path)
+        expected_db_list, expected_data_list, _ = read_reduced_file(ascii_path)
+        assert [item[0] for item in db_list] == [item[0] for item in expected_db_list]
+        assert [item[0] for item in data_list] == [item[0] for item in expected_data_list]
+        assert [os.path.basename(item[1]) for item in data_list] == [
+            os.path.basename(item[1]) for item in expected_data_list
+        ]
+
 
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -0,0 +1,161 @@
+# standard imports
+import math
+
+# third party imports
+import numpy as np
+import pytest
+
+# quicknxs imports
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.cube_storage import SparseCube, sparse_cube
+from quicknxs.interfaces.data_handling.data_set import CrossSectionData
+from quicknxs.interfaces.data_handling.reflectivity_preview import (
+    constant_q_binning,
+    final_q_edges,
+    pixel_angles,
+    preview_reflectivity,
+    rebin_counts,
+    roi_signal,
+)
+from quicknxs.interfaces.data_manager import DataManager
+
+
+def _get_cross_section_data():
+    """Cross-section with a flat background of one count per bin and ten counts per bin in the peak"""
+    config = Configuration()
+    config.peak_position = 5
+    config.peak_width = 2
+    config.low_res_position = 2
+    config.low_res_width = 4
+    config.bck_position = 4
+    config.bck_width = 8
+    config.do_final_rebin = False
+    config.use_dangle = True
+    xs = CrossSectionData("Off_Off", config)
+    xs.data = np.ones((10, 4, 5))
+    xs.data[4:6, :, :] = 10.0
+    xs.raw_error = np.sqrt(xs.data)
+    xs.xtofdata = xs.data.sum(axis=1)
+    xs.tof_edges = np.linspace(10000.0, 30000.0, 6)
+    xs.proton_charge = 2.0
+    xs.dist_mod_det = 18.0
+    xs.dist_sam_det = 2.5
+    xs.pixel_width = 0.0007
+    xs.dangle = 1.2
+    xs.angle_offset = 0.0
+    xs.direct_pixel = 5.0
+    return xs
+
+
+def test_roi_signal():
+    xs = _get_cross_section_data()
+    conf = xs.configuration
+    signal, error = roi_signal(xs, conf.peak_roi, conf.low_res_roi, conf.bck_roi)
+    # 2 peak pixels x 4 low-res pixels x (10 counts - 1 background count), over a proton charge of 2
+    np.testing.assert_allclose(signal, 36.0)
+    # Variance of the mean background on each side of the peak: 4 * 4 / 4**2 on the left, 2 * 4 / 2**2 on the right
+    np.testing.assert_allclose(error, math.sqrt(80 + 2 * (1.0 + 2.0) / 4.0) / 2.0)
+    signal, _ = roi_signal(xs, conf.peak_roi, conf.low_res_roi, conf.bck_roi, subtract_background=False)
+    np.testing.assert_allclose(signal, 40.0)
+
+
+@pytest.mark.parametrize("scale", [1.0, 1.3])
+def test_roi_signal_sparse(scale, monkeypatch):
+    """Sparse cubes give the same signal as dense ones, without being converted to dense arrays"""
+    xs = _get_cross_section_data()
+    conf = xs.configuration
+    counts = np.random.default_rng(7).poisson(0.2, xs.data.shape) * scale
+    xs.data, xs.raw_error = counts, np.sqrt(counts)
+    expected = roi_signal(xs, conf.peak_roi, conf.low_res_roi, conf.bck_roi)
+    xs.data, xs.raw_error = sparse_cube(counts, np.sqrt(counts))
+
+    def _dense(*args, **kwargs):
+        raise AssertionError("Sparse cube converted to a dense array")
+
+    monkeypatch.setattr(SparseCube, "__array__", _dense)
+    for values, expected_values in zip(roi_signal(xs, conf.peak_roi, conf.low_res_roi, conf.bck_roi), expected):
+        np.testing.assert_allclose(values, expected_values, rtol=1e-12)
+
+
+def test_preview_normalized_by_itself():
+    xs = _get_cross_section_data()
+    q, r, dr = preview_reflectivity(xs, direct_beam=xs)
+    theta = 0.6 * math.pi / 180.0
+    assert np.all(np.diff(q) > 0)
+    np.testing.assert_allclose(r, 0.005 / math.sin(theta))
+    q_edges = 4.0 * math.pi * math.sin(theta) / (3.956034e-7 * np.array([30000.0, 26000.0]) * 1.0e4 / 18.0)
+    assert q[0] == pytest.approx(q_edges.mean())
+
+
+def test_preview_constant_q_normalized_by_itself():
+    xs = _get_cross_section_data()
+    xs.configuration.use_constant_q = True
+    xs.configuration.final_rebin_step = -0.01
+    q, r, _ = preview_reflectivity(xs, direct_beam=xs)
+    theta = 0.6 * math.pi / 180.0
+    assert np.all(np.diff(q) > 0)
+    assert r.count() > 0
+    # Each peak pixel holds half of the direct beam, and the bins average the pixels
+    np.testing.assert_allclose(r.compressed(), 0.005 / math.sin(theta))
+
+
+def test_pixel_angles():
+    xs = _get_cross_section_data()
+    conf = xs.configuration
+    angles = pixel_angles(xs, conf, 0.01, conf.peak_roi)
+    assert len(angles) == conf.peak_roi[1] - conf.peak_roi[0]
+    # The specular pixel is at the incident angle, and the angle decreases with the pixel index
+    offset = math.atan(0.0007 / 2.5) / 2.0
+    np.testing.assert_allclose(angles, 0.01 + offset * (conf.peak_position - np.arange(*conf.peak_roi)))
+
+
+def test_constant_q_binning():
+    q = np.array([0.0105, 0.0106, 0.0125, 0.0001])
+    r = np.array([1.0, 3.0, 5.0, 7.0])
+    edges, r_binned, dr_binned = constant_q_binning(q, r, np.ones(4), 0.001, n_pixels=2)
+    np.testing.assert_allclose(edges, [0.010, 0.011, 0.012, 0.013])
+    # Points are averaged in each bin, and scaled by the number of pixels; empty bins are trimmed
+    np.testing.assert_allclose(r_binned, [4.0, 0.0, 10.0])
+    np.testing.assert_allclose(dr_binned, [math.sqrt(2.0), 0.0, 2.0])
+
+
+def test_rebin():
+    signal, error = rebin_counts(np.array([0.0, 1.0, 2.0]), np.array([2.0, 4.0]), np.ones(2), np.array([0.5, 2.0]))
+    np.testing.assert_allclose(signal, [5.0])
+    edges = final_q_edges(0.01, 0.1, -0.01)
+    assert edges[0] <= 0.01 < edges[1]
+    assert edges[-2] < 0.1 <= edges[-1]
+    np.testing.assert_allclose(edges[1:] / edges[:-1], 1.01)
+
+
+@pytest.mark.datarepo
+@pytest.mark.parametrize("use_constant_q, median_tolerance, p90_tolerance", [(False, 0.01, 0.03), (True, 0.05, 0.15)])
+def test_preview_matches_mantid(use_constant_q, median_tolerance, p90_tolerance, data_server):
+    """The preview agrees with the reflectivity computed by Mantid"""
+    manager = DataManager(data_server.directory)
+    manager.load(data_server.path_to("REF_M_42100"), Configuration())
+    manager.add_active_to_normalization()
+    configuration = Configuration()
+    configuration.use_constant_q = use_constant_q
+    manager.load(data_server.path_to("REF_M_42112"), configuration)
+    assert manager.find_best_direct_beam()
+    manager.calculate_reflectivity()
+
+    xs = manager.active_channel
+    assert xs.configuration.use_constant_q == use_constant_q
+    q, r, _ = manager.preview_reflectivity(xs.configuration)
+
+    # Compare the points where Mantid has good statistics
+    mantid_q = np.asarray(xs.q)
+    mantid_r = np.ma.getdata(xs.r)
+    good = (mantid_r > 0) & (np.ma.getdata(xs.dr) < 0.1 * mantid_r)
+    good &= (mantid_q > q[0]) & (mantid_q < q[-1])
+    assert np.count_nonzero(good) > 10
+    preview_r = np.interp(mantid_q[good], q, np.ma.filled(r, 0))
+    deviation = np.abs(preview_r / mantid_r[good] - 1.0)
+    assert np.median(deviation) < median_tolerance
+    assert np.percentile(deviation, 90) < p90_tolerance
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,96 @@
+# standard imports
+import math
+import os
+
+# third party imports
+import h5py
+import mantid.simpleapi as api
+import numpy as np
+import pytest
+
+# quicknxs imports
+from quicknxs.interfaces.data_handling.instrument import Instrument
+from quicknxs.interfaces.data_handling.run_index import RunIndex, mid_q_value, read_run_logs
+
+
+def _write_run(file_path, lambda_request, dangle, data_type=0, slit_width=1.0):
+    """Write a minimal event file holding the DAS logs used by the index"""
+    logs = {
+        "LambdaRequest": ([lambda_request], "Angstrom"),
+        "DANGLE": ([dangle, dangle + 0.02], "degrees"),
+        "DANGLE0": ([0.0], "degrees"),
+        "data_type": ([data_type], ""),
+        "S1HWidth": ([slit_width], "mm"),
+        "S2HWidth": ([slit_width], "mm"),
+        "S3HWidth": ([slit_width], "mm"),
+    }
+    with h5py.File(file_path, "w") as nxs:
+        for name, (values, units) in logs.items():
+            dataset = nxs.create_dataset("entry/DASlogs/%s/value" % name, data=np.asarray(values, dtype=float))
+            dataset.attrs["units"] = units
+
+
+@pytest.fixture
+def data_directory(tmp_path):
+    _write_run(str(tmp_path / "REF_M_1.nxs.h5"), 5.0, 1.0)
+    _write_run(str(tmp_path / "REF_M_2.nxs.h5"), 5.0, 2.0)
+    _write_run(str(tmp_path / "REF_M_3.nxs.h5"), 5.0, 1.5)
+    _write_run(str(tmp_path / "REF_M_4.nxs.h5"), 5.0, 3.0)
+    _write_run(str(tmp_path / "REF_M_5.nxs.h5"), 5.0, 0.0, data_type=1)
+    _write_run(str(tmp_path / "REF_M_6.nxs.h5"), 8.0, 0.0, data_type=1)
+    return str(tmp_path)
+
+
+def test_read_run_logs(data_directory):
+    logs = read_run_logs(os.path.join(data_directory, "REF_M_2.nxs.h5"))
+    assert logs["LambdaRequest"] == [5.0, 5.0, "Angstrom"]
+    assert logs["DANGLE"][1] == pytest.approx(2.01)
+    # DANGLE units are not recognized, so degrees are assumed
+    assert mid_q_value(logs) == pytest.approx(4.0 * math.pi * math.sin(2.01 * math.pi / 360.0) / 5.0)
+
+
+def test_incremental_update(data_directory):
+    run_index = RunIndex()
+    file_path = os.path.join(data_directory, "REF_M_2.nxs.h5")
+    assert run_index.get_log_values(file_path, ["LambdaRequest", "NoLog"]) == {"LambdaRequest": 5.0}
+    run_index.update(data_directory)
+    # Modified file
+    _write_run(file_path, 6.0, 2.0)
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    run_index.refresh(data_directory)
+    assert run_index.get_log_values(file_path, ["LambdaRequest"]) == {"LambdaRequest": 6.0}
+    # Removed file
+    os.remove(file_path)
+    run_index.refresh(data_directory)
+    assert run_index.get_meta_data(file_path) is None
+
+
+def test_queries(data_directory):
+    run_index = RunIndex()
+    first_run = os.path.join(data_directory, "REF_M_1.nxs.h5")
+    meta_data = run_index.get_meta_data(first_run)
+    assert not meta_data.is_direct_beam
+    runs = run_index.increasing_q_runs(first_run, meta_data.mid_q, False)
+    assert [os.path.basename(path) for path in runs] == ["REF_M_2.nxs.h5", "REF_M_4.nxs.h5"]
+    assert run_index.increasing_q_runs(first_run, meta_data.mid_q, False, max_runs=1) == runs[:1]
+    direct_beams = run_index.direct_beams(data_directory, 5.0)
+    assert [os.path.basename(path) for path in direct_beams] == ["REF_M_5.nxs.h5"]
+    assert run_index.direct_beams(data_directory, 5.0, slit_widths=[1.0, 1.0, 1.0]) == direct_beams
+    assert run_index.direct_beams(data_directory, 5.0, slit_widths=[2.0, 1.0, 1.0]) == []
+
+
+@pytest.mark.datarepo
+def test_mid_q_matches_mantid(data_server):
+    run_index = RunIndex()
+    for run in ["REF_M_42112", "REF_M_42113", "REF_M_42116"]:
+        file_path = data_server.path_to(run)
+        ws = api.LoadEventNexus(file_path, MetaDataOnly=True, OutputWorkspace="meta_data")
+        meta_data = run_index.get_meta_data(file_path)
+        assert meta_data.mid_q == pytest.approx(Instrument.mid_q_value(ws), rel=1e-6)
+        assert meta_data.is_direct_beam == Instrument.check_direct_beam(ws)
+        api.DeleteWorkspace(ws)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,85 @@
+# third-party imports
+import mantid.simpleapi as api
+import numpy as np
+import pytest
+
+# quicknxs imports
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.session import configuration_from_json, configuration_to_json
+from quicknxs.interfaces.data_manager import DataManager
+
+
+def test_configuration_round_trip():
+    configuration = Configuration()
+    configuration.peak_roi = [120, 140]
+    configuration.scaling_factor = 1.5
+    configuration.normalization = 30001
+    configuration.tof_overwrite = np.linspace(10000.0, 40000.0, 11)
+    restored = configuration_from_json(configuration_to_json(configuration))
+    assert restored.peak_roi == [120, 140]
+    assert restored.scaling_factor == 1.5
+    assert restored.normalization == 30001
+    np.testing.assert_array_equal(restored.tof_overwrite, configuration.tof_overwrite)
+    assert configuration_to_json(restored) == configuration_to_json(configuration)
+
+
+@pytest.mark.datarepo
+def test_save_and_load_session(tmp_path, data_server):
+    """A restored session holds the same data, and only loads the events when a reduction needs them"""
+    manager = DataManager(data_server.directory)
+    manager.load(data_server.path_to("REF_M_42112"), Configuration())
+    manager.add_active_to_reduction()
+    manager._nexus_data.set_parameter("scaling_factor", 2.0)
+    manager.add_additional_reduction_list(2)
+    nexus_data = manager.main_reduction_list[0]
+    session_path = str(tmp_path / "reduction.session.h5")
+    manager.save_session(session_path)
+
+    # Start over, as in a new application session
+    workspace_names = set()
+    for item in [nexus_data] + manager.peak_reduction_lists[2]:
+        workspace_names.update(item.get_workspace_names())
+    for name in workspace_names:
+        if name in api.mtd:
+            api.DeleteWorkspace(name)
+    restored_manager = DataManager(data_server.directory)
+    restored_manager.load_session(session_path)
+
+    assert sorted(restored_manager.peak_reduction_lists) == [1, 2]
+    restored = restored_manager.main_reduction_list[0]
+    assert restored_manager.peak_reduction_lists[2][0] is not restored
+    assert restored_manager._cache == [restored]
+    assert restored.number == nexus_data.number
+    assert list(restored.cross_sections) == list(nexus_data.cross_sections)
+    for xs, cross_section in restored.cross_sections.items():
+        original = nexus_data.cross_sections[xs]
+        assert cross_section._event_workspace is None
+        assert cross_section.configuration.scaling_factor == 2.0
+        np.testing.assert_array_equal(cross_section.data, original.data)
+        np.testing.assert_array_equal(cross_section.q, original.q)
+        np.testing.assert_array_equal(cross_section.r, original.r)
+        assert cross_section.scattering_angle == original.scattering_angle
+        # The reflectivity workspace is restored on first use
+        np.testing.assert_array_equal(cross_section.reflectivity_workspace.readY(0), original.raw_r.data)
+        assert cross_section._event_workspace is None
+
+    # Reducing with the same parameters reuses the restored reflectivity, without loading the events
+    restored_manager._nexus_data = restored
+    restored_manager.calculate_reflectivity()
+    assert restored_manager.reflectivity_cache.hits == 1
+    for xs, cross_section in restored.cross_sections.items():
+        assert cross_section._event_workspace is None
+        np.testing.assert_array_equal(cross_section.q, nexus_data.cross_sections[xs].q)
+
+    # A new reduction loads the events
+    main_xs = restored.cross_sections[restored.main_cross_section]
+    restored.set_parameter("peak_roi", [main_xs.configuration.peak_roi[0] + 1, main_xs.configuration.peak_roi[1]])
+    restored_manager.calculate_reflectivity()
+    assert restored_manager.reflectivity_cache.misses == 1
+    for cross_section in restored.cross_sections.values():
+        assert cross_section.event_workspace is not None
+        assert cross_section.q is not None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
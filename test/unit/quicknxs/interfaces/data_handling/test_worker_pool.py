@@ -0,0 +1,80 @@
+# standard imports
+import multiprocessing
+
+# third party imports
+import numpy as np
+import pytest
+
+# quicknxs imports
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling import gisans, off_specular, worker_pool
+from quicknxs.interfaces.data_handling.worker_pool import (
+    SharedArrays,
+    attached_arrays,
+    can_start_workers,
+    get_worker_pool,
+    shutdown_worker_pool,
+)
+
+
+@pytest.fixture
+def two_workers(monkeypatch):
+    monkeypatch.setattr(Configuration, "worker_processes", 2)
+    yield
+    shutdown_worker_pool()
+
+
+def test_shared_arrays():
+    x = np.arange(12, dtype=float).reshape(3, 4)
+    index = np.arange(5, dtype=np.int32)
+    with SharedArrays(x=x, index=index) as descriptors:
+        with attached_arrays(descriptors) as arrays:
+            np.testing.assert_array_equal(arrays["x"], x)
+            np.testing.assert_array_equal(arrays["index"], index)
+            assert arrays["index"].dtype == np.int32
+            assert not arrays["x"].flags.writeable
+
+
+def test_worker_pool_is_reused(two_workers, monkeypatch):
+    pool = get_worker_pool()
+    assert pool is not None
+    assert get_worker_pool() is pool
+    # A new pool is started when the size changes
+    monkeypatch.setattr(Configuration, "worker_processes", 3)
+    assert get_worker_pool() is not pool
+    monkeypatch.setattr(Configuration, "worker_processes", 1)
+    assert get_worker_pool() is None
+    assert worker_pool._pool is None
+
+
+def test_no_pool_in_daemonic_workers(two_workers):
+    assert can_start_workers()
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        assert pool.apply(can_start_workers) is False
+
+
+def test_smooth_data_in_pool(two_workers, monkeypatch):
+    rng = np.random.default_rng(42)
+    x = rng.uniform(-0.03, 0.03, 2000)
+    y = rng.uniform(0.0, 0.1, 2000)
+    intensity = rng.exponential(1.0, 2000)
+    options = dict(gridx=30, gridy=11, sigmax=0.002, sigmay=0.005, axis_sigma_scaling=2, xysigma0=0.05)
+    _, _, reference = off_specular.smooth_data_kdtree(x, y, intensity, **options)
+    monkeypatch.setattr(off_specular, "PARALLEL_SMOOTHING_MIN_POINTS", 0)
+    x_out, y_out, smoothed = off_specular.smooth_data(x, y, intensity, pool=3, **options)
+    assert smoothed.shape == (11, 30)
+    np.testing.assert_array_equal(smoothed, reference)
+
+
+def test_rebin_parallel(two_workers, gisans_reduction_list):
+    reduction_list = gisans_reduction_list()
+    results = gisans.rebin_parallel(reduction_list, "Off_Off", 2.0, 8.0, wl_npts=3, qy_npts=5, qz_npts=4)
+    assert len(results) == 3
+    for i, result in enumerate(results):
+        expected = gisans.rebin_extract(reduction_list, "Off_Off", 2.0 + 2 * i, 4.0 + 2 * i, qy_npts=5, qz_npts=4)
+        for values, expected_values in zip(result, expected):
+            np.testing.assert_array_equal(values, expected_values)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -3,6 +3,7 @@
 import os
 import sys
 
+import mantid.simpleapi as api
 import numpy as np
 import pytest
 from PyQt5.QtCore import QTimer
@@ -210,6 +211,42 @@ def test_reload_all_files_two_data_tabs(qtbot):
     assert data_manager._nexus_data == data_manager.reduction_list[selected_row]
 
 
+@pytest.mark.datarepo
+def test_open_file_in_background(qtbot, data_server, monkeypatch):
+    """Test loading files in a worker thread"""
+    monkeypatch.setattr(MainHandler, "BACKGROUND_LOADING", True)
+    main_window = MainWindow()
+    handler = main_window.file_handler
+    data_manager = main_window.data_manager
+    qtbot.addWidget(main_window)
+
+    # A cancelled file is never applied
+    handler.open_file(data_server.path_to("REF_M_42112"))
+    assert handler.is_loading()
+    handler.cancel_loading(wait=True)
+    assert not handler.is_loading()
+    qtbot.wait(100)
+    assert data_manager.current_file is None
+
+    # The data manager is updated once loading is complete
+    handler.open_file(data_server.path_to("REF_M_42113"))
+    assert data_manager.current_file is None
+    qtbot.waitUntil(lambda: not handler.is_loading(), timeout=60000)
+    assert data_manager.current_file == data_server.path_to("REF_M_42113")
+    assert data_manager.get_cachesize() == 1
+    assert data_manager.active_channel.xtofdata is not None
+
+    # A file opened while another one loads is loaded once the cancelled worker has stopped
+    handler.open_file(data_server.path_to("REF_M_42112"))
+    cancelled = handler._loading_worker
+    handler.open_file(data_server.path_to("REF_M_42112"), force=True)
+    qtbot.waitUntil(lambda: not handler.is_loading(), timeout=60000)
+    assert cancelled.isFinished()
+    assert data_manager.current_file == data_server.path_to("REF_M_42112")
+    # Temporary workspaces are not shared between loads
+    assert all(name not in api.mtd for name in ["binning_ws", "data_rebinned", "_integrated"])
+
+
 def _get_nexus_data():
     """Data for testing"""
     config = Configuration()
@@ -0,0 +1,54 @@
+# standard imports
+import os
+
+# third party imports
+import pytest
+
+# quicknxs imports
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_manager import DataManager
+from quicknxs.interfaces.event_handlers.run_prefetcher import RunPrefetcher
+
+
+@pytest.fixture
+def data_manager(tmp_path):
+    for run in range(42110, 42116):
+        (tmp_path / ("REF_M_%d.nxs.h5" % run)).write_bytes(b"")
+    manager = DataManager(str(tmp_path))
+    manager.current_file_name = "REF_M_42112.nxs.h5"
+    return manager
+
+
+def test_neighbour_files(data_manager):
+    prefetcher = RunPrefetcher(data_manager)
+    neighbours = [os.path.basename(path) for path in prefetcher.neighbour_files(3)]
+    assert neighbours == [
+        "REF_M_42113.nxs.h5",
+        "REF_M_42111.nxs.h5",
+        "REF_M_42114.nxs.h5",
+        "REF_M_42110.nxs.h5",
+        "REF_M_42115.nxs.h5",
+    ]
+    data_manager.current_file_name = "REF_M_1.nxs.h5"
+    assert prefetcher.neighbour_files(3) == []
+
+
+def test_prefetch_disabled(data_manager):
+    configuration = Configuration()
+    configuration.prefetch_runs = 0
+    prefetcher = RunPrefetcher(data_manager)
+    prefetcher.prefetch(configuration)
+    assert not prefetcher.is_prefetching()
+
+
+def test_prefetch_memory_budget(data_manager):
+    configuration = Configuration()
+    configuration.prefetch_runs = 2
+    configuration.cache_memory_budget = 0.0
+    prefetcher = RunPrefetcher(data_manager)
+    prefetcher.prefetch(configuration)
+    assert not prefetcher.is_prefetching()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
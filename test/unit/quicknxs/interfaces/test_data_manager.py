@@ -1,5 +1,7 @@
 # local imports
 # 3rd-party imports
+import mantid.simpleapi as api
+import numpy as np
 import pytest
 
 import quicknxs.interfaces.data_handling.data_manipulation as dm
@@ -93,6 +95,67 @@ class TestDataManagerTest(object):
         manager.clear_cached_unused_data()
         assert manager.get_cachesize() == 3
 
+    @pytest.mark.datarepo
+    def test_cache_memory_budget(self, data_server):
+        """Test least-recently-used eviction of cached data within the memory budget"""
+        manager = DataManager(data_server.directory)
+        configuration = Configuration()
+        manager.load(data_server.path_to("REF_M_42112"), configuration)
+        manager.add_active_to_reduction()
+        in_reduction = manager._nexus_data
+        manager.load(data_server.path_to("REF_M_42113"), configuration)
+        unused = manager._nexus_data
+        unused_workspaces = unused.get_workspace_names()
+        assert manager.get_cache_memory_size() > 0
+        # Loading again from the cache makes the data set the most recently used
+        assert manager.load(data_server.path_to("REF_M_42112"), configuration)
+        assert manager._cache == [unused, in_reduction]
+        # Data sets in the reduction list and the active data set are kept
+        configuration.cache_memory_budget = 0
+        manager.load(data_server.path_to("REF_M_42116"), configuration)
+        assert manager.get_cachesize() == 2
+        assert unused not in manager._cache
+        assert all(name not in api.mtd for name in unused_workspaces)
+        assert all(xs.event_workspace is not None for xs in in_reduction.cross_sections.values())
+
+    @pytest.mark.datarepo
+    def test_reflectivity_cache(self, data_server):
+        """Test that the reduction is only run again when its inputs change"""
+        manager = DataManager(data_server.directory)
+        manager.load(data_server.path_to("REF_M_42112"), Configuration())
+        cache = manager.reflectivity_cache
+        assert (cache.hits, cache.misses) == (0, 1)
+        xs = manager.active_channel
+        q, r = xs.q.copy(), xs.raw_r.copy()
+        # Scaling is applied after the reduction
+        manager._nexus_data.set_parameter("scaling_factor", 2.0)
+        manager.calculate_reflectivity()
+        assert (cache.hits, cache.misses) == (1, 1)
+        np.testing.assert_array_equal(xs.q, q)
+        np.testing.assert_array_equal(xs.raw_r, r)
+        # Changing the region of interest requires a new reduction
+        manager._nexus_data.set_parameter("peak_roi", [xs.configuration.peak_roi[0] + 1, xs.configuration.peak_roi[1]])
+        manager.calculate_reflectivity()
+        assert (cache.hits, cache.misses) == (1, 2)
+        # The result is not reused once its workspaces are deleted
+        api.DeleteWorkspace(xs._reflectivity_workspace)
+        manager.calculate_reflectivity()
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    @pytest.mark.datarepo
+    def test_read_data(self, data_server):
+        """Test that loading data for a worker thread leaves the data manager unchanged"""
+        manager = DataManager(data_server.directory)
+        manager.load(data_server.path_to("REF_M_42112"), Configuration())
+        direct_beam = manager._nexus_data
+        manager.add_active_to_normalization()
+        cache = manager.reflectivity_cache
+        cache_state = (len(cache), cache.hits, cache.misses)
+        nexus_data = manager.read_data(data_server.path_to("REF_M_42113"), Configuration(), [direct_beam], "2")
+        assert manager.get_cachesize() == 1 and manager._nexus_data is direct_beam
+        assert (len(cache), cache.hits, cache.misses) == cache_state
+        assert nexus_data.file_path == data_server.path_to("REF_M_42113")
+
     @pytest.mark.datarepo
     def test_add_additional_reduction_list(self, data_server):
         manager = DataManager(data_server.directory)
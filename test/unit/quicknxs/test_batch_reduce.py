@@ -0,0 +1,82 @@
+# standard imports
+import os
+import subprocess
+import sys
+
+# third party imports
+import pytest
+
+# quicknxs imports
+from quicknxs.batch_reduce import find_reduced_files, main, summarize
+from quicknxs.interfaces.configuration import Configuration
+from quicknxs.interfaces.data_handling.processing_workflow import DEFAULT_OPTIONS, ProcessingWorkflow
+from quicknxs.interfaces.data_manager import DataManager
+
+HEADER = """# Datafile created by QuickNXS 4.0.0
+# Datafile created using Mantid 6.10.0
+# Date: {date}
+# Type: Specular
+# Input file indices: {runs}
+# Extracted states: {state}
+#
+# [Data Runs]
+# [Data]
+0.01 1.0 0.1 0.001
+"""
+
+
+def test_find_reduced_files(tmp_path):
+    (tmp_path / "REF_M_1_Specular_Off_Off.dat").write_text(HEADER.format(date="1", runs="1", state="Off_Off"))
+    (tmp_path / "REF_M_1_Specular_On_Off.dat").write_text(HEADER.format(date="2", runs="1", state="On_Off"))
+    (tmp_path / "REF_M_2_Specular_Off_Off.dat").write_text(HEADER.format(date="1", runs="2", state="Off_Off"))
+    (tmp_path / "notes.dat").write_text("1 2 3\n")
+    reduced_files = find_reduced_files([str(tmp_path)])
+    # One template per reduction, whatever the number of cross-sections
+    assert reduced_files == [
+        str(tmp_path / "REF_M_1_Specular_Off_Off.dat"),
+        str(tmp_path / "REF_M_2_Specular_Off_Off.dat"),
+    ]
+
+
+def test_summarize():
+    results = [
+        dict(file_path="a.dat", n_runs=4, times=dict(load=10.0, specular=2.0, total=12.0), error=None),
+        dict(file_path="b.dat", n_runs=2, times=dict(load=6.0, specular=4.0, total=10.0), error=None),
+        dict(file_path="c.dat", n_runs=0, times=dict(total=1.0), error="No data could be loaded"),
+    ]
+    summary = summarize(results, 30.0).splitlines()
+    assert summary[0] == "Reduced 2 of 3 templates (6 runs) in 30.0 sec: 12.00 runs/min"
+    assert summary[1].split() == ["load:", "mean", "8.00", "sec", "total", "16.00", "sec"]
+    assert summary[-1] == "  FAILED c.dat: No data could be loaded"
+
+
+def test_no_qt_import():
+    """The batch reducer must run on nodes without a display or Qt"""
+    code = "import sys, quicknxs.batch_reduce; print(any(m.startswith('PyQt5') for m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "False"
+
+
+@pytest.mark.datarepo
+def test_parallel_gisans(data_server, tmp_path):
+    """GISANS templates reduced concurrently: the reduction workers cannot start a worker pool of their own"""
+    template_directory = tmp_path / "templates"
+    output_directory = tmp_path / "output"
+    template_directory.mkdir()
+    for run in ["REF_M_42112", "REF_M_42113"]:
+        manager = DataManager(data_server.directory)
+        manager.load(data_server.path_to("REF_M_42100"), Configuration())
+        manager.add_active_to_normalization()
+        manager.load(data_server.path_to(run), Configuration())
+        manager.add_active_to_reduction()
+        options = dict(DEFAULT_OPTIONS, format_mantid=False, output_directory=str(template_directory))
+        ProcessingWorkflow(manager, options).execute()
+
+    argv = [str(template_directory), "-o", str(output_directory), "-j", "2", "--gisans", "--no-script"]
+    assert main(argv) == 0
+    gisans_files = [name for name in os.listdir(output_directory) if "_GISANS_" in name]
+    assert len(gisans_files) > 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])